@@ -1,13 +1,22 @@
 import logging
+from datetime import datetime
 from telegram import Update
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters
 from config import Config
-from database import init_db, get_db
+from database import init_db, get_session, UnitOfWork
 from utils.keyboards import Keyboards
 from utils.helpers import Helpers
-from modules.user_manager import UserManager
-from modules.plan_manager import PlanManager
-from modules.hidify_api import HiddifyAPI
+from utils.callback_router import CallbackRouter
+from modules.user_manager import UserManager, UserIdentityCache, UserLoader
+from modules.plan_manager import PlanManager, PlanCache
+from modules.panel_registry import PanelRegistry
+from modules.webhook_server import WebhookServer
+from modules.update_processor import PerUserUpdateProcessor
+from modules.bot_identity import BotIdentity
+from modules.rollup_manager import RollupManager
+from modules.wallet import WalletManager
+from modules.state_store import create_state_store
+from utils.background import PeriodicTask
 
 # تنظیمات لاگ
 logging.basicConfig(
@@ -18,10 +27,25 @@ logger = logging.getLogger(__name__)
 
 class HiddyShopBot:
     def __init__(self):
-        self.app = Application.builder().token(Config.BOT_TOKEN).build()
-        self.hiddify_api = HiddifyAPI()
+        self.update_processor = PerUserUpdateProcessor(Config.UPDATE_CONCURRENCY, unit_of_work=UnitOfWork)
+        self.app = (
+            Application.builder()
+            .token(Config.BOT_TOKEN)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .concurrent_updates(self.update_processor)
+            .build()
+        )
+        self.panels = PanelRegistry.from_config()  # هر نود آینه محلی خودش را دارد
+        self.identity = BotIdentity(self.app.bot)
+        self.rollups = PeriodicTask("rollups", Config.ROLLUP_REFRESH_INTERVAL, RollupManager.refresh_all)
+        self.wallet_snapshots = PeriodicTask(
+            "wallet_snapshots", Config.WALLET_SNAPSHOT_INTERVAL, WalletManager.snapshot_all
+        )
+        self.states = create_state_store()  # وضعیت گفتگوی کاربران
+        self.state_purge = PeriodicTask("state_purge", Config.STATE_PURGE_INTERVAL, self.states.purge)
+        self.setup_routes()
         self.setup_handlers()
-        self.user_states = {}  # برای مدیریت وضعیت کاربران
     
     def setup_handlers(self):
         """تنظیم هندلرهای ربات"""
@@ -30,6 +54,9 @@ class HiddyShopBot:
         self.app.add_handler(CommandHandler("help", self.help_command))
         self.app.add_handler(CommandHandler("admin", self.admin_command))
         
+        # خطای هندلرها: تغییرات دیتابیس همان آپدیت rollback می‌شود
+        self.app.add_error_handler(self.error_handler)
+        
         # کالبک‌های دکمه‌ها
         self.app.add_handler(CallbackQueryHandler(self.button_handler))
         
@@ -43,15 +70,14 @@ class HiddyShopBot:
             chat_id = update.effective_chat.id
             
             # ایجاد کاربر در دیتابیس
-            async for db in get_db():
-                user_manager = UserManager(db)
-                db_user = await user_manager.create_user(
-                    telegram_id=user.id,
-                    first_name=user.first_name,
-                    last_name=user.last_name,
-                    username=user.username
-                )
-                break
+            db = await get_session()
+            user_manager = UserManager(db)
+            await user_manager.ensure_user(
+                telegram_id=user.id,
+                first_name=user.first_name,
+                last_name=user.last_name,
+                username=user.username
+            )
             
             # بررسی رفرال
             if context.args:
@@ -71,6 +97,7 @@ class HiddyShopBot:
                 reply_markup=keyboard
             )
         except Exception as e:
+            UnitOfWork.mark_failed()
             logger.error(f"Error in start_command: {e}")
             await update.message.reply_text("❌ خطایی رخ داده است!")
     
@@ -100,93 +127,83 @@ class HiddyShopBot:
             reply_markup=keyboard
         )
     
+    def setup_routes(self):
+        """ثبت مسیرهای کالبک دکمه‌ها"""
+        self.router = CallbackRouter()
+        admin_only = self.admin_only
+        
+        # منوی اصلی
+        self.router.add("main_menu", self.show_main_menu)
+        
+        # فروشگاه
+        self.router.add("shop", self.show_shop_menu)
+        self.router.add("plans_list", self.show_plans_list)
+        self.router.add("plan_{plan_id:int}", self.show_plan_details)
+        self.router.add("buy_plan_{plan_id:int}", self.buy_plan)
+        
+        # کیف پول، رفرال، پروفایل
+        self.router.add("wallet", self.show_wallet_info)
+        self.router.add("referral", self.show_referral_info)
+        self.router.add("profile", self.show_profile_info)
+        
+        # درخواست نمایندگی
+        self.router.add("agent_request", self.show_agent_request_form)
+        self.router.add("submit_agent_request", self.start_agent_request_process)
+        
+        # پنل ادمین
+        self.router.add("admin_panel", admin_only(self.show_admin_panel))
+        self.router.add("admin_users", admin_only(self.show_admin_users))
+        self.router.add("admin_plans", admin_only(self.show_admin_plans))
+        self.router.add("admin_payments", admin_only(self.show_admin_payments))
+        self.router.add("admin_stats", admin_only(self.show_admin_stats))
+        self.router.add("admin_backup", admin_only(self.show_admin_backup))
+        self.router.add("admin_discount", admin_only(self.show_admin_discount))
+        self.router.add("admin_agent_requests", admin_only(self.show_admin_agent_requests))
+        
+        # صفحه‌بندی ادمین (cursor صفحه بعد همیشه آخرین پارامتر است)
+        self.router.add("admin_users_page_{page:int}_{cursor}", admin_only(self.show_admin_users))
+        self.router.add("admin_payments_{status}", admin_only(self.show_admin_payments))
+        self.router.add("admin_payments_page_{page:int}_{status}_{cursor}", admin_only(self.show_admin_payments))
+        self.router.add("admin_discounts_page_{page:int}_{cursor}", admin_only(self.show_admin_discount))
+        self.router.add("admin_agent_requests_page_{page:int}_{cursor}", admin_only(self.show_admin_agent_requests))
+        self.router.add("verify_payment_{payment_id:int}_{result}", admin_only(self.verify_payment))
+        
+        # بازگشت‌ها
+        self.router.add("back_to_shop", self.show_shop_menu)
+        self.router.add("back_to_admin", admin_only(self.show_admin_panel))
+    
+    def admin_only(self, handler):
+        """محدود کردن هندلر کالبک به ادمین"""
+        async def wrapper(query, **params):
+            if query.from_user.id != Config.ADMIN_ID:
+                await query.answer("❌ دسترسی مجاز نیست!")
+                return
+            await handler(query, **params)
+        return wrapper
+    
     async def button_handler(self, update: Update, context):
         """مدیریت کلیک دکمه‌ها"""
         query = update.callback_query
         await query.answer()
-        data = query.data
-        user_id = query.from_user.id
         
         try:
-            # منوی اصلی
-            if data == "main_menu":
-                is_admin = user_id == Config.ADMIN_ID
-                keyboard = Keyboards.main_menu(is_admin=is_admin)
-                await query.edit_message_text(
-                    "منوی اصلی:",
-                    reply_markup=keyboard
-                )
-            
-            # فروشگاه
-            elif data == "shop":
-                await self.show_shop_menu(query)
-            elif data == "plans_list":
-                await self.show_plans_list(query)
-            elif data.startswith("plan_"):
-                plan_id = int(data.split("_")[1])
-                await self.show_plan_details(query, plan_id)
-            
-            # کیف پول
-            elif data == "wallet":
-                await self.show_wallet_info(query)
-            
-            # رفرال
-            elif data == "referral":
-                await self.show_referral_info(query)
-            
-            # پروفایل
-            elif data == "profile":
-                await self.show_profile_info(query)
-            
-            # درخواست نمایندگی
-            elif data == "agent_request":
-                await self.show_agent_request_form(query)
-            
-            # پنل ادمین
-            elif data == "admin_panel":
-                if user_id == Config.ADMIN_ID:
-                    await self.show_admin_panel(query)
-                else:
-                    await query.answer("❌ دسترسی مجاز نیست!")
-            
-            # بخش‌های ادمین
-            elif data == "admin_users":
-                await self.show_admin_users(query)
-            elif data == "admin_plans":
-                await self.show_admin_plans(query)
-            elif data == "admin_payments":
-                await self.show_admin_payments(query)
-            elif data == "admin_stats":
-                await self.show_admin_stats(query)
-            elif data == "admin_backup":
-                await self.show_admin_backup(query)
-            elif data == "admin_discount":
-                await self.show_admin_discount(query)
-            elif data == "admin_agent_requests":
-                await self.show_admin_agent_requests(query)
-            
-            # عملیات پلن
-            elif data.startswith("buy_plan_"):
-                plan_id = int(data.split("_")[2])
-                await self.buy_plan(query, plan_id)
-            
-            # عملیات درخواست نمایندگی
-            elif data == "submit_agent_request":
-                await self.start_agent_request_process(query)
-            
-            # بازگشت‌ها
-            elif data == "back_to_shop":
-                await self.show_shop_menu(query)
-            elif data == "back_to_admin":
-                await self.show_admin_panel(query)
-            else:
+            if not await self.router.dispatch(query.data, query):
                 await query.answer("❌ گزینه نامعتبر!")
-                
         except Exception as e:
+            UnitOfWork.mark_failed()
             logger.error(f"Error in button_handler: {e}")
             await query.answer("❌ خطایی رخ داده است!")
     
     # توابع منوی اصلی
+    async def show_main_menu(self, query):
+        """نمایش منوی اصلی"""
+        is_admin = query.from_user.id == Config.ADMIN_ID
+        keyboard = Keyboards.main_menu(is_admin=is_admin)
+        await query.edit_message_text(
+            "منوی اصلی:",
+            reply_markup=keyboard
+        )
+    
     async def show_shop_menu(self, query):
         """نمایش منوی فروشگاه"""
         keyboard = Keyboards.shop_menu()
@@ -197,10 +214,9 @@ class HiddyShopBot:
     
     async def show_plans_list(self, query):
         """نمایش لیست پلن‌ها"""
-        async for db in get_db():
-            plan_manager = PlanManager(db)
-            plans = await plan_manager.get_active_plans()
-            break
+        db = await get_session()
+        plan_manager = PlanManager(db)
+        plans = await plan_manager.get_active_plans()
         
         if not plans:
             await query.edit_message_text(
@@ -209,7 +225,7 @@ class HiddyShopBot:
             )
             return
         
-        keyboard = Keyboards.plans_list(plans)
+        keyboard = Keyboards.plans_list(plans, version=PlanCache.version)
         await query.edit_message_text(
             "📋 پلن‌های موجود:",
             reply_markup=keyboard
@@ -217,10 +233,9 @@ class HiddyShopBot:
     
     async def show_plan_details(self, query, plan_id):
         """نمایش جزئیات پلن"""
-        async for db in get_db():
-            plan_manager = PlanManager(db)
-            plan = await plan_manager.get_plan_by_id(plan_id)
-            break
+        db = await get_session()
+        plan_manager = PlanManager(db)
+        plan = await plan_manager.get_active_plan(plan_id)
         
         if not plan:
             await query.answer("❌ پلن یافت نشد!")
@@ -239,10 +254,9 @@ class HiddyShopBot:
     
     async def buy_plan(self, query, plan_id):
         """خرید پلن"""
-        async for db in get_db():
-            plan_manager = PlanManager(db)
-            plan = await plan_manager.get_plan_by_id(plan_id)
-            break
+        db = await get_session()
+        plan_manager = PlanManager(db)
+        plan = await plan_manager.get_active_plan(plan_id)
         
         if not plan:
             await query.answer("❌ پلن یافت نشد!")
@@ -260,12 +274,9 @@ class HiddyShopBot:
     
     async def show_wallet_info(self, query):
         """نمایش اطلاعات کیف پول"""
-        user_id = query.from_user.id
-        async for db in get_db():
-            from modules.wallet import WalletManager
-            wallet_manager = WalletManager(db)
-            balance = await wallet_manager.get_user_wallet_balance(user_id)
-            break
+        db = await get_session()
+        user = await UserManager(db).get_user_identity(query.from_user.id)
+        balance = await WalletManager(db).get_user_wallet_balance(user.id) if user else 0.0
         
         wallet_info = f"""
 💳 کیف پول شما:
@@ -281,34 +292,28 @@ class HiddyShopBot:
         """نمایش اطلاعات رفرال - نسخه واقعی"""
         user_id = query.from_user.id
         try:
-            async for db in get_db():
-                from modules.user_manager import UserManager
-                from modules.referral import ReferralManager
-                user_manager = UserManager(db)
-                referral_manager = ReferralManager(db)
-                
-                # دریافت اطلاعات کاربر
-                user = await user_manager.get_user_by_telegram_id(user_id)
-                if not user:
-                    await query.answer("❌ خطا در دریافت اطلاعات کاربر!")
-                    return
-                
-                # دریافت آمار رفرال
-                stats = await referral_manager.get_user_referral_stats(user.id)
-                
-                # دریافت کاربران معرفی‌شده (آخرین 5 نفر)
-                referred_users = await referral_manager.get_user_referrals(user.id, page=1, per_page=5)
-                break
+            db = await get_session()
+            from modules.user_manager import UserManager
+            from modules.referral import ReferralManager
+            user_manager = UserManager(db)
+            referral_manager = ReferralManager(db)
+            
+            # دریافت اطلاعات کاربر
+            user = await user_manager.get_user_identity(user_id)
+            if not user:
+                await query.answer("❌ خطا در دریافت اطلاعات کاربر!")
+                return
+            
+            # دریافت آمار رفرال و آخرین کاربران معرفی‌شده از جدول خلاصه
+            stats = await referral_manager.get_user_referral_stats(user.id)
             
             # ساخت لیست کاربران معرفی‌شده
             referred_list = ""
-            if referred_users:
+            if stats["recent_referrals"]:
                 referred_list = "\nآخرین کاربران معرفی‌شده:\n"
-                for i, (referred_user, created_at) in enumerate(referred_users, 1):
-                    name = f"{referred_user.first_name or ''} {referred_user.last_name or ''}".strip()
-                    if not name:
-                        name = f"کاربر {referred_user.id}"
-                    referred_list += f"{i}. {name} ({created_at.strftime('%Y/%m/%d')})\n"
+                for i, referred in enumerate(stats["recent_referrals"], 1):
+                    created_at = datetime.fromisoformat(referred["created_at"])
+                    referred_list += f"{i}. {referred['name']} ({created_at.strftime('%Y/%m/%d')})\n"
             else:
                 referred_list = "\nهنوز کاربری معرفی نکرده‌اید."
             
@@ -321,7 +326,7 @@ class HiddyShopBot:
 └─ کمیسیون در انتظار: {Helpers.format_price(stats['pending_commission'])}
 💡 روش دعوت:
 لینک دعوت شما:
-`t.me/{(await self.app.bot.get_me()).username}?start={user.referral_code}`
+`{self.identity.referral_link(user.referral_code)}`
 {referred_list}
 برای دعوت دوستان، لینک بالا را با آن‌ها به اشتراک بگذارید.
 """
@@ -331,6 +336,7 @@ class HiddyShopBot:
                 parse_mode="Markdown"
             )
         except Exception as e:
+            UnitOfWork.mark_failed()
             logger.error(f"Error in show_referral_info: {e}")
             await query.answer("❌ خطایی رخ داده است!")
     
@@ -339,11 +345,28 @@ class HiddyShopBot:
         user = query.from_user
         user_id = user.id
         
+        # مصرف سرویس‌ها از آینه محلی هیدیفای خوانده می‌شود، نه از پنل
+        services = []
+        db = await get_session()
+        user_manager = UserManager(db)
+        db_user = await user_manager.get_user_identity(user_id)
+        if db_user:
+            services = await self.panels.get_user_services(db, db_user.id)
+        
+        services_text = ""
+        for i, service in enumerate(services, 1):
+            expiry = service['expiry_date'].strftime('%Y/%m/%d') if service['expiry_date'] else 'نامشخص'
+            services_text += f"\n🔌 سرویس {i}:\n"
+            services_text += f"├─ مصرف: {Helpers.format_traffic(round(service['current_usage_gb'], 2))} از {Helpers.format_traffic(service['usage_limit_gb'])}\n"
+            services_text += f"├─ روزهای باقی‌مانده: {service['days_left']}\n"
+            services_text += f"└─ تاریخ انقضا: {expiry}\n"
+        
         profile_info = f"""
 📊 پروفایل کاربری:
 👤 نام: {user.first_name} {user.last_name or ''}
 🆔 آیدی تلگرام: {user.id}
 📝 نام کاربری: @{user.username or 'ندارد'}
+{services_text}
 برای تغییر اطلاعات، از طریق تلگرام اقدام کنید.
 """
         await query.edit_message_text(
@@ -357,10 +380,9 @@ class HiddyShopBot:
         user_id = query.from_user.id
         
         # بررسی اینکه آیا کاربر قبلاً نماینده است یا نه
-        async for db in get_db():
-            user_manager = UserManager(db)
-            user = await user_manager.get_user_by_telegram_id(user_id)
-            break
+        db = await get_session()
+        user_manager = UserManager(db)
+        user = await user_manager.get_user_identity(user_id)
         
         if user and user.is_agent:
             await query.edit_message_text(
@@ -370,11 +392,9 @@ class HiddyShopBot:
             return
         
         # بررسی اینکه آیا قبلاً درخواست داده یا نه
-        async for db in get_db():
-            from modules.agent_manager import AgentManager
-            agent_manager = AgentManager(db)
-            existing_request = await agent_manager.get_user_agent_request(user_id)
-            break
+        from modules.agent_manager import AgentManager
+        agent_manager = AgentManager(db)
+        existing_request = await agent_manager.get_user_agent_request(user_id)
         
         if existing_request:
             if existing_request.status == "pending":
@@ -420,7 +440,7 @@ class HiddyShopBot:
             agent_request_info,
             reply_markup=Keyboards.back_to_main()
         )
-        self.user_states[user_id] = "awaiting_agent_request_data"
+        await self.states.set(user_id, "awaiting_agent_request_data")
     
     async def start_agent_request_process(self, query):
         """شروع فرآیند درخواست نمایندگی"""
@@ -433,7 +453,7 @@ class HiddyShopBot:
             "تجربه و مهارت‌های مرتبط (اختیاری):",
             reply_markup=Keyboards.back_to_main()
         )
-        self.user_states[query.from_user.id] = "awaiting_agent_request_data"
+        await self.states.set(query.from_user.id, "awaiting_agent_request_data")
     
     async def process_agent_request_data(self, update: Update):
         """پردازش داده‌های درخواست نمایندگی"""
@@ -472,18 +492,17 @@ class HiddyShopBot:
                 return
             
             # ذخیره درخواست
-            async for db in get_db():
-                from modules.agent_manager import AgentManager
-                agent_manager = AgentManager(db)
-                agent_request = await agent_manager.create_agent_request(
-                    user_id=user_id,
-                    full_name=full_name,
-                    phone=phone,
-                    email=email,
-                    address=address,
-                    experience=experience
-                )
-                break
+            db = await get_session()
+            from modules.agent_manager import AgentManager
+            agent_manager = AgentManager(db)
+            agent_request = await agent_manager.create_agent_request(
+                user_id=user_id,
+                full_name=full_name,
+                phone=phone,
+                email=email,
+                address=address,
+                experience=experience
+            )
             
             if agent_request:
                 await update.message.reply_text(
@@ -508,14 +527,14 @@ class HiddyShopBot:
                     pass
                 
                 # حذف وضعیت کاربر
-                if user_id in self.user_states:
-                    del self.user_states[user_id]
+                await self.states.delete(user_id)
             else:
                 await update.message.reply_text(
                     "❌ خطا در ارسال درخواست نمایندگی!",
                     reply_markup=Keyboards.back_to_main()
                 )
         except Exception as e:
+            UnitOfWork.mark_failed()
             logger.error(f"Error in process_agent_request_data: {e}")
             await update.message.reply_text(
                 "❌ خطا در پردازش اطلاعات!",
@@ -531,40 +550,23 @@ class HiddyShopBot:
             reply_markup=keyboard
         )
     
-    async def show_admin_users(self, query):
+    async def show_admin_users(self, query, page: int = 1, cursor: str = None):
         """نمایش مدیریت کاربران"""
         try:
-            async for db in get_db():
-                user_manager = UserManager(db)
-                users = await user_manager.get_all_users(page=1, per_page=10)
-                total_users = len(users)  # در نسخه واقعی باید از دیتابیس بگیریم
-                break
-            
-            users_info = f"""
-👥 مدیریت کاربران:
-📊 آمار کلی:
-├─ تعداد کل کاربران: {total_users}
-├─ کاربران فعال: {len([u for u in users if u.is_active])}
-└─ کاربران ادمین: {len([u for u in users if u.is_admin])}
-عملیات موجود:
-• مشاهده لیست کاربران
-• مسدود/رفع مسدودی کاربران
-• تغییر سطح دسترسی
-این بخش در حال توسعه است.
-"""
-            keyboard = Keyboards.admin_back_menu()
-            await query.edit_message_text(users_info, reply_markup=keyboard)
+            db = await get_session()
+            from modules.admin.user_admin import UserAdmin
+            await UserAdmin(db).show_users_list(query, page, cursor)
         except Exception as e:
+            UnitOfWork.mark_failed()
             logger.error(f"Error in show_admin_users: {e}")
             await query.answer("❌ خطایی رخ داده است!")
     
     async def show_admin_plans(self, query):
         """نمایش مدیریت پلن‌ها - نسخه واقعی"""
         try:
-            async for db in get_db():
-                plan_manager = PlanManager(db)
-                plans = await plan_manager.get_all_plans(page=1, per_page=10)
-                break
+            db = await get_session()
+            plan_manager = PlanManager(db)
+            plans = await plan_manager.get_all_plans(page=1, per_page=10)
             
             if not plans:
                 plans_text = "❌ هیچ پلنی تعریف نشده است."
@@ -590,31 +592,47 @@ class HiddyShopBot:
             keyboard = Keyboards.admin_back_menu()
             await query.edit_message_text(plans_info, reply_markup=keyboard)
         except Exception as e:
+            UnitOfWork.mark_failed()
             logger.error(f"Error in show_admin_plans: {e}")
             await query.answer("❌ خطایی رخ داده است!")
     
-    async def show_admin_payments(self, query):
+    async def show_admin_payments(self, query, page: int = 1, status: str = "all",
+                                  cursor: str = None):
         """نمایش مدیریت پرداخت‌ها"""
-        admin_info = """
-💰 مدیریت پرداخت‌ها:
-در این بخش می‌توانید:
-- لیست پرداخت‌ها را مشاهده کنید
-- پرداخت‌های در انتظار تایید را بررسی کنید
-- تراکنش‌ها را مدیریت کنید
-این بخش در نسخه‌های بعدی پیاده‌سازی خواهد شد.
-"""
-        keyboard = Keyboards.admin_back_menu()
-        await query.edit_message_text(admin_info, reply_markup=keyboard)
+        db = await get_session()
+        from modules.admin.payment_admin import PaymentAdmin
+        await PaymentAdmin(db).show_payments_list(query, page, status, cursor)
     
     async def show_admin_stats(self, query):
         """نمایش آمار سیستم"""
-        admin_info = """
+        db = await get_session()
+        from modules.admin.stats_admin import StatsAdmin
+        stats = await StatsAdmin(db).get_system_stats()
+        
+        panels_text = ""
+        for panel in self.panels.get_stats():
+            breaker = panel['breaker']
+            panels_text += f"""🔧 نود {panel['name']} ({'سالم' if panel['healthy'] else 'ناسالم'}):
+├─ کاربران: {panel['user_count']} از {panel['capacity']}
+├─ CPU: {panel['cpu_percent']}%
+├─ وضعیت مدار: {breaker['state']}
+├─ خطاهای پشت‌سرهم: {breaker['consecutive_failures']}
+├─ کل خطاها: {breaker['total_failures']}
+├─ درخواست‌های رد شده: {breaker['rejected_calls']}
+└─ تعداد قطعی‌ها: {breaker['open_count']}
+"""
+        admin_info = f"""
 📊 آمار سیستم:
+👤 کاربران: {stats['total_users']} (فعال: {stats['active_users']}، امروز: {stats['today_users']})
+📦 پلن‌ها: {stats['total_plans']} (فعال: {stats['active_plans']})
+🛒 سفارشات: {stats['total_orders']} (امروز: {stats['today_orders']})
+💰 درآمد کل: {Helpers.format_price(stats['total_revenue'])}
+💵 درآمد امروز: {Helpers.format_price(stats['today_revenue'])}
+{panels_text}
 در این بخش می‌توانید:
 - آمار کلی سیستم را مشاهده کنید
 - گزارش‌های مالی را ببینید
 - عملکرد ربات را بررسی کنید
-این بخش در نسخه‌های بعدی پیاده‌سازی خواهد شد.
 """
         keyboard = Keyboards.admin_back_menu()
         await query.edit_message_text(admin_info, reply_markup=keyboard)
@@ -632,41 +650,41 @@ class HiddyShopBot:
         keyboard = Keyboards.admin_back_menu()
         await query.edit_message_text(admin_info, reply_markup=keyboard)
     
-    async def show_admin_discount(self, query):
+    async def show_admin_discount(self, query, page: int = 1, cursor: str = None):
         """نمایش مدیریت کدهای تخفیف"""
-        admin_info = """
-🏷️ مدیریت کدهای تخفیف:
-در این بخش می‌توانید:
-- کدهای تخفیف جدید ایجاد کنید
-- کدهای موجود را مدیریت کنید
-- آمار استفاده از کدها را ببینید
-این بخش در نسخه‌های بعدی پیاده‌سازی خواهد شد.
-"""
-        keyboard = Keyboards.admin_back_menu()
-        await query.edit_message_text(admin_info, reply_markup=keyboard)
+        db = await get_session()
+        from modules.admin.discount_admin import DiscountAdmin
+        await DiscountAdmin(db).show_discounts_list(query, page, cursor)
     
-    async def show_admin_agent_requests(self, query):
+    async def show_admin_agent_requests(self, query, page: int = 1, cursor: str = None):
         """نمایش درخواست‌های نمایندگی"""
+        per_page = 10
         try:
-            async for db in get_db():
-                from modules.agent_manager import AgentManager
-                agent_manager = AgentManager(db)
-                pending_requests = await agent_manager.get_pending_requests(page=1, per_page=10)
-                total_pending = await agent_manager.get_requests_count("pending")
-                break
+            db = await get_session()
+            from modules.agent_manager import AgentManager
+            agent_manager = AgentManager(db)
+            pending_requests = await agent_manager.get_pending_requests(cursor=cursor, per_page=per_page)
+            total_pending = await agent_manager.get_requests_count("pending")
+            total_approved = await agent_manager.get_requests_count("approved")
             
             requests_info = f"""
 🏢 مدیریت درخواست‌های نمایندگی:
 📊 آمار:
 ├─ درخواست‌های در انتظار: {total_pending}
-└─ درخواست‌های تایید شده: {await agent_manager.get_requests_count("approved")}
+└─ درخواست‌های تایید شده: {total_approved}
             
 📋 درخواست‌های در انتظار تایید:
 """
             
             if pending_requests:
-                for i, request in enumerate(pending_requests, 1):
+                # حساب تلگرام درخواست‌دهنده‌ها با یک کوئری (user_id درخواست آیدی تلگرام است)
+                users = await UserLoader(db).load_many_by_telegram_id(
+                    request.user_id for request in pending_requests
+                )
+                for i, (request, user) in enumerate(zip(pending_requests, users), (page - 1) * per_page + 1):
                     requests_info += f"{i}. {request.full_name}\n"
+                    if user:
+                        requests_info += f"   👤 @{user.username or 'ندارد'} ({user.telegram_id})\n"
                     requests_info += f"   📱 {request.phone}\n"
                     requests_info += f"   📧 {request.email or 'ندارد'}\n"
                     requests_info += f"   📅 {request.created_at.strftime('%Y/%m/%d %H:%M')}\n"
@@ -682,48 +700,59 @@ class HiddyShopBot:
             
             await query.edit_message_text(
                 requests_info,
-                reply_markup=Keyboards.admin_back_menu()
+                reply_markup=Keyboards.admin_agent_requests_navigation(page, pending_requests.next_cursor)
             )
         except Exception as e:
+            UnitOfWork.mark_failed()
             logger.error(f"Error in show_admin_agent_requests: {e}")
             await query.answer("❌ خطایی رخ داده است!")
     
+    async def verify_payment(self, query, payment_id: int, result: str):
+        """تایید یا رد پرداخت توسط ادمین"""
+        db = await get_session()
+        from modules.admin.payment_admin import PaymentAdmin
+        payment_admin = PaymentAdmin(db, self.panels)
+        await payment_admin.verify_payment(query, payment_id, result == "success")
+    
     async def handle_referral(self, user_id: int, referral_code: str):
         """مدیریت رفرال"""
         try:
-            async for db in get_db():
-                from modules.user_manager import UserManager
-                from modules.referral import ReferralManager
-                user_manager = UserManager(db)
-                referral_manager = ReferralManager(db)
-                
-                # پیدا کردن کاربر معرف
-                referrer = await user_manager.get_user_by_referral_code(referral_code)
-                if not referrer or referrer.telegram_id == user_id:
-                    return
-                
-                # بررسی وجود رفرال قبلی
-                existing_referral = await referral_manager.get_referral_by_users(
-                    referrer.id, user_id
-                )
-                if existing_referral:
-                    return
-                
-                # ایجاد رکورد رفرال
+            db = await get_session()
+            from modules.user_manager import UserManager
+            from modules.referral import ReferralManager
+            user_manager = UserManager(db)
+            referral_manager = ReferralManager(db)
+            
+            # پیدا کردن کاربر معرف
+            referrer = await user_manager.get_user_by_referral_code(referral_code)
+            if not referrer or referrer.telegram_id == user_id:
+                return
+            
+            # بررسی وجود رفرال قبلی
+            referred = await user_manager.get_user_identity(user_id)
+            if not referred:
+                return
+            existing_referral = await referral_manager.get_referral_by_users(
+                referrer.id, referred.id
+            )
+            if existing_referral:
+                return
+            
+            # ایجاد رکورد رفرال؛ خطای آن فقط savepoint رفرال را برمی‌گرداند، نه ثبت‌نام کاربر
+            async with db.begin_nested():
                 await referral_manager.create_referral(
                     referrer_id=referrer.id,
-                    referred_id=user_id
+                    referred_id=referred.id
                 )
-                
-                # اطلاع‌رسانی به کاربر معرف
-                try:
-                    await self.app.bot.send_message(
-                        chat_id=referrer.telegram_id,
-                        text=f"👥 کاربر جدید با کد رفرال شما ثبت‌نام کرد!"
-                    )
-                except:
-                    pass  # اگر نتوانست پیام بفرستد، مهم نیست
-                break
+            
+            # اطلاع‌رسانی به کاربر معرف
+            try:
+                await self.app.bot.send_message(
+                    chat_id=referrer.telegram_id,
+                    text=f"👥 کاربر جدید با کد رفرال شما ثبت‌نام کرد!"
+                )
+            except:
+                pass  # اگر نتوانست پیام بفرستد، مهم نیست
         except Exception as e:
             logger.error(f"Error in handle_referral: {e}")
     
@@ -732,12 +761,10 @@ class HiddyShopBot:
         user_id = update.effective_user.id
         
         # بررسی اینکه آیا کاربر در حالت خاصی است یا نه
-        if user_id in self.user_states:
-            state = self.user_states[user_id]
-            
-            if state == "awaiting_agent_request_data":
-                await self.process_agent_request_data(update)
-                return
+        state = await self.states.get(user_id)
+        if state == "awaiting_agent_request_data":
+            await self.process_agent_request_data(update)
+            return
         
         await update.message.reply_text(
             "لطفاً از منوی اصلی استفاده کنید:",
@@ -746,11 +773,49 @@ class HiddyShopBot:
             )
         )
     
+    async def error_handler(self, update: object, context):
+        """ثبت خطای هندلر و برگرداندن تغییرات دیتابیس همان آپدیت"""
+        UnitOfWork.mark_failed()
+        logger.error(f"Error while handling update: {context.error}", exc_info=context.error)
+    
+    async def post_init(self, app):
+        """راه‌اندازی سرویس‌های پس‌زمینه"""
+        await self.identity.load()
+        self.identity.start()
+        await self.panels.load_mirrors()
+        self.panels.start()
+        self.rollups.start()
+        self.wallet_snapshots.start()
+        self.state_purge.start()
+    
+    async def post_shutdown(self, app):
+        """آزادسازی منابع هنگام خاموش شدن ربات"""
+        await self.identity.stop()
+        await self.rollups.stop()
+        await self.wallet_snapshots.stop()
+        await self.state_purge.stop()
+        await self.panels.stop()
+    
+    def get_metrics(self) -> dict:
+        """آمار اجزای ربات برای endpoint متریک"""
+        return {
+            "panels": self.panels.get_stats(),
+            "routes": self.router.get_stats(),
+            "updates": self.update_processor.get_stats(),
+            "database": UnitOfWork.get_stats(),
+            "states": self.states.get_stats(),
+            "user_cache": UserIdentityCache.get_stats()
+        }
+    
     async def run(self):
         """اجرای ربات"""
         logger.info("ربات در حال اجراست...")
         await init_db()  # ایجاد دیتابیس
-        await self.app.run_polling()
+        if Config.BOT_MODE == "webhook":
+            server = WebhookServer(self.app, metrics=self.get_metrics)
+            await server.serve()
+        else:
+            await self.app.run_polling()
 
 # اجرای ربات
 if __name__ == "__main__":
@@ -11,13 +11,55 @@ class Config:
     HIDDIFY_PROXY_PATH = os.getenv("HIDDIFY_PROXY_PATH", "admin")
     HIDDIFY_ADMIN_UUID = os.getenv("HIDDIFY_ADMIN_UUID")
     HIDDIFY_ADMIN_PASSWORD = os.getenv("HIDDIFY_ADMIN_PASSWORD")
+    HIDDIFY_TIMEOUT = float(os.getenv("HIDDIFY_TIMEOUT", 30))  # تایم‌اوت پیش‌فرض به ثانیه
+    HIDDIFY_MAX_CONCURRENCY = int(os.getenv("HIDDIFY_MAX_CONCURRENCY", 10))  # حداکثر درخواست همزمان
+    HIDDIFY_POOL_SIZE = int(os.getenv("HIDDIFY_POOL_SIZE", 20))  # اندازه connection pool
+    HIDDIFY_BATCH_CONCURRENCY = int(os.getenv("HIDDIFY_BATCH_CONCURRENCY", 8))  # موازی‌سازی عملیات گروهی
+    HIDDIFY_RETRIES = int(os.getenv("HIDDIFY_RETRIES", 3))  # تعداد تلاش مجدد خطاهای موقت
+    HIDDIFY_BACKOFF_BASE = float(os.getenv("HIDDIFY_BACKOFF_BASE", 0.5))  # ثانیه
+    HIDDIFY_BACKOFF_MAX = float(os.getenv("HIDDIFY_BACKOFF_MAX", 10))  # ثانیه
+    HIDDIFY_BREAKER_THRESHOLD = int(os.getenv("HIDDIFY_BREAKER_THRESHOLD", 5))  # خطای پشت‌سرهم تا باز شدن مدار
+    HIDDIFY_BREAKER_RECOVERY = float(os.getenv("HIDDIFY_BREAKER_RECOVERY", 30))  # ثانیه تا اولین تلاش آزمایشی
+    HIDDIFY_BREAKER_MAX_RECOVERY = float(os.getenv("HIDDIFY_BREAKER_MAX_RECOVERY", 300))  # سقف زمان بازیابی
+    # چند نود هیدیفای به صورت JSON: [{"name": "de1", "base_url": "...", "api_key": "...", "capacity": 500}]
+    HIDDIFY_PANELS = os.getenv("HIDDIFY_PANELS", "")
+    HIDDIFY_PANEL_CAPACITY = int(os.getenv("HIDDIFY_PANEL_CAPACITY", 1000))  # ظرفیت پیش‌فرض هر نود
+    HIDDIFY_PANEL_REFRESH_INTERVAL = int(os.getenv("HIDDIFY_PANEL_REFRESH_INTERVAL", 300))  # ثانیه
+    HIDDIFY_MIRROR_REFRESH_INTERVAL = int(os.getenv("HIDDIFY_MIRROR_REFRESH_INTERVAL", 120))  # ثانیه
+    HIDDIFY_MIRROR_MAX_STALENESS = int(os.getenv("HIDDIFY_MIRROR_MAX_STALENESS", 300))  # ثانیه
     
     # تنظیمات ربات
     BOT_TOKEN = os.getenv("BOT_TOKEN")
     ADMIN_ID = int(os.getenv("ADMIN_ID", 0))
+    BOT_MODE = os.getenv("BOT_MODE", "polling")  # polling یا webhook
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # آدرس عمومی HTTPS ربات
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # هدر X-Telegram-Bot-Api-Secret-Token
+    BOT_IDENTITY_REFRESH_INTERVAL = int(os.getenv("BOT_IDENTITY_REFRESH_INTERVAL", 3600))  # ثانیه
+    UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", 32))  # حداکثر آپدیت در حال پردازش همزمان
     
     # تنظیمات دیتابیس
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./hiddyshop.db")
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", UPDATE_CONCURRENCY))  # هر آپدیت همزمان یک اتصال
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))  # اتصال اضافه برای کارهای پس‌زمینه
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))  # ثانیه انتظار برای اتصال آزاد
+    
+    # کش‌ها
+    PLAN_CACHE_TTL = int(os.getenv("PLAN_CACHE_TTL", 600))  # ثانیه؛ 0 یعنی فقط باطل‌سازی صریح
+    USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 300))  # ثانیه؛ سقف کهنگی هویت کاربر بین چند نمونه ربات
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))  # تعداد کاربران پرتکرار در کش
+    
+    # وضعیت گفتگوی کاربران
+    STATE_STORE = os.getenv("STATE_STORE", "memory")  # memory یا sql (مشترک بین چند نمونه ربات)
+    STATE_TTL = int(os.getenv("STATE_TTL", 1800))  # ثانیه؛ فرم‌های نیمه‌کاره بعد از این مدت فراموش می‌شوند
+    STATE_MAX_ENTRIES = int(os.getenv("STATE_MAX_ENTRIES", 10000))  # سقف ورودی‌های حافظه (LRU)
+    STATE_PURGE_INTERVAL = int(os.getenv("STATE_PURGE_INTERVAL", 300))  # ثانیه
+    
+    # جدول‌های خلاصه روزانه
+    ROLLUP_REFRESH_INTERVAL = int(os.getenv("ROLLUP_REFRESH_INTERVAL", 900))  # ثانیه
+    WALLET_SNAPSHOT_INTERVAL = int(os.getenv("WALLET_SNAPSHOT_INTERVAL", 3600))  # ثانیه
+    ROLLUP_LOOKBACK_DAYS = int(os.getenv("ROLLUP_LOOKBACK_DAYS", 3))  # روزهای اخیر که هر بار دوباره ساخته می‌شوند
     
     # تنظیمات ربات
     BOT_NAME = os.getenv("BOT_NAME", "HiddyShop Bot")
@@ -1,13 +1,39 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+import logging
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional
+from sqlalchemy import DateTime, literal
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncConnection
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from config import Config
 
+logger = logging.getLogger(__name__)
+
+def _pool_options(url: str) -> dict:
+    """اندازه pool متناسب با آپدیت‌های همزمان
+
+    هر آپدیت در حال پردازش حداکثر یک اتصال نگه می‌دارد (تا پایان UnitOfWork)، پس
+    pool پیش‌فرض (5 + 10) زیر بار جلوی آپدیت‌ها را می‌گیرد. SQLite (NullPool برای
+    فایل و StaticPool برای حافظه) pool اندازه‌دار ندارد و این تنظیمات را نمی‌پذیرد.
+    """
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": Config.DB_POOL_SIZE,
+        "max_overflow": Config.DB_MAX_OVERFLOW,
+        "pool_timeout": Config.DB_POOL_TIMEOUT
+    }
+
 # ایجاد موتور دیتابیس
 engine = create_async_engine(
     Config.DATABASE_URL,
     echo=False,
-    pool_pre_ping=True
+    pool_pre_ping=True,
+    **_pool_options(Config.DATABASE_URL)
 )
 
 # ایجاد session factory
@@ -20,16 +46,192 @@ AsyncSessionLocal = sessionmaker(
 # کلاس پایه برای مدل‌ها
 Base = declarative_base()
 
+# SQLite زمان پیش‌فرض (CURRENT_TIMESTAMP) را به شکل 'YYYY-MM-DD HH:MM:SS' و
+# datetime پایتون را با میکروثانیه ذخیره می‌کند و مقایسه رشته‌ای است. مرز
+# ثانیه کامل بدون میکروثانیه با هر دو شکل درست مقایسه می‌شود.
+BoundaryDateTime = DateTime().with_variant(
+    sqlite.DATETIME(
+        storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"
+    ),
+    "sqlite"
+)
+
+def time_bound(value: datetime):
+    """مرز بازه زمانی (با ثانیه کامل، مثل شروع روز) برای مقایسه با ستون‌های DateTime"""
+    return literal(value.replace(microsecond=0), BoundaryDateTime)
+
+class UnitOfWork:
+    """یک اتصال و یک session مشترک برای همه مدیرهای یک آپدیت
+
+    اتصال تنبل و با اولین get_session از pool گرفته می‌شود، پس آپدیتی که به
+    دیتابیس نیاز ندارد اتصالی اشغال نمی‌کند. مدیرها به جای commit از
+    commit_or_flush استفاده می‌کنند که داخل UnitOfWork فقط flush است، و به جای
+    rollback از savepoint (begin_nested). در پایان آپدیت یک بار commit (یا در
+    صورت خطا rollback) انجام و اتصال آزاد می‌شود. UnitOfWork تو در تو به نمونه
+    بیرونی می‌پیوندد.
+
+    Application تلگرام خطای هندلرها را خودش می‌گیرد و به error handlerها می‌دهد،
+    و هندلرهای ربات هم خطای خودشان را می‌گیرند؛ پس خطا به __aexit__ نمی‌رسد و
+    هر جا خطا گرفته می‌شود باید mark_failed صدا زده شود تا تغییرات آن آپدیت
+    rollback شود.
+    """
+
+    _current: ContextVar[Optional["UnitOfWork"]] = ContextVar("unit_of_work", default=None)
+
+    # آمار سراسری (زمان‌ها به ثانیه)
+    _stats = {
+        "units": 0,
+        "sessions": 0,
+        "active_sessions": 0,
+        "commits": 0,
+        "rollbacks": 0,
+        "total_checkout": 0.0,
+        "max_checkout": 0.0,
+        "total_lifetime": 0.0,
+        "max_lifetime": 0.0
+    }
+
+    def __init__(self):
+        self.session: Optional[AsyncSession] = None
+        self._connection: Optional[AsyncConnection] = None
+        self._outer: Optional["UnitOfWork"] = None
+        self._token = None
+        self._opened_at = 0.0
+        self._after_finish: List[Callable[[], Awaitable]] = []
+        self.failed = False
+
+    @classmethod
+    def current(cls) -> Optional["UnitOfWork"]:
+        return cls._current.get()
+
+    @classmethod
+    def mark_failed(cls):
+        """علامت‌گذاری UnitOfWork جاری تا در پایان به جای commit، rollback شود"""
+        unit = cls._current.get()
+        if unit is not None:
+            unit.failed = True
+
+    def after_finish(self, callback: Callable[[], Awaitable]):
+        """اجرای callback بعد از commit یا rollback و آزاد شدن اتصال
+
+        برای نوشتن‌هایی که نباید به نتیجه آپدیت وابسته باشند (مثل وضعیت گفتگو)
+        و نباید اتصال دومی را همزمان با اتصال آپدیت نگه دارند.
+        """
+        self._after_finish.append(callback)
+
+    async def __aenter__(self) -> "UnitOfWork":
+        self._outer = self._current.get()
+        if self._outer is not None:
+            return self._outer
+        self._token = self._current.set(self)
+        self._stats["units"] += 1
+        return self
+
+    async def get_session(self) -> AsyncSession:
+        """session مشترک؛ در اولین فراخوانی اتصال از pool گرفته می‌شود"""
+        if self.session is None:
+            started = time.perf_counter()
+            self._connection = await engine.connect()
+            self._opened_at = time.perf_counter()
+            checkout = self._opened_at - started
+            self._stats["sessions"] += 1
+            self._stats["active_sessions"] += 1
+            self._stats["total_checkout"] += checkout
+            self._stats["max_checkout"] = max(self._stats["max_checkout"], checkout)
+            self.session = AsyncSessionLocal(bind=self._connection)
+        return self.session
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        if self._outer is not None:
+            return False
+        try:
+            if self.session is not None:
+                await self._finish(exc_type is None and not self.failed)
+        finally:
+            self._current.reset(self._token)
+            await self._run_after_finish()
+        return False
+
+    async def _run_after_finish(self):
+        callbacks, self._after_finish = self._after_finish, []
+        for callback in callbacks:
+            try:
+                await callback()
+            except Exception as e:
+                logger.error(f"Error in unit of work after_finish callback: {e}")
+
+    async def _finish(self, success: bool):
+        try:
+            if success and self.session.in_transaction():
+                await self.session.commit()
+                self._stats["commits"] += 1
+            elif self.session.in_transaction():
+                await self.session.rollback()
+                self._stats["rollbacks"] += 1
+        except Exception:
+            await self.session.rollback()
+            self._stats["rollbacks"] += 1
+            raise
+        finally:
+            await self.session.close()
+            await self._connection.close()
+            lifetime = time.perf_counter() - self._opened_at
+            self._stats["active_sessions"] -= 1
+            self._stats["total_lifetime"] += lifetime
+            self._stats["max_lifetime"] = max(self._stats["max_lifetime"], lifetime)
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        """آمار session و زمان گرفتن اتصال از pool به میلی‌ثانیه"""
+        stats = cls._stats
+        sessions = stats["sessions"]
+        closed = sessions - stats["active_sessions"]
+        return {
+            "units": stats["units"],
+            "sessions": sessions,
+            "active_sessions": stats["active_sessions"],
+            "without_db": stats["units"] - sessions,
+            "commits": stats["commits"],
+            "rollbacks": stats["rollbacks"],
+            "avg_checkout_ms": round(stats["total_checkout"] / sessions * 1000, 2) if sessions else 0.0,
+            "max_checkout_ms": round(stats["max_checkout"] * 1000, 2),
+            "avg_lifetime_ms": round(stats["total_lifetime"] / closed * 1000, 2) if closed else 0.0,
+            "max_lifetime_ms": round(stats["max_lifetime"] * 1000, 2),
+            "pool": engine.pool.status()
+        }
+
 # توابع کمکی
+async def commit_or_flush(session: AsyncSession):
+    """commit برای session مستقل؛ برای session UnitOfWork جاری فقط flush
+
+    commit نهایی (یا rollback) در پایان آپدیت توسط خود UnitOfWork انجام می‌شود.
+    """
+    unit = UnitOfWork.current()
+    if unit is not None and unit.session is session:
+        await session.flush()
+    else:
+        await session.commit()
+
+async def get_session() -> AsyncSession:
+    """session آپدیت جاری (باید داخل UnitOfWork صدا زده شود)"""
+    unit = UnitOfWork.current()
+    if unit is None:
+        raise RuntimeError("get_session() called outside of a UnitOfWork")
+    return await unit.get_session()
+
 async def get_db():
-    """دریافت session دیتابیس"""
+    """دریافت session دیتابیس (داخل UnitOfWork همان session آپدیت برگردانده می‌شود)"""
+    unit = UnitOfWork.current()
+    if unit is not None:
+        yield await unit.get_session()
+        return
     async with AsyncSessionLocal() as session:
         yield session
 
 async def init_db():
-    """ایجاد جداول دیتابیس"""
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    """بروزرسانی شمای دیتابیس تا آخرین نسخه مهاجرت"""
+    from migrations.runner import upgrade
+    await upgrade(engine)
 
 async def close_db():
     """بستن اتصال دیتابیس"""
@@ -0,0 +1,203 @@
+"""شمای پایه (مهاجرت ۱) به صورت ثابت
+
+این تعریف‌ها عمداً از models جدا هستند: baseline باید همیشه همان جدول‌هایی را
+بسازد که هنگام شروع نسخه‌گذاری شما وجود داشتند، نه شکل امروز مدل‌ها. هر تغییر
+بعدی (ستون، ایندکس یا جدول جدید) فقط در یک مرحله جدید versions.py اضافه می‌شود.
+
+LEGACY_TABLES جدول‌هایی هستند که create_all قدیمی ربات پیش از نسخه‌گذاری
+می‌ساخت؛ بقیه پیش از مهاجرت ۱ فقط روی بعضی دیتابیس‌ها ساخته شده بودند.
+"""
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, String, Float, Text, Boolean, Date, DateTime,
+    ForeignKey, UniqueConstraint
+)
+
+metadata = MetaData()
+
+users = Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("telegram_id", Integer, unique=True, index=True, nullable=False),
+    Column("username", String(100), nullable=True),
+    Column("first_name", String(100), nullable=True),
+    Column("last_name", String(100), nullable=True),
+    Column("phone", String(20), nullable=True),
+    Column("is_admin", Boolean),
+    Column("is_agent", Boolean),
+    Column("is_blocked", Boolean),
+    Column("wallet_balance", Float),
+    Column("referral_code", String(50), unique=True, index=True),
+    Column("referred_by", Integer, nullable=True),
+    Column("is_active", Boolean),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime)
+)
+
+user_hiddify = Table(
+    "user_hiddify", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, nullable=False),
+    Column("hiddify_uuid", String(50), unique=True, index=True, nullable=False),
+    Column("secret_uuid", String(50), unique=True, nullable=False),
+    Column("created_at", DateTime)
+)
+
+plans = Table(
+    "plans", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String(100), nullable=False),
+    Column("description", Text, nullable=True),
+    Column("days", Integer, nullable=False),
+    Column("traffic_gb", Float, nullable=False),
+    Column("price", Float, nullable=False),
+    Column("hiddify_mode", String(50)),
+    Column("product_name", String(100), nullable=True),
+    Column("is_active", Boolean),
+    Column("sort_order", Integer),
+    Column("max_ips", Integer),
+    Column("monthly_package", Boolean),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime)
+)
+
+orders = Table(
+    "orders", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("plan_id", Integer, ForeignKey("plans.id"), nullable=False),
+    Column("plan_name", String(100), nullable=False),
+    Column("days", Integer, nullable=False),
+    Column("traffic_gb", Float, nullable=False),
+    Column("price", Float, nullable=False),
+    Column("discount_code", String(50), nullable=True),
+    Column("discount_amount", Float),
+    Column("status", String(20)),
+    Column("hiddify_uuid", String(50), nullable=True),
+    Column("secret_uuid", String(50), nullable=True),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime)
+)
+
+payments = Table(
+    "payments", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("order_id", Integer, ForeignKey("orders.id"), nullable=True),
+    Column("amount", Float, nullable=False),
+    Column("currency", String(10)),
+    Column("payment_method", String(50), nullable=False),
+    Column("payment_gateway", String(50), nullable=True),
+    Column("transaction_id", String(100), nullable=True),
+    Column("authority", String(100), nullable=True),
+    Column("status", String(20)),
+    Column("description", Text, nullable=True),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime)
+)
+
+referrals = Table(
+    "referrals", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("referrer_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("referred_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("commission_amount", Float),
+    Column("commission_status", String(20)),
+    Column("order_id", Integer, nullable=True),
+    Column("created_at", DateTime)
+)
+
+discount_codes = Table(
+    "discount_codes", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("code", String(50), unique=True, index=True, nullable=False),
+    Column("description", String(200), nullable=True),
+    Column("discount_type", String(20)),
+    Column("discount_value", Float, nullable=False),
+    Column("max_uses", Integer),
+    Column("used_count", Integer),
+    Column("valid_from", DateTime, nullable=True),
+    Column("valid_until", DateTime, nullable=True),
+    Column("is_active", Boolean),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime)
+)
+
+agent_requests = Table(
+    "agent_requests", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("full_name", String(100), nullable=False),
+    Column("phone", String(20), nullable=False),
+    Column("email", String(100), nullable=True),
+    Column("address", Text, nullable=True),
+    Column("experience", Text, nullable=True),
+    Column("status", String(20)),
+    Column("rejection_reason", Text, nullable=True),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime)
+)
+
+LEGACY_TABLES = [users, user_hiddify, plans, orders, payments, referrals, discount_codes, agent_requests]
+
+hiddify_user_states = Table(
+    "hiddify_user_states", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("hiddify_uuid", String(50), unique=True, index=True, nullable=False),
+    Column("name", String(100), nullable=True),
+    Column("usage_limit_gb", Float),
+    Column("current_usage_gb", Float),
+    Column("package_days", Integer),
+    Column("start_date", DateTime, nullable=True),
+    Column("mode", String(50), nullable=True),
+    Column("enable", Boolean),
+    Column("last_online", DateTime, nullable=True),
+    Column("raw_data", Text, nullable=True),
+    Column("synced_at", DateTime)
+)
+
+referral_summaries = Table(
+    "referral_summaries", metadata,
+    Column("referrer_id", Integer, ForeignKey("users.id"), primary_key=True),
+    Column("referred_count", Integer, nullable=False),
+    Column("paid_commission", Float, nullable=False),
+    Column("pending_commission", Float, nullable=False),
+    Column("recent_referrals", Text, nullable=True),
+    Column("updated_at", DateTime)
+)
+
+payment_daily_rollups = Table(
+    "payment_daily_rollups", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("day", Date, nullable=False, index=True),
+    Column("status", String(20), nullable=False),
+    Column("payment_method", String(50), nullable=False),
+    Column("payment_gateway", String(50), nullable=False),
+    Column("count", Integer, nullable=False),
+    Column("amount", Float, nullable=False),
+    UniqueConstraint("day", "status", "payment_method", "payment_gateway", name="uq_payment_rollup")
+)
+
+order_daily_rollups = Table(
+    "order_daily_rollups", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("day", Date, nullable=False, index=True),
+    Column("plan_id", Integer, nullable=False),
+    Column("status", String(20), nullable=False),
+    Column("count", Integer, nullable=False),
+    Column("amount", Float, nullable=False),
+    Column("discount_amount", Float, nullable=False),
+    UniqueConstraint("day", "plan_id", "status", name="uq_order_rollup")
+)
+
+signup_daily_rollups = Table(
+    "signup_daily_rollups", metadata,
+    Column("day", Date, primary_key=True),
+    Column("count", Integer, nullable=False)
+)
+
+rollup_states = Table(
+    "rollup_states", metadata,
+    Column("name", String(50), primary_key=True),
+    Column("rolled_through", Date, nullable=True),
+    Column("updated_at", DateTime)
+)
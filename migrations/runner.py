@@ -0,0 +1,90 @@
+import asyncio
+import logging
+from datetime import datetime
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, select, insert, func, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from migrations.versions import MIGRATIONS, HEAD
+
+logger = logging.getLogger(__name__)
+
+# جدول نسخه بیرون از Base.metadata است تا create_all آن را مدیریت نکند
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String(200)),
+    Column("applied_at", DateTime)
+)
+
+# کلید advisory lock در PostgreSQL تا چند نمونه ربات همزمان مهاجرت نکنند
+PG_LOCK_KEY = 7412001
+
+async def current_version(engine: AsyncEngine) -> int:
+    """نسخه فعلی شما؛ صفر یعنی دیتابیس هنوز نسخه‌گذاری نشده"""
+    async with engine.connect() as conn:
+        try:
+            result = await conn.execute(select(func.max(schema_version.c.version)))
+            return result.scalar() or 0
+        except DBAPIError:
+            return 0
+
+async def upgrade(engine: AsyncEngine) -> int:
+    """اعمال مراحل باقی‌مانده؛ اگر دیتابیس در head باشد فقط یک کوئری اجرا می‌شود"""
+    version = await current_version(engine)
+    if version >= HEAD:
+        logger.debug(f"Database schema at head (version {version})")
+        return version
+
+    postgres = engine.dialect.name == "postgresql"
+    async with engine.connect() as lock_conn:
+        if postgres:
+            await lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": PG_LOCK_KEY})
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(lambda sync_conn: schema_version.create(sync_conn, checkfirst=True))
+
+            # نمونه دیگری ممکن است در زمان انتظار برای قفل مهاجرت کرده باشد
+            version = await current_version(engine)
+            for migration in MIGRATIONS:
+                if migration.version <= version:
+                    continue
+                logger.info(f"Applying migration {migration.version}: {migration.description}")
+                if migration.online and postgres:
+                    async with engine.connect() as conn:
+                        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                        await conn.run_sync(migration.upgrade)
+                        await conn.execute(_version_row(migration))
+                else:
+                    async with engine.begin() as conn:
+                        await conn.run_sync(migration.upgrade)
+                        await conn.execute(_version_row(migration))
+                version = migration.version
+        finally:
+            if postgres:
+                await lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": PG_LOCK_KEY})
+                await lock_conn.commit()
+
+    logger.info(f"Database schema upgraded to version {version}")
+    return version
+
+def _version_row(migration):
+    return insert(schema_version).values(
+        version=migration.version,
+        description=migration.description,
+        applied_at=datetime.now()
+    )
+
+async def main():
+    from database import engine
+    before = await current_version(engine)
+    after = await upgrade(engine)
+    print(f"schema version: {before} -> {after} (head {HEAD})")
+    await engine.dispose()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
+
+# نمونه استفاده
+# python -m migrations.runner
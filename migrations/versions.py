@@ -0,0 +1,189 @@
+import logging
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.schema import CreateIndex
+from database import Base
+from migrations import baseline as baseline_schema
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Migration:
+    """یک مرحله مهاجرت
+
+    online=True یعنی در PostgreSQL بیرون از تراکنش اجرا می‌شود (برای
+    CREATE INDEX CONCURRENTLY). همه مراحل باید idempotent باشند، چون
+    دیتابیس‌های قبل از نسخه‌گذاری بخشی از جدول‌ها و ستون‌ها را از قبل دارند.
+    """
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+    online: bool = False
+
+def load_models():
+    """ایمپورت همه مدل‌ها تا در Base.metadata ثبت شوند"""
+    import models.user  # noqa: F401
+    import models.plan  # noqa: F401
+    import models.order  # noqa: F401
+    import models.payment  # noqa: F401
+    import models.referral  # noqa: F401
+    import models.discount  # noqa: F401
+    import models.agent_request  # noqa: F401
+    import models.rollup  # noqa: F401
+    import models.wallet  # noqa: F401
+    import models.conversation_state  # noqa: F401
+
+def add_column_if_missing(connection: Connection, table: str, column: str, ddl_type: str):
+    """افزودن ستون nullable در صورت نبودن"""
+    columns = {col["name"] for col in inspect(connection).get_columns(table)}
+    if column not in columns:
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+        logger.info(f"Added column {table}.{column}")
+
+def create_missing_indexes(connection: Connection, tables: Optional[List[str]] = None):
+    """ساخت ایندکس‌های تعریف‌شده در مدل‌ها که در دیتابیس وجود ندارند
+
+    در PostgreSQL ایندکس با CONCURRENTLY ساخته می‌شود تا جدول در طول ساخت قفل
+    نوشتن نشود؛ ایندکس نیمه‌کاره (invalid) از اجرای ناموفق قبلی حذف و دوباره
+    ساخته می‌شود. ایندکسی که ستونش هنوز اضافه نشده رد می‌شود؛ مرحله‌ای که آن
+    ستون را اضافه می‌کند ایندکس را هم می‌سازد.
+    """
+    inspector = inspect(connection)
+    postgres = connection.dialect.name == "postgresql"
+
+    for table in Base.metadata.sorted_tables:
+        if tables and table.name not in tables:
+            continue
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+
+        for index in table.indexes:
+            if postgres and index.name in existing and not _pg_index_valid(connection, index.name):
+                connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}"))
+                existing.discard(index.name)
+            if index.name in existing:
+                continue
+            if any(column.name not in columns for column in index.columns):
+                continue
+
+            ddl = str(CreateIndex(index).compile(dialect=connection.dialect))
+            if postgres:
+                ddl = ddl.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)
+                ddl = ddl.replace("CREATE UNIQUE INDEX", "CREATE UNIQUE INDEX CONCURRENTLY", 1)
+            connection.execute(text(ddl))
+            logger.info(f"Created index {index.name}")
+
+def drop_index_if_exists(connection: Connection, table: str, name: str):
+    """حذف ایندکس جایگزین‌شده (در PostgreSQL با CONCURRENTLY)"""
+    inspector = inspect(connection)
+    if not inspector.has_table(table):
+        return
+    if name not in {index["name"] for index in inspector.get_indexes(table)}:
+        return
+
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    elif dialect == "mysql":
+        connection.execute(text(f"DROP INDEX {name} ON {table}"))
+    else:
+        connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    logger.info(f"Dropped index {name}")
+
+def _pg_index_valid(connection: Connection, name: str) -> bool:
+    result = connection.execute(
+        text(
+            "SELECT i.indisvalid FROM pg_class c "
+            "JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname = :name"
+        ),
+        {"name": name}
+    )
+    valid = result.scalar()
+    return valid is None or bool(valid)
+
+# مراحل
+
+def baseline(connection: Connection):
+    """ساخت جدول‌های پایه‌ای که وجود ندارند، از تعریف ثابت migrations.baseline"""
+    baseline_schema.metadata.create_all(connection, checkfirst=True)
+
+def create_model_tables(connection: Connection, *names: str):
+    """ساخت جدول‌های نام‌برده از روی مدل‌ها در صورت نبودن"""
+    load_models()
+    tables = [Base.metadata.tables[name] for name in names]
+    Base.metadata.create_all(connection, tables=tables, checkfirst=True)
+
+def add_order_hiddify_panel(connection: Connection):
+    """ستون نود هیدیفای سفارش (برای دیتابیس‌های ساخته‌شده قبل از چندپنلی)"""
+    add_column_if_missing(connection, "orders", "hiddify_panel", "VARCHAR(50)")
+
+def add_query_indexes(connection: Connection):
+    """ایندکس‌های کوئری‌های پرتکرار روی جدول‌های موجود"""
+    load_models()
+    create_missing_indexes(connection)
+
+def wallet_ledger(connection: Connection):
+    """جدول‌های دفتر کل کیف پول و ردیف افتتاحیه برای موجودی‌های قبلی"""
+    create_model_tables(connection, "wallet_ledger", "wallet_snapshots")
+    connection.execute(text(
+        "INSERT INTO wallet_ledger (user_id, amount, balance_after, entry_type, description, created_at) "
+        "SELECT u.id, CAST(ROUND(u.wallet_balance) AS INTEGER), CAST(ROUND(u.wallet_balance) AS INTEGER), "
+        "'opening', 'موجودی افتتاحیه', CURRENT_TIMESTAMP FROM users u "
+        "WHERE u.wallet_balance IS NOT NULL AND u.wallet_balance <> 0 "
+        "AND NOT EXISTS (SELECT 1 FROM wallet_ledger w WHERE w.user_id = u.id)"
+    ))
+
+def keyset_indexes(connection: Connection):
+    """ایندکس‌های (..., created_at, id) برای صفحه‌بندی keyset
+
+    ایندکس‌های جدید اول ساخته می‌شوند و بعد ایندکس‌هایی که پیشوند آن‌ها هستند
+    حذف می‌شوند تا کوئری‌ها هیچ لحظه‌ای بدون ایندکس نمانند.
+    """
+    load_models()
+    create_missing_indexes(connection)
+    for table, name in [
+        ("users", "ix_users_created_at"),
+        ("payments", "ix_payments_created_at"),
+        ("payments", "ix_payments_user_created"),
+        ("payments", "ix_payments_status_created"),
+        ("referrals", "ix_referrals_referrer_created"),
+        ("agent_requests", "ix_agent_requests_status"),
+    ]:
+        drop_index_if_exists(connection, table, name)
+
+def conversation_states(connection: Connection):
+    """جدول وضعیت گفتگوی کاربران (برای STATE_STORE=sql)"""
+    create_model_tables(connection, "conversation_states")
+
+def hiddify_user_panels(connection: Connection):
+    """ثبت نود هیدیفای کنار لینک کاربر و وضعیت آینه (ردیف‌های قبلی روی نود پیش‌فرض هستند)"""
+    load_models()
+    add_column_if_missing(connection, "user_hiddify", "hiddify_panel", "VARCHAR(50)")
+    add_column_if_missing(connection, "hiddify_user_states", "panel", "VARCHAR(50)")
+    create_missing_indexes(connection, ["hiddify_user_states"])
+
+def rollup_dirty_days(connection: Connection):
+    """جدول روزهای خلاصه‌ای که بعد از تغییر وضعیت باید دوباره ساخته شوند"""
+    create_model_tables(connection, "rollup_dirty_days")
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline schema", baseline),
+    Migration(2, "orders.hiddify_panel column", add_order_hiddify_panel),
+    Migration(3, "composite indexes for hot queries", add_query_indexes, online=True),
+    Migration(4, "wallet ledger and snapshots", wallet_ledger),
+    Migration(5, "keyset pagination indexes", keyset_indexes, online=True),
+    Migration(6, "conversation states", conversation_states),
+    Migration(7, "hiddify panel per user and mirror state", hiddify_user_panels, online=True),
+    Migration(8, "rollup dirty days", rollup_dirty_days),
+]
+
+HEAD = MIGRATIONS[-1].version
+
+# نمونه افزودن مرحله جدید (به انتهای MIGRATIONS)
+# def add_users_language(connection):
+#     add_column_if_missing(connection, "users", "language", "VARCHAR(10)")
+# Migration(9, "users.language column", add_users_language),
@@ -1,12 +1,15 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Index
 from sqlalchemy.sql import func
 from database import Base
 
 class AgentRequest(Base):
     __tablename__ = "agent_requests"
+    __table_args__ = (
+        Index("ix_agent_requests_status_created_id", "status", "created_at", "id"),  # درخواست‌های در انتظار
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     
     # اطلاعات درخواست
     full_name = Column(String(100), nullable=False)
@@ -0,0 +1,13 @@
+from sqlalchemy import Column, BigInteger, String, DateTime
+from sqlalchemy.sql import func
+from database import Base
+
+class ConversationState(Base):
+    """وضعیت گفتگوی کاربر (مثلاً در انتظار اطلاعات فرم نمایندگی)"""
+    __tablename__ = "conversation_states"
+
+    user_id = Column(BigInteger, primary_key=True)  # آیدی تلگرام کاربر
+    state = Column(String(100), nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)  # پاکسازی دوره‌ای ردیف‌های منقضی
+
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
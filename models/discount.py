@@ -1,9 +1,12 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Index
 from sqlalchemy.sql import func
 from database import Base
 
 class DiscountCode(Base):
     __tablename__ = "discount_codes"
+    __table_args__ = (
+        Index("ix_discount_codes_created_id", "created_at", "id"),  # لیست کدها
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     code = Column(String(50), unique=True, index=True, nullable=False)
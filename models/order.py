@@ -1,9 +1,12 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, Text, ForeignKey, Index
 from sqlalchemy.sql import func
 from database import Base
 
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        Index("ix_orders_user_created", "user_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -24,7 +27,8 @@ class Order(Base):
     
     # اطلاعات هیدیفای
     hiddify_uuid = Column(String(50), nullable=True)
+    hiddify_panel = Column(String(50), nullable=True)  # نام نود هیدیفای که کاربر روی آن ساخته شده
     secret_uuid = Column(String(50), nullable=True)
     
-    created_at = Column(DateTime, default=func.now())
+    created_at = Column(DateTime, default=func.now(), index=True)
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
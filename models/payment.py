@@ -1,9 +1,15 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, Text, ForeignKey, Index
 from sqlalchemy.sql import func
 from database import Base
 
 class Payment(Base):
     __tablename__ = "payments"
+    __table_args__ = (
+        # id انتهای ایندکس‌ها برای صفحه‌بندی keyset روی (created_at, id) است
+        Index("ix_payments_user_created_id", "user_id", "created_at", "id"),  # تاریخچه پرداخت کاربر
+        Index("ix_payments_status_created_id", "status", "created_at", "id"),  # پرداخت‌های در انتظار و آمار
+        Index("ix_payments_created_id", "created_at", "id"),  # همه پرداخت‌ها
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -18,7 +24,7 @@ class Payment(Base):
     payment_gateway = Column(String(50), nullable=True)  # نام درگاه (زرین‌پال، نکست‌پی، ...)
     
     # شناسه پرداخت
-    transaction_id = Column(String(100), nullable=True)
+    transaction_id = Column(String(100), nullable=True, index=True)
     authority = Column(String(100), nullable=True)  # برای زرین‌پال
     
     # وضعیت
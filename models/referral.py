@@ -1,9 +1,14 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Index
 from sqlalchemy.sql import func
 from database import Base
 
 class Referral(Base):
     __tablename__ = "referrals"
+    __table_args__ = (
+        Index("ix_referrals_referrer_status", "referrer_id", "commission_status"),
+        Index("ix_referrals_referrer_created_id", "referrer_id", "created_at", "id"),  # آخرین معرفی‌شده‌ها
+        Index("ix_referrals_status_created", "commission_status", "created_at"),  # کمیسیون‌های در انتظار
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     referrer_id = Column(Integer, ForeignKey("users.id"), nullable=False)  # کاربر معرف
@@ -17,3 +22,17 @@ class Referral(Base):
     order_id = Column(Integer, nullable=True)
     
     created_at = Column(DateTime, default=func.now())
+
+class ReferralSummary(Base):
+    """خلاصه رفرال هر کاربر که همزمان با ثبت رفرال و پرداخت کمیسیون بروز می‌شود"""
+    __tablename__ = "referral_summaries"
+    
+    referrer_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    referred_count = Column(Integer, default=0, nullable=False)
+    paid_commission = Column(Float, default=0.0, nullable=False)
+    pending_commission = Column(Float, default=0.0, nullable=False)
+    
+    # آخرین کاربران معرفی‌شده به صورت JSON: [{"user_id", "name", "created_at"}]
+    recent_referrals = Column(Text, nullable=True)
+    
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
@@ -0,0 +1,57 @@
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, UniqueConstraint
+from sqlalchemy.sql import func
+from database import Base
+
+class PaymentDailyRollup(Base):
+    """خلاصه روزانه پرداخت‌ها به تفکیک وضعیت، روش و درگاه"""
+    __tablename__ = "payment_daily_rollups"
+    __table_args__ = (
+        UniqueConstraint("day", "status", "payment_method", "payment_gateway", name="uq_payment_rollup"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False, index=True)
+    status = Column(String(20), nullable=False)
+    payment_method = Column(String(50), nullable=False)
+    payment_gateway = Column(String(50), nullable=False, default="")  # خالی یعنی بدون درگاه
+
+    count = Column(Integer, default=0, nullable=False)
+    amount = Column(Float, default=0.0, nullable=False)
+
+class OrderDailyRollup(Base):
+    """خلاصه روزانه سفارش‌ها به تفکیک پلن و وضعیت"""
+    __tablename__ = "order_daily_rollups"
+    __table_args__ = (
+        UniqueConstraint("day", "plan_id", "status", name="uq_order_rollup"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False, index=True)
+    plan_id = Column(Integer, nullable=False)
+    status = Column(String(20), nullable=False)
+
+    count = Column(Integer, default=0, nullable=False)
+    amount = Column(Float, default=0.0, nullable=False)  # مجموع قیمت
+    discount_amount = Column(Float, default=0.0, nullable=False)
+
+class SignupDailyRollup(Base):
+    """تعداد ثبت‌نام روزانه کاربران"""
+    __tablename__ = "signup_daily_rollups"
+
+    day = Column(Date, primary_key=True)
+    count = Column(Integer, default=0, nullable=False)
+
+class RollupDirtyDay(Base):
+    """روز خلاصه‌شده‌ای که وضعیت ردیفی از آن بعداً تغییر کرده و باید دوباره ساخته شود"""
+    __tablename__ = "rollup_dirty_days"
+
+    name = Column(String(50), primary_key=True)  # نام خلاصه (payments، orders)
+    day = Column(Date, primary_key=True)
+
+class RollupState(Base):
+    """آخرین روزی که هر خلاصه تا آن ساخته شده است"""
+    __tablename__ = "rollup_states"
+
+    name = Column(String(50), primary_key=True)
+    rolled_through = Column(Date, nullable=True)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
@@ -1,10 +1,13 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Text, ForeignKey, Index
 from sqlalchemy.sql import func
 from database import Base
 from datetime import datetime
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_created_id", "created_at", "id"),  # لیست کاربران و ثبت‌نام روزانه
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     telegram_id = Column(Integer, unique=True, index=True, nullable=False)
@@ -35,7 +38,30 @@ class UserHiddify(Base):
     __tablename__ = "user_hiddify"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, nullable=False)  # آیدی کاربر ربات
+    user_id = Column(Integer, nullable=False, index=True)  # آیدی کاربر ربات
     hiddify_uuid = Column(String(50), unique=True, index=True, nullable=False)
     secret_uuid = Column(String(50), unique=True, nullable=False)
+    hiddify_panel = Column(String(50), nullable=True)  # نود هیدیفای کاربر (خالی یعنی نود پیش‌فرض)
     created_at = Column(DateTime, default=func.now())
+
+class HiddifyUserState(Base):
+    """آینه محلی وضعیت کاربران هیدیفای (از طریق hiddify_uuid به UserHiddify متصل است)"""
+    __tablename__ = "hiddify_user_states"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    hiddify_uuid = Column(String(50), unique=True, index=True, nullable=False)
+    panel = Column(String(50), nullable=True, index=True)  # نودی که این وضعیت از آن خوانده شده
+    name = Column(String(100), nullable=True)
+    
+    # مصرف و اعتبار
+    usage_limit_gb = Column(Float, default=0.0)
+    current_usage_gb = Column(Float, default=0.0)
+    package_days = Column(Integer, default=0)
+    start_date = Column(DateTime, nullable=True)
+    mode = Column(String(50), nullable=True)
+    enable = Column(Boolean, default=True)
+    last_online = Column(DateTime, nullable=True)
+    
+    # داده خام پنل (JSON) برای تشخیص تغییرات
+    raw_data = Column(Text, nullable=True)
+    synced_at = Column(DateTime, default=func.now())
@@ -0,0 +1,37 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
+from sqlalchemy.sql import func
+from database import Base
+
+class WalletLedgerEntry(Base):
+    """دفتر کل کیف پول (فقط افزودنی؛ هیچ ردیفی ویرایش یا حذف نمی‌شود)"""
+    __tablename__ = "wallet_ledger"
+    __table_args__ = (
+        Index("ix_wallet_ledger_user_id_id", "user_id", "id"),  # صفحه‌بندی و بازسازی موجودی
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+
+    # مبالغ به تومان و عدد صحیح؛ مثبت واریز و منفی برداشت
+    amount = Column(Integer, nullable=False)
+    balance_after = Column(Integer, nullable=False)
+
+    entry_type = Column(String(20), nullable=False)  # opening, credit, debit, transfer_in, transfer_out, adjust
+    description = Column(String(255), nullable=True)
+    payment_id = Column(Integer, nullable=True)
+
+    created_at = Column(DateTime, default=func.now())
+
+class WalletSnapshot(Base):
+    """موجودی کاربر تا یک ردیف مشخص از دفتر کل"""
+    __tablename__ = "wallet_snapshots"
+    __table_args__ = (
+        Index("ix_wallet_snapshots_user_ledger", "user_id", "ledger_id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    ledger_id = Column(Integer, nullable=False)  # آخرین ردیف دفتر کل که در موجودی حساب شده
+    balance = Column(Integer, nullable=False)
+
+    created_at = Column(DateTime, default=func.now())
@@ -9,29 +9,19 @@ class DiscountAdmin:
         self.db = db
         self.discount_manager = DiscountManager(db)
     
-    async def show_discounts_list(self, query, page: int = 1):
-        """نمایش لیست کدهای تخفیف"""
+    async def show_discounts_list(self, query, page: int = 1, cursor: str = None):
+        """نمایش لیست کدهای تخفیف (cursor از دکمه صفحه بعد می‌آید)"""
         per_page = 10
-        # در اینجا باید تعداد کل کدها رو محاسبه کنیم
-        from models.discount import DiscountCode
-        count_result = await self.db.execute(select(func.count(DiscountCode.id)))
-        total_discounts = count_result.scalar_one()
-        total_pages = (total_discounts + per_page - 1) // per_page
+        total_discounts = await self.discount_manager.get_discounts_count()
         
         # دریافت کدهای تخفیف
-        offset = (page - 1) * per_page
-        result = await self.db.execute(
-            select(DiscountCode)
-            .order_by(DiscountCode.created_at.desc())
-            .offset(offset).limit(per_page)
-        )
-        discounts = result.scalars().all()
+        discounts = await self.discount_manager.get_all_discounts(cursor=cursor, per_page=per_page)
         
         if not discounts:
             discounts_text = "❌ هیچ کد تخفیفی تعریف نشده است."
         else:
             discounts_text = "🏷️ لیست کدهای تخفیف:\n"
-            for i, discount in enumerate(discounts, 1):
+            for i, discount in enumerate(discounts, (page - 1) * per_page + 1):
                 status = "فعال" if discount.is_active else "غیرفعال"
                 discount_type = "درصدی" if discount.discount_type == "percentage" else "ثابت"
                 
@@ -47,7 +37,7 @@ class DiscountAdmin:
         
         discounts_info = f"""
 🏷️ مدیریت کدهای تخفیف:
-صفحه {page} از {total_pages}
+صفحه {page}
 تعداد کل کدها: {total_discounts}
 
 {discounts_text}
@@ -59,7 +49,7 @@ class DiscountAdmin:
 • حذف کدها
 """
         
-        keyboard = Keyboards.admin_discounts_navigation(page, total_pages)
+        keyboard = Keyboards.admin_discounts_navigation(page, discounts.next_cursor)
         await query.edit_message_text(discounts_info, reply_markup=keyboard)
     
     async def show_create_discount_form(self, query):
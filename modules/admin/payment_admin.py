@@ -1,18 +1,21 @@
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from modules.payment_manager import PaymentManager
-from modules.user_manager import UserManager
+from modules.user_manager import UserManager, UserLoader
 from utils.helpers import Helpers
 from utils.keyboards import Keyboards
 
 class PaymentAdmin:
-    def __init__(self, db: AsyncSession):
+    def __init__(self, db: AsyncSession, panels=None):
         self.db = db
+        self.panels = panels  # PanelRegistry برای تحویل سفارش‌های پرداخت‌شده
         self.payment_manager = PaymentManager(db)
         self.user_manager = UserManager(db)
+        self.user_loader = UserLoader(db)
     
-    async def show_payments_list(self, query, page: int = 1, status: str = "all"):
-        """نمایش لیست پرداخت‌ها برای ادمین"""
+    async def show_payments_list(self, query, page: int = 1, status: str = "all",
+                                cursor: str = None):
+        """نمایش لیست پرداخت‌ها برای ادمین (cursor از دکمه صفحه بعد می‌آید)"""
         per_page = 10
         if status == "all":
             # دریافت آمار کلی
@@ -20,14 +23,6 @@ class PaymentAdmin:
             success_payments = await self.payment_manager.get_success_payments_count()
             failed_payments = await self.payment_manager.get_failed_payments_count()
             pending_payments = await self.payment_manager.get_pending_payments_count()
-        elif status == "pending":
-            payments = await self.payment_manager.get_pending_payments(page=page, per_page=per_page)
-            total_payments = await self.payment_manager.get_pending_payments_count()
-        else:
-            # برای سایر وضعیت‌ها
-            pass
-        
-        total_pages = (total_payments + per_page - 1) // per_page
         
         if status == "all":
             payments_text = "📊 آمار کلی پرداخت‌ها:\n"
@@ -41,23 +36,17 @@ class PaymentAdmin:
             payments_text = f"📋 پرداخت‌های {self._get_status_persian(status)}:\n"
         
         if status == "pending":
-            payments = await self.payment_manager.get_pending_payments(page=page, per_page=per_page)
+            payments = await self.payment_manager.get_pending_payments(cursor=cursor, per_page=per_page)
         else:
             # دریافت آخرین پرداخت‌ها
-            from models.payment import Payment
-            offset = (page - 1) * per_page
-            result = await self.db.execute(
-                select(Payment)
-                .order_by(Payment.created_at.desc())
-                .offset(offset).limit(per_page)
-            )
-            payments = result.scalars().all()
+            payments = await self.payment_manager.get_recent_payments(cursor=cursor, per_page=per_page)
         
         if not payments:
             payments_text += "❌ هیچ پرداختی ثبت نشده است."
         else:
-            for i, payment in enumerate(payments, 1):
-                user = await self.user_manager.get_user_by_id(payment.user_id)
+            # کاربران همه ردیف‌ها با یک کوئری
+            users = await self.user_loader.load_many(payment.user_id for payment in payments)
+            for i, (payment, user) in enumerate(zip(payments, users), (page - 1) * per_page + 1):
                 user_name = "ناشناس"
                 if user:
                     name = f"{user.first_name or ''} {user.last_name or ''}".strip()
@@ -80,7 +69,7 @@ class PaymentAdmin:
         
         payments_info = f"""
 💰 مدیریت پرداخت‌ها:
-صفحه {page} از {total_pages}
+صفحه {page}
 
 {payments_text}
 
@@ -90,12 +79,12 @@ class PaymentAdmin:
 • مشاهده آمار کلی پرداخت‌ها
 """
         
-        keyboard = Keyboards.admin_payments_navigation(page, total_pages, status)
+        keyboard = Keyboards.admin_payments_navigation(page, payments.next_cursor, status)
         await query.edit_message_text(payments_info, reply_markup=keyboard)
     
-    async def show_pending_payments(self, query, page: int = 1):
+    async def show_pending_payments(self, query, page: int = 1, cursor: str = None):
         """نمایش پرداخت‌های در انتظار تایید"""
-        await self.show_payments_list(query, page, "pending")
+        await self.show_payments_list(query, page, "pending", cursor)
     
     async def show_payment_details(self, query, payment_id):
         """نمایش جزئیات پرداخت"""
@@ -109,7 +98,7 @@ class PaymentAdmin:
             await query.answer("❌ پرداخت یافت نشد!")
             return
         
-        user = await self.user_manager.get_user_by_id(payment.user_id)
+        user = await self.user_loader.load(payment.user_id)
         user_name = "ناشناس"
         if user:
             name = f"{user.first_name or ''} {user.last_name or ''}".strip()
@@ -174,13 +163,23 @@ class PaymentAdmin:
         
         if success:
             action_text = "تایید" if is_success else "رد"
+            result_text = f"✅ پرداخت با موفقیت {action_text} شد!"
+            
+            # پرداخت سفارش با ساخت سرویس تحویل می‌شود، بقیه پرداخت‌ها شارژ کیف پول هستند
+            if is_success and payment.order_id:
+                node_name = await self._complete_order(payment)
+                if node_name:
+                    result_text += f"\n🔌 سرویس روی نود {node_name} ساخته شد."
+                else:
+                    result_text += "\n⚠️ ساخت سرویس ناموفق بود؛ سفارش در وضعیت پرداخت‌شده ماند."
+            
             await query.edit_message_text(
-                f"✅ پرداخت با موفقیت {action_text} شد!",
+                result_text,
                 reply_markup=Keyboards.admin_back_to_payments()
             )
             
-            # اگر پرداخت تایید شد، موجودی کیف پول را افزایش دهیم
-            if is_success:
+            # اگر پرداخت شارژ کیف پول بود، موجودی کیف پول را افزایش دهیم
+            if is_success and not payment.order_id:
                 from modules.wallet import WalletManager
                 wallet_manager = WalletManager(self.db)
                 await wallet_manager.add_to_wallet(
@@ -194,6 +193,22 @@ class PaymentAdmin:
                 reply_markup=Keyboards.admin_back_to_payments()
             )
     
+    async def _complete_order(self, payment) -> str:
+        """ساخت سرویس هیدیفای سفارش روی کم‌بارترین نود؛ نام نود یا رشته خالی"""
+        from models.order import Order
+        order = await self.db.get(Order, payment.order_id)
+        if order is None or self.panels is None:
+            return ""
+        
+        user = await self.user_loader.load(order.user_id)
+        result = await self.panels.provision_order(self.db, order, {
+            "name": f"{user.telegram_id if user else order.user_id}-{order.id}",
+            "usage_limit_GB": order.traffic_gb,
+            "package_days": order.days,
+            "comment": f"order #{order.id}"
+        })
+        return order.hiddify_panel if result is not None else ""
+    
     def _get_status_persian(self, status: str) -> str:
         """تبدیل وضعیت به فارسی"""
         status_map = {
@@ -1,147 +1,81 @@
-from sqlalchemy import select, func
+from sqlalchemy import select, func, and_, case, true
 from sqlalchemy.ext.asyncio import AsyncSession
+from database import time_bound
 from models.user import User
 from models.plan import Plan
 from models.payment import Payment
 from models.order import Order
 from models.referral import Referral
 from datetime import datetime, timedelta
+from utils.helpers import Helpers
 
 class StatsAdmin:
     def __init__(self, db: AsyncSession):
         self.db = db
     
     async def get_system_stats(self) -> dict:
-        """دریافت آمار کلی سیستم"""
-        # تعداد کاربران
-        users_count = await self.db.execute(select(func.count(User.id)))
-        total_users = users_count.scalar_one()
+        """دریافت آمار کلی سیستم با یک کوئری"""
+        result = await self.db.execute(self._system_stats_query())
+        return dict(result.mappings().one())
+    
+    def _system_stats_query(self):
+        """SELECT یکجای آمار داشبورد
+
+        مجموع‌ها برای هر جدول یک تجمیع شرطی (یک بار پیمایش) هستند. شمارنده‌های
+        «امروز» زیرکوئری جدا با WHERE روی بازه created_at هستند تا فقط بازه امروز
+        از ایندکس خوانده شود، نه کل جدول. مرزها با time_bound bind می‌شوند تا ردیف
+        ساعت ۰۰:۰۰:۰۰ در SQLite به روز خودش برسد.
+        """
+        today_start, today_end = map(time_bound, Helpers.day_bounds())
         
-        # تعداد کاربران فعال
-        active_users_count = await self.db.execute(
-            select(func.count(User.id)).where(User.is_active == True)
-        )
-        active_users = active_users_count.scalar_one()
+        def today(column):
+            return and_(column >= today_start, column < today_end)
         
-        # تعداد کاربران ادمین
-        admin_users_count = await self.db.execute(
-            select(func.count(User.id)).where(User.is_admin == True)
-        )
-        admin_users = admin_users_count.scalar_one()
+        users = select(
+            func.count(User.id).label("total_users"),
+            self._count_if(User.is_active == True).label("active_users"),
+            self._count_if(User.is_admin == True).label("admin_users")
+        ).subquery()
         
-        # تعداد پلن‌ها
-        plans_count = await self.db.execute(select(func.count(Plan.id)))
-        total_plans = plans_count.scalar_one()
+        plans = select(
+            func.count(Plan.id).label("total_plans"),
+            self._count_if(Plan.is_active == True).label("active_plans")
+        ).subquery()
         
-        # تعداد پلن‌های فعال
-        active_plans_count = await self.db.execute(
-            select(func.count(Plan.id)).where(Plan.is_active == True)
-        )
-        active_plans = active_plans_count.scalar_one()
+        orders = select(func.count(Order.id).label("total_orders")).subquery()
         
-        # تعداد سفارشات
-        orders_count = await self.db.execute(select(func.count(Order.id)))
-        total_orders = orders_count.scalar_one()
+        revenue = select(
+            func.coalesce(func.sum(Payment.amount), 0.0).label("total_revenue")
+        ).where(Payment.status == "success").subquery()
         
-        # تعداد سفارشات امروز
-        today = datetime.now().date()
-        today_orders_count = await self.db.execute(
-            select(func.count(Order.id))
-            .where(func.date(Order.created_at) == today)
+        today_users = select(func.count()).select_from(User).where(today(User.created_at))
+        today_orders = select(func.count()).select_from(Order).where(today(Order.created_at))
+        today_revenue = select(func.coalesce(func.sum(Payment.amount), 0.0)).where(
+            and_(Payment.status == "success", today(Payment.created_at))
         )
-        today_orders = today_orders_count.scalar_one()
         
-        # درآمد کل (پرداخت‌های موفق)
-        revenue_result = await self.db.execute(
-            select(func.sum(Payment.amount))
-            .where(Payment.status == "success")
-        )
-        total_revenue = revenue_result.scalar_one() or 0.0
-        
-        # درآمد امروز
-        today_revenue_result = await self.db.execute(
-            select(func.sum(Payment.amount))
-            .where(
-                and_(
-                    Payment.status == "success",
-                    func.date(Payment.created_at) == today
-                )
+        return (
+            select(
+                users, plans, orders, revenue,
+                today_users.scalar_subquery().label("today_users"),
+                today_orders.scalar_subquery().label("today_orders"),
+                today_revenue.scalar_subquery().label("today_revenue")
             )
+            .select_from(users)
+            .join(plans, true())
+            .join(orders, true())
+            .join(revenue, true())
         )
-        today_revenue = today_revenue_result.scalar_one() or 0.0
-        
-        # کاربران امروز
-        today_users_result = await self.db.execute(
-            select(func.count(User.id))
-            .where(func.date(User.created_at) == today)
-        )
-        today_users = today_users_result.scalar_one()
-        
-        return {
-            "total_users": total_users,
-            "active_users": active_users,
-            "admin_users": admin_users,
-            "total_plans": total_plans,
-            "active_plans": active_plans,
-            "total_orders": total_orders,
-            "today_orders": today_orders,
-            "total_revenue": total_revenue,
-            "today_revenue": today_revenue,
-            "today_users": today_users
-        }
+    
+    @staticmethod
+    def _count_if(condition):
+        """شمارش شرطی داخل یک تجمیع"""
+        return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
     
     async def get_payment_statistics(self, days: int = 30) -> dict:
-        """دریافت آمار پرداخت‌ها در بازه زمانی"""
-        start_date = datetime.now() - timedelta(days=days)
-        
-        # پرداخت‌های موفق
-        success_result = await self.db.execute(
-            select(func.count(Payment.id), func.sum(Payment.amount))
-            .where(
-                and_(
-                    Payment.status == "success",
-                    Payment.created_at >= start_date
-                )
-            )
-        )
-        success_data = success_result.fetchone()
-        success_count = success_data[0] if success_data else 0
-        success_amount = success_data[1] if success_data else 0.0
-        
-        # پرداخت‌های ناموفق
-        failed_result = await self.db.execute(
-            select(func.count(Payment.id))
-            .where(
-                and_(
-                    Payment.status == "failed",
-                    Payment.created_at >= start_date
-                )
-            )
-        )
-        failed_count = failed_result.scalar_one() or 0
-        
-        # پرداخت‌های در انتظار
-        pending_result = await self.db.execute(
-            select(func.count(Payment.id))
-            .where(
-                and_(
-                    Payment.status == "pending",
-                    Payment.created_at >= start_date
-                )
-            )
-        )
-        pending_count = pending_result.scalar_one() or 0
-        
-        total_count = (success_count or 0) + (failed_count or 0) + (pending_count or 0)
-        conversion_rate = (success_count / total_count * 100) if total_count > 0 else 0
-        
-        return {
-            "success_count": success_count or 0,
-            "success_amount": success_amount or 0.0,
-            "failed_count": failed_count or 0,
-            "pending_count": pending_count or 0,
-            "conversion_rate": conversion_rate
-        }
+        """دریافت آمار پرداخت‌ها در بازه زمانی (از جدول‌های خلاصه روزانه)"""
+        from modules.rollup_manager import RollupManager
+        return await RollupManager(self.db).get_payment_statistics(days)
     
     async def get_top_referrers(self, limit: int = 10) -> list:
         """دریافت بهترین کاربران رفرال‌دهنده"""
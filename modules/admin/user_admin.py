@@ -1,6 +1,6 @@
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from modules.user_manager import UserManager
+from modules.user_manager import UserManager, UserLoader
 from utils.helpers import Helpers
 from utils.keyboards import Keyboards
 
@@ -8,13 +8,13 @@ class UserAdmin:
     def __init__(self, db: AsyncSession):
         self.db = db
         self.user_manager = UserManager(db)
+        self.user_loader = UserLoader(db)
     
-    async def show_users_list(self, query, page: int = 1):
-        """نمایش لیست کاربران برای ادمین"""
+    async def show_users_list(self, query, page: int = 1, cursor: str = None):
+        """نمایش لیست کاربران برای ادمین (cursor از دکمه صفحه بعد می‌آید)"""
         per_page = 10
-        users = await self.user_manager.get_all_users(page=page, per_page=per_page)
+        users = await self.user_manager.get_all_users(cursor=cursor, per_page=per_page)
         total_users = await self.user_manager.get_users_count()
-        total_pages = (total_users + per_page - 1) // per_page
         
         # دریافت آمار کلی
         active_users = await self.user_manager.get_active_users_count()
@@ -25,7 +25,9 @@ class UserAdmin:
             users_text = "❌ هیچ کاربری ثبت نشده است."
         else:
             users_text = "👥 لیست کاربران:\n"
-            for i, user in enumerate(users, 1):
+            # معرف‌های همه ردیف‌ها با یک کوئری
+            referrers = await self.user_loader.load_many(user.referred_by for user in users)
+            for i, (user, referrer) in enumerate(zip(users, referrers), (page - 1) * per_page + 1):
                 status = "فعال" if user.is_active else "غیرفعال"
                 if user.is_blocked:
                     status = "مسدود"
@@ -40,11 +42,13 @@ class UserAdmin:
                 users_text += f"   🆔 {user.telegram_id}\n"
                 users_text += f"   📊 وضعیت: {status}\n"
                 users_text += f"   💰 کیف پول: {Helpers.format_price(user.wallet_balance)}\n"
+                if referrer:
+                    users_text += f"   👥 معرف: {self._display_name(referrer)}\n"
                 users_text += f"   🆔 /edit_user_{user.id}\n\n"
         
         users_info = f"""
 👥 مدیریت کاربران:
-صفحه {page} از {total_pages}
+صفحه {page}
 📊 آمار کلی:
 ├─ تعداد کل کاربران: {total_users}
 ├─ کاربران فعال: {active_users}
@@ -60,7 +64,7 @@ class UserAdmin:
 • افزایش/کاهش کیف پول
 """
         
-        keyboard = Keyboards.admin_users_navigation(page, total_pages)
+        keyboard = Keyboards.admin_users_navigation(page, users.next_cursor)
         await query.edit_message_text(users_info, reply_markup=keyboard)
     
     async def show_user_details(self, query, user_id):
@@ -82,6 +86,9 @@ class UserAdmin:
         elif user.is_agent:
             status = "نماینده"
         
+        referrer = await self.user_loader.load(user.referred_by)
+        referrer_name = self._display_name(referrer) if referrer else "ندارد"
+        
         user_info = f"""
 👤 جزئیات کاربر: {name}
 🆔 شناسه کاربری: {user.id}
@@ -91,6 +98,7 @@ class UserAdmin:
 📊 وضعیت: {status}
 💰 کیف پول: {Helpers.format_price(user.wallet_balance)}
 🔗 کد رفرال: {user.referral_code}
+👥 معرف: {referrer_name}
 📅 تاریخ عضویت: {user.created_at.strftime('%Y/%m/%d %H:%M')}
 
 عملیات موجود:
@@ -285,7 +293,7 @@ class UserAdmin:
     async def search_users(self, query, search_query: str):
         """جستجوی کاربران"""
         try:
-            users = await self.user_manager.search_users(search_query, page=1, per_page=20)
+            users = await self.user_manager.search_users(search_query, per_page=20)
             
             if not users:
                 await query.edit_message_text(
@@ -321,3 +329,8 @@ class UserAdmin:
                 f"❌ خطا در جستجو: {str(e)}",
                 reply_markup=Keyboards.admin_back_to_users()
             )
+    
+    def _display_name(self, user) -> str:
+        """نام نمایشی کاربر"""
+        name = f"{user.first_name or ''} {user.last_name or ''}".strip()
+        return name or f"کاربر {user.telegram_id}"
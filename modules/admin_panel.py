@@ -1,10 +1,12 @@
 from sqlalchemy import select, func, and_
 from sqlalchemy.ext.asyncio import AsyncSession
+from database import commit_or_flush
 from models.user import User
 from models.plan import Plan
 from models.payment import Payment
 from models.order import Order
 from models.referral import Referral
+from modules.user_manager import UserIdentityCache
 from datetime import datetime, timedelta
 
 class AdminPanel:
@@ -13,40 +15,8 @@ class AdminPanel:
     
     async def get_system_stats(self) -> dict:
         """دریافت آمار کلی سیستم"""
-        # تعداد کاربران
-        users_count = await self.db.execute(select(func.count(User.id)))
-        total_users = users_count.scalar_one()
-        
-        # تعداد پلن‌ها
-        plans_count = await self.db.execute(select(func.count(Plan.id)))
-        total_plans = plans_count.scalar_one()
-        
-        # تعداد سفارشات
-        orders_count = await self.db.execute(select(func.count(Order.id)))
-        total_orders = orders_count.scalar_one()
-        
-        # درآمد کل (پرداخت‌های موفق)
-        revenue_result = await self.db.execute(
-            select(func.sum(Payment.amount))
-            .where(Payment.status == "success")
-        )
-        total_revenue = revenue_result.scalar_one() or 0.0
-        
-        # کاربران امروز
-        today = datetime.now().date()
-        today_users_result = await self.db.execute(
-            select(func.count(User.id))
-            .where(func.date(User.created_at) == today)
-        )
-        today_users = today_users_result.scalar_one()
-        
-        return {
-            "total_users": total_users,
-            "total_plans": total_plans,
-            "total_orders": total_orders,
-            "total_revenue": total_revenue,
-            "today_users": today_users
-        }
+        from modules.admin.stats_admin import StatsAdmin
+        return await StatsAdmin(self.db).get_system_stats()
     
     async def get_recent_users(self, limit: int = 10) -> list:
         """دریافت جدیدترین کاربران"""
@@ -83,7 +53,8 @@ class AdminPanel:
         if user:
             user.is_active = False
             user.updated_at = datetime.now()
-            await self.db.commit()
+            await commit_or_flush(self.db)
+            UserIdentityCache.invalidate(user.telegram_id)
             return True
         return False
     
@@ -97,7 +68,8 @@ class AdminPanel:
         if user:
             user.is_active = True
             user.updated_at = datetime.now()
-            await self.db.commit()
+            await commit_or_flush(self.db)
+            UserIdentityCache.invalidate(user.telegram_id)
             return True
         return False
     
@@ -111,49 +83,15 @@ class AdminPanel:
         if user:
             user.is_admin = is_admin
             user.updated_at = datetime.now()
-            await self.db.commit()
+            await commit_or_flush(self.db)
+            UserIdentityCache.invalidate(user.telegram_id)
             return True
         return False
     
     async def get_payment_statistics(self, days: int = 30) -> dict:
-        """دریافت آمار پرداخت‌ها در بازه زمانی"""
-        start_date = datetime.now() - timedelta(days=days)
-        
-        # پرداخت‌های موفق
-        success_result = await self.db.execute(
-            select(func.count(Payment.id), func.sum(Payment.amount))
-            .where(
-                and_(
-                    Payment.status == "success",
-                    Payment.created_at >= start_date
-                )
-            )
-        )
-        success_data = success_result.fetchone()
-        success_count = success_data[0] if success_data else 0
-        success_amount = success_data[1] if success_data else 0.0
-        
-        # پرداخت‌های ناموفق
-        failed_result = await self.db.execute(
-            select(func.count(Payment.id))
-            .where(
-                and_(
-                    Payment.status == "failed",
-                    Payment.created_at >= start_date
-                )
-            )
-        )
-        failed_count = failed_result.scalar_one() or 0
-        
-        total_count = (success_count or 0) + (failed_count or 0)
-        conversion_rate = (success_count / total_count * 100) if total_count > 0 else 0
-        
-        return {
-            "success_count": success_count or 0,
-            "success_amount": success_amount or 0.0,
-            "failed_count": failed_count or 0,
-            "conversion_rate": conversion_rate
-        }
+        """دریافت آمار پرداخت‌ها در بازه زمانی (از جدول‌های خلاصه روزانه)"""
+        from modules.rollup_manager import RollupManager
+        return await RollupManager(self.db).get_payment_statistics(days)
     
     async def get_top_referrers(self, limit: int = 10) -> list:
         """دریافت بهترین کاربران رفرال‌دهنده"""
@@ -1,6 +1,8 @@
-from sqlalchemy import select
+from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
+from database import commit_or_flush
 from models.agent_request import AgentRequest
+from utils.pagination import Keyset, Page
 from datetime import datetime
 
 class AgentManager:
@@ -21,7 +23,7 @@ class AgentManager:
         )
         
         self.db.add(agent_request)
-        await self.db.commit()
+        await commit_or_flush(self.db)
         await self.db.refresh(agent_request)
         return agent_request
     
@@ -39,16 +41,15 @@ class AgentManager:
         )
         return result.scalar_one_or_none()
     
-    async def get_pending_requests(self, page: int = 1, per_page: int = 20) -> list:
+    async def get_pending_requests(self, cursor: str = None, per_page: int = 20) -> Page:
         """دریافت درخواست‌های در انتظار تایید"""
-        offset = (page - 1) * per_page
         result = await self.db.execute(
-            select(AgentRequest)
-            .where(AgentRequest.status == "pending")
-            .order_by(AgentRequest.created_at.desc())
-            .offset(offset).limit(per_page)
+            Keyset.apply(
+                select(AgentRequest).where(AgentRequest.status == "pending"),
+                AgentRequest.created_at, AgentRequest.id, cursor, per_page
+            )
         )
-        return result.scalars().all()
+        return Keyset.page(result.scalars(), per_page)
     
     async def approve_agent_request(self, request_id: int) -> bool:
         """تایید درخواست نمایندگی"""
@@ -66,7 +67,7 @@ class AgentManager:
             user_manager = UserManager(self.db)
             await user_manager.set_user_agent(request.user_id, True)
             
-            await self.db.commit()
+            await commit_or_flush(self.db)
             return True
         return False
     
@@ -81,7 +82,7 @@ class AgentManager:
             request.status = "rejected"
             request.rejection_reason = reason
             request.updated_at = datetime.now()
-            await self.db.commit()
+            await commit_or_flush(self.db)
             return True
         return False
     
@@ -0,0 +1,61 @@
+import logging
+from datetime import datetime
+from typing import List, Optional
+from telegram import Bot, BotCommand, User
+from config import Config
+from utils.background import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+class BotIdentity:
+    """اطلاعات ثابت ربات (get_me و دستورات) که یک بار گرفته و دوره‌ای بروزرسانی می‌شود"""
+
+    def __init__(self, bot: Bot, refresh_interval: int = None):
+        self.bot = bot
+        self.me: Optional[User] = None
+        self.commands: List[BotCommand] = []
+        self.refreshed_at: Optional[datetime] = None
+        self._task = PeriodicTask(
+            "bot_identity",
+            refresh_interval or Config.BOT_IDENTITY_REFRESH_INTERVAL,
+            self.refresh,
+            run_immediately=False
+        )
+
+    async def load(self):
+        """بارگذاری اولیه؛ Bot.initialize خودش get_me را صدا زده، پس همان استفاده می‌شود"""
+        try:
+            self.me = self.bot.bot
+        except RuntimeError:
+            # ربات هنوز initialize نشده
+            self.me = await self.bot.get_me()
+        self.commands = list(await self.bot.get_my_commands())
+        self.refreshed_at = datetime.now()
+        logger.info(f"Bot identity loaded: @{self.me.username}")
+
+    async def refresh(self):
+        """بروزرسانی اطلاعات ربات از تلگرام"""
+        self.me = await self.bot.get_me()
+        self.commands = list(await self.bot.get_my_commands())
+        self.refreshed_at = datetime.now()
+
+    def start(self):
+        """شروع بروزرسانی دوره‌ای"""
+        self._task.start()
+
+    async def stop(self):
+        """توقف بروزرسانی دوره‌ای"""
+        await self._task.stop()
+
+    @property
+    def username(self) -> str:
+        return self.me.username if self.me else ""
+
+    def referral_link(self, referral_code: str) -> str:
+        """لینک دعوت بدون درخواست به تلگرام"""
+        return f"t.me/{self.username}?start={referral_code}"
+
+# نمونه استفاده
+# identity = BotIdentity(application.bot)
+# await identity.load()
+# link = identity.referral_link(user.referral_code)
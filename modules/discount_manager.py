@@ -1,6 +1,8 @@
-from sqlalchemy import select, and_
+from sqlalchemy import select, and_, func
 from sqlalchemy.ext.asyncio import AsyncSession
+from database import commit_or_flush
 from models.discount import DiscountCode
+from utils.pagination import Keyset, Page
 from datetime import datetime
 
 class DiscountManager:
@@ -23,7 +25,7 @@ class DiscountManager:
         )
         
         self.db.add(discount)
-        await self.db.commit()
+        await commit_or_flush(self.db)
         await self.db.refresh(discount)
         return discount
     
@@ -34,25 +36,37 @@ class DiscountManager:
         )
         return result.scalar_one_or_none()
     
-    async def get_active_discounts(self, page: int = 1, per_page: int = 20) -> list:
+    async def get_active_discounts(self, cursor: str = None, per_page: int = 20) -> Page:
         """دریافت کدهای تخفیف فعال"""
-        offset = (page - 1) * per_page
         now = datetime.now()
         
         result = await self.db.execute(
-            select(DiscountCode)
-            .where(
-                and_(
-                    DiscountCode.is_active == True,
-                    (DiscountCode.valid_from.is_(None) | (DiscountCode.valid_from <= now)),
-                    (DiscountCode.valid_until.is_(None) | (DiscountCode.valid_until >= now)),
-                    (DiscountCode.max_uses == 0) | (DiscountCode.used_count < DiscountCode.max_uses)
-                )
+            Keyset.apply(
+                select(DiscountCode)
+                .where(
+                    and_(
+                        DiscountCode.is_active == True,
+                        (DiscountCode.valid_from.is_(None) | (DiscountCode.valid_from <= now)),
+                        (DiscountCode.valid_until.is_(None) | (DiscountCode.valid_until >= now)),
+                        (DiscountCode.max_uses == 0) | (DiscountCode.used_count < DiscountCode.max_uses)
+                    )
+                ),
+                DiscountCode.created_at, DiscountCode.id, cursor, per_page
             )
-            .order_by(DiscountCode.created_at.desc())
-            .offset(offset).limit(per_page)
         )
-        return result.scalars().all()
+        return Keyset.page(result.scalars(), per_page)
+    
+    async def get_all_discounts(self, cursor: str = None, per_page: int = 20) -> Page:
+        """دریافت همه کدهای تخفیف (برای ادمین)"""
+        result = await self.db.execute(
+            Keyset.apply(select(DiscountCode), DiscountCode.created_at, DiscountCode.id, cursor, per_page)
+        )
+        return Keyset.page(result.scalars(), per_page)
+    
+    async def get_discounts_count(self) -> int:
+        """تعداد کل کدهای تخفیف"""
+        result = await self.db.execute(select(func.count(DiscountCode.id)))
+        return result.scalar_one()
     
     async def update_discount(self, discount_id: int, **kwargs) -> bool:
         """بروزرسانی کد تخفیف"""
@@ -66,7 +80,7 @@ class DiscountManager:
                 if hasattr(discount, key):
                     setattr(discount, key, value)
             discount.updated_at = datetime.now()
-            await self.db.commit()
+            await commit_or_flush(self.db)
             return True
         return False
     
@@ -79,7 +93,7 @@ class DiscountManager:
         
         if discount:
             await self.db.delete(discount)
-            await self.db.commit()
+            await commit_or_flush(self.db)
             return True
         return False
     
@@ -101,7 +115,7 @@ class DiscountManager:
         if discount and self._is_discount_valid(discount):
             discount.used_count += 1
             discount.updated_at = datetime.now()
-            await self.db.commit()
+            await commit_or_flush(self.db)
             return True
         return False
     
@@ -0,0 +1,253 @@
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import select, delete, or_, true
+from config import Config
+from database import AsyncSessionLocal
+from models.user import HiddifyUserState
+from utils.background import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+class HiddifyMirror:
+    """آینه محلی کاربران هیدیفای با همگام‌سازی افزایشی
+
+    فهرست کاربران به صورت دوره‌ای از پنل خوانده می‌شود (API v2 هیدیفای فیلتر
+    «تغییرکرده از زمان X» ندارد، پس هر بار فهرست کامل می‌آید) و فقط رکوردهایی که
+    تغییر کرده‌اند در جدول hiddify_user_states نوشته می‌شوند. برای تشخیص تغییر
+    فقط یک hash کوتاه از هر کاربر در حافظه می‌ماند، نه نسخه دوم JSON آن.
+    خواندن‌ها از حافظه انجام می‌شود و داده‌ای قدیمی‌تر از max_staleness هرگز
+    برگردانده نمی‌شود.
+
+    هر نود هیدیفای آینه خودش را دارد (panel نام نود است) و فقط ردیف‌های همان نود
+    را می‌خواند و حذف می‌کند. include_unassigned برای نود پیش‌فرض است تا ردیف‌های
+    قبل از چندپنلی (panel خالی) هم به آن تعلق بگیرند.
+    """
+
+    # تعداد uuid در هر کوئری IN
+    CHUNK_SIZE = 500
+
+    def __init__(self, api, max_staleness: int = None, refresh_interval: int = None,
+                 panel: str = None, include_unassigned: bool = True):
+        self.api = api
+        self.panel = panel
+        self.include_unassigned = include_unassigned
+        self.max_staleness = timedelta(
+            seconds=max_staleness or Config.HIDDIFY_MIRROR_MAX_STALENESS
+        )
+        self._users: Dict[str, Dict] = {}
+        self._hashes: Dict[str, bytes] = {}  # hash هر کاربر برای تشخیص تغییر
+        self._synced_at: Dict[str, datetime] = {}
+        self.last_full_sync: Optional[datetime] = None
+        self._lock = asyncio.Lock()
+        self._task = PeriodicTask(
+            f"hiddify_mirror:{panel}" if panel else "hiddify_mirror",
+            refresh_interval or Config.HIDDIFY_MIRROR_REFRESH_INTERVAL,
+            self.refresh
+        )
+
+    def start(self):
+        """شروع همگام‌سازی پس‌زمینه"""
+        self._task.start()
+
+    async def stop(self):
+        """توقف همگام‌سازی پس‌زمینه"""
+        await self._task.stop()
+
+    async def load_from_db(self):
+        """بارگذاری آخرین وضعیت ذخیره‌شده تا بعد از ری‌استارت نیازی به پنل نباشد"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(HiddifyUserState).where(self._owned()))
+            for state in result.scalars():
+                self._users[state.hiddify_uuid] = json.loads(state.raw_data) if state.raw_data else {}
+                self._hashes[state.hiddify_uuid] = self._fingerprint(state.raw_data or "{}")
+                self._synced_at[state.hiddify_uuid] = state.synced_at
+        logger.info(f"Hiddify mirror {self.panel or ''} loaded {len(self._users)} users from database")
+
+    def _owned(self):
+        """شرط ردیف‌های hiddify_user_states متعلق به این نود"""
+        if self.panel is None:
+            return true()
+        if self.include_unassigned:
+            return or_(HiddifyUserState.panel == self.panel, HiddifyUserState.panel.is_(None))
+        return HiddifyUserState.panel == self.panel
+
+    def _is_fresh(self, uuid: str, max_age: timedelta) -> bool:
+        synced_at = self._synced_at.get(uuid)
+        return synced_at is not None and datetime.now() - synced_at <= max_age
+
+    async def refresh(self, force: bool = False) -> bool:
+        """همگام‌سازی کامل فهرست کاربران با پنل"""
+        requested_at = datetime.now()
+        async with self._lock:
+            # اگر درخواست همزمان دیگری همین حالا همگام‌سازی کرده، تکرار نکن
+            if not force and self.last_full_sync and self.last_full_sync >= requested_at:
+                return True
+
+            users = await self.api.get_all_users()
+            if users is None:
+                logger.warning("Hiddify mirror refresh failed, keeping previous snapshot")
+                return False
+
+            synced_at = datetime.now()
+            changed = {}
+            seen = set()
+            for user in users:
+                uuid = user.get("uuid")
+                if not uuid:
+                    continue
+                seen.add(uuid)
+                raw = self._serialize(user)
+                fingerprint = self._fingerprint(raw)
+                if self._hashes.get(uuid) != fingerprint:
+                    changed[uuid] = raw
+                    self._hashes[uuid] = fingerprint
+                self._users[uuid] = user
+                self._synced_at[uuid] = synced_at
+
+            removed = [uuid for uuid in self._users if uuid not in seen]
+            for uuid in removed:
+                self._forget(uuid)
+
+            await self._persist(changed, removed, synced_at)
+            self.last_full_sync = synced_at
+            logger.info(
+                f"Hiddify mirror synced: {len(seen)} users, "
+                f"{len(changed)} changed, {len(removed)} removed"
+            )
+            return True
+
+    async def refresh_user(self, uuid: str) -> Optional[Dict]:
+        """بروزرسانی اجباری یک کاربر از پنل"""
+        user = await self.api.get_user(uuid)
+        if user is None:
+            return None
+
+        synced_at = datetime.now()
+        raw = self._serialize(user)
+        fingerprint = self._fingerprint(raw)
+        changed = {uuid: raw} if self._hashes.get(uuid) != fingerprint else {}
+        self._users[uuid] = user
+        self._hashes[uuid] = fingerprint
+        self._synced_at[uuid] = synced_at
+        await self._persist(changed, [], synced_at)
+        return user
+
+    def _forget(self, uuid: str):
+        self._users.pop(uuid, None)
+        self._hashes.pop(uuid, None)
+        self._synced_at.pop(uuid, None)
+
+    @staticmethod
+    def _serialize(user: Dict) -> str:
+        return json.dumps(user, sort_keys=True, ensure_ascii=False)
+
+    @staticmethod
+    def _fingerprint(raw: str) -> bytes:
+        return hashlib.blake2b(raw.encode(), digest_size=16).digest()
+
+    async def _persist(self, changed: Dict[str, str], removed: List[str], synced_at: datetime):
+        """نوشتن فقط رکوردهای تغییرکرده و حذف‌شده در دیتابیس"""
+        if not changed and not removed:
+            return
+
+        async with AsyncSessionLocal() as db:
+            uuids = list(changed)
+            for i in range(0, len(uuids), self.CHUNK_SIZE):
+                chunk = uuids[i:i + self.CHUNK_SIZE]
+                result = await db.execute(
+                    select(HiddifyUserState).where(HiddifyUserState.hiddify_uuid.in_(chunk))
+                )
+                existing = {state.hiddify_uuid: state for state in result.scalars()}
+                for uuid in chunk:
+                    state = existing.get(uuid)
+                    if state is None:
+                        state = HiddifyUserState(hiddify_uuid=uuid)
+                        db.add(state)
+                    self._apply_state(state, self._users[uuid], changed[uuid], synced_at)
+
+            for i in range(0, len(removed), self.CHUNK_SIZE):
+                await db.execute(
+                    delete(HiddifyUserState)
+                    .where(HiddifyUserState.hiddify_uuid.in_(removed[i:i + self.CHUNK_SIZE]))
+                )
+
+            await db.commit()
+
+    def _apply_state(self, state: HiddifyUserState, user: Dict, raw: str, synced_at: datetime):
+        state.name = user.get("name")
+        state.usage_limit_gb = float(user.get("usage_limit_GB") or 0)
+        state.current_usage_gb = float(user.get("current_usage_GB") or 0)
+        state.package_days = int(user.get("package_days") or 0)
+        state.start_date = self._parse_datetime(user.get("start_date"))
+        state.mode = user.get("mode")
+        state.enable = bool(user.get("enable", True))
+        state.last_online = self._parse_datetime(user.get("last_online"))
+        state.raw_data = raw
+        state.synced_at = synced_at
+        if self.panel is not None:
+            state.panel = self.panel
+
+    @staticmethod
+    def _parse_datetime(value) -> Optional[datetime]:
+        if not value:
+            return None
+        try:
+            return datetime.fromisoformat(str(value))
+        except ValueError:
+            return None
+
+    async def get_user(self, uuid: str, max_age: int = None) -> Optional[Dict]:
+        """دریافت کاربر از آینه؛ اگر داده قدیمی باشد فقط همان کاربر از پنل خوانده می‌شود"""
+        max_age = self.max_staleness if max_age is None else timedelta(seconds=max_age)
+        if not self._is_fresh(uuid, max_age):
+            await self.refresh_user(uuid)
+        return self._users.get(uuid) if self._is_fresh(uuid, max_age) else None
+
+    async def get_usage(self, uuid: str, max_age: int = None) -> Optional[Dict]:
+        """دریافت مصرف و تاریخ انقضای کاربر"""
+        user = await self.get_user(uuid, max_age)
+        if user is None:
+            return None
+
+        usage_limit = float(user.get("usage_limit_GB") or 0)
+        current_usage = float(user.get("current_usage_GB") or 0)
+        package_days = int(user.get("package_days") or 0)
+        start_date = self._parse_datetime(user.get("start_date"))
+        expiry_date = start_date + timedelta(days=package_days) if start_date else None
+        if expiry_date:
+            days_left = max(0, (expiry_date - datetime.now()).days)
+        else:
+            days_left = package_days
+
+        return {
+            "usage_limit_gb": usage_limit,
+            "current_usage_gb": current_usage,
+            "remaining_gb": max(0.0, usage_limit - current_usage),
+            "package_days": package_days,
+            "expiry_date": expiry_date,
+            "days_left": days_left,
+            "enable": bool(user.get("enable", True))
+        }
+
+    @property
+    def user_count(self) -> int:
+        """تعداد کاربران نود در آخرین همگام‌سازی"""
+        return len(self._users)
+
+    def get_stats(self) -> dict:
+        """آمار آینه"""
+        return {
+            "panel": self.panel,
+            "users": self.user_count,
+            "last_full_sync": self.last_full_sync
+        }
+
+# نمونه استفاده
+# mirror = HiddifyMirror(AsyncHiddifyAPI(), panel="de1")
+# await mirror.load_from_db()
+# mirror.start()
+# usage = await mirror.get_usage(hiddify_uuid)
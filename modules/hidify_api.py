@@ -1,8 +1,12 @@
 import requests
+import aiohttp
+import asyncio
 import logging
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Iterable, Callable, Awaitable
 from config import Config
+from utils.circuit_breaker import CircuitBreaker, jittered_backoff
 import json
+from uuid import uuid4
 
 logger = logging.getLogger(__name__)
 
@@ -121,6 +125,322 @@ class HiddifyAPI:
         logger.info("Getting all configs from Hiddify")
         return self._make_request("GET", "/admin/all-configs/")
 
+class HiddifyAPIError(Exception):
+    """خطای ارتباط با API هیدیفای"""
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+    
+    @property
+    def transient(self) -> bool:
+        """خطاهای موقت (شبکه، تایم‌اوت، 429 و 5xx) قابل تکرار هستند"""
+        return self.status is None or self.status == 429 or self.status >= 500
+
+class CircuitOpenError(HiddifyAPIError):
+    """مدار باز است و درخواست بدون تماس با پنل رد شد"""
+    
+    @property
+    def transient(self) -> bool:
+        return False
+
+class AsyncHiddifyAPI:
+    """نسخه async کلاینت هیدیفای روی یک connection pool مشترک"""
+    
+    # تایم‌اوت هر endpoint به ثانیه (بقیه از Config.HIDDIFY_TIMEOUT استفاده می‌کنند)
+    ENDPOINT_TIMEOUTS = {
+        "get_all_users": 60,
+        "get_all_admins": 60,
+        "get_all_configs": 60,
+        "get_user_configs": 20,
+        "get_server_status": 10,
+        "get_panel_info": 10,
+    }
+    
+    def __init__(self, base_url: str = None, api_key: str = None, proxy_path: str = None,
+                 max_concurrency: int = None, pool_size: int = None):
+        self.base_url = (base_url or Config.HIDDIFY_BASE_URL).rstrip('/')
+        self.api_key = api_key or Config.HIDDIFY_API_KEY
+        self.proxy_path = proxy_path or Config.HIDDIFY_PROXY_PATH
+        self.headers = {
+            "Hiddify-API-Key": self.api_key or "",
+            "Content-Type": "application/json"
+        }
+        self.pool_size = pool_size or Config.HIDDIFY_POOL_SIZE
+        self._semaphore = asyncio.Semaphore(max_concurrency or Config.HIDDIFY_MAX_CONCURRENCY)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.breaker = CircuitBreaker(
+            f"hiddify:{self.base_url}",
+            failure_threshold=Config.HIDDIFY_BREAKER_THRESHOLD,
+            recovery_timeout=Config.HIDDIFY_BREAKER_RECOVERY,
+            max_recovery_timeout=Config.HIDDIFY_BREAKER_MAX_RECOVERY
+        )
+        logger.info(f"AsyncHiddifyAPI initialized with base_url: {self.base_url}")
+    
+    def _get_url(self, endpoint: str) -> str:
+        """ساخت URL کامل"""
+        return f"{self.base_url}/{self.proxy_path}/api/v2{endpoint}"
+    
+    def _get_timeout(self, name: str) -> aiohttp.ClientTimeout:
+        """تایم‌اوت مخصوص endpoint"""
+        return aiohttp.ClientTimeout(total=self.ENDPOINT_TIMEOUTS.get(name, Config.HIDDIFY_TIMEOUT))
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """ایجاد session مشترک با اتصال‌های keep-alive (به صورت lazy)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=60,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(headers=self.headers, connector=connector)
+        return self._session
+    
+    async def close(self):
+        """بستن connection pool"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def _request(self, method: str, endpoint: str, data: Dict = None,
+                       name: str = None) -> Dict:
+        """ارسال درخواست به API؛ در صورت خطا HiddifyAPIError می‌دهد"""
+        url = self._get_url(endpoint)
+        # وقتی پنل در دسترس نیست، بدون انتظار برای تایم‌اوت رد می‌شود
+        if not self.breaker.allow_request():
+            raise CircuitOpenError(f"Circuit open for Hiddify API: {method} {url}")
+        
+        session = await self._get_session()
+        async with self._semaphore:
+            logger.debug(f"API Request: {method} {url}")
+            try:
+                async with session.request(
+                    method,
+                    url,
+                    json=data,
+                    timeout=self._get_timeout(name)
+                ) as response:
+                    body = await response.read()
+                    if response.status != 200:
+                        raise HiddifyAPIError(
+                            f"API Error: {response.status} - {body[:200]!r}",
+                            status=response.status
+                        )
+                    self.breaker.record_success()
+                    return json.loads(body) if body else {}
+            except asyncio.TimeoutError:
+                self.breaker.record_failure()
+                raise HiddifyAPIError(f"Timeout in Hiddify API: {method} {url}")
+            except aiohttp.ClientError as e:
+                self.breaker.record_failure()
+                raise HiddifyAPIError(f"Network Error in Hiddify API: {e}")
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except HiddifyAPIError as e:
+                # خطاهای 4xx یعنی پنل سالم است
+                if e.transient:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                raise
+    
+    def _backoff_delay(self, attempt: int) -> float:
+        """تاخیر تصادفی (full jitter) با رشد نمایی برای تلاش مجدد"""
+        return jittered_backoff(attempt, Config.HIDDIFY_BACKOFF_BASE, Config.HIDDIFY_BACKOFF_MAX)
+    
+    async def _make_request(self, method: str, endpoint: str, data: Dict = None,
+                            name: str = None) -> Optional[Dict]:
+        """ارسال درخواست به API (مثل نسخه sync در صورت خطا None برمی‌گرداند)
+        
+        درخواست‌های GET در صورت خطای موقت با backoff تکرار می‌شوند.
+        """
+        retries = Config.HIDDIFY_RETRIES if method == "GET" else 0
+        attempt = 0
+        try:
+            while True:
+                try:
+                    return await self._request(method, endpoint, data, name)
+                except HiddifyAPIError as e:
+                    if not e.transient or attempt >= retries:
+                        raise
+                    await asyncio.sleep(self._backoff_delay(attempt))
+                    attempt += 1
+        except HiddifyAPIError as e:
+            logger.error(str(e))
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected Error in Hiddify API: {e}")
+            return None
+    
+    def get_stats(self) -> dict:
+        """وضعیت circuit breaker و تعداد خطاها"""
+        return self.breaker.get_stats()
+    
+    # مدیریت کاربران
+    async def get_all_users(self) -> Optional[List[Dict]]:
+        """دریافت همه کاربران"""
+        return await self._make_request("GET", "/admin/user/", name="get_all_users")
+    
+    async def create_user(self, user_data: Dict) -> Optional[Dict]:
+        """ایجاد کاربر جدید"""
+        return await self._make_request("POST", "/admin/user/", user_data, name="create_user")
+    
+    async def get_user(self, uuid: str) -> Optional[Dict]:
+        """دریافت اطلاعات کاربر خاص"""
+        return await self._make_request("GET", f"/admin/user/{uuid}/", name="get_user")
+    
+    async def create_user_or_raise(self, user_data: Dict) -> Dict:
+        """ایجاد کاربر بدون تلاش مجدد؛ خطا به صورت HiddifyAPIError برمی‌گردد تا فراخواننده
+        بین خطای قطعی (4xx) و نامعلوم (تایم‌اوت، شبکه، 5xx) تفاوت بگذارد"""
+        return await self._request("POST", "/admin/user/", user_data, name="create_user")
+    
+    async def find_user(self, uuid: str) -> Optional[Dict]:
+        """جستجوی کاربر با uuid؛ None فقط یعنی کاربر روی پنل نیست (404)
+        
+        خطاهای موقت با backoff تکرار می‌شوند و اگر باز هم جوابی نیامد
+        HiddifyAPIError داده می‌شود، چون «نمی‌دانیم» با «وجود ندارد» فرق دارد.
+        """
+        attempt = 0
+        while True:
+            try:
+                return await self._request("GET", f"/admin/user/{uuid}/", name="get_user")
+            except HiddifyAPIError as e:
+                if e.status == 404:
+                    return None
+                if not e.transient or attempt >= Config.HIDDIFY_RETRIES:
+                    raise
+                await asyncio.sleep(self._backoff_delay(attempt))
+                attempt += 1
+    
+    async def update_user(self, uuid: str, user_data: Dict) -> Optional[Dict]:
+        """ویرایش کاربر"""
+        return await self._make_request("PATCH", f"/admin/user/{uuid}/", user_data, name="update_user")
+    
+    async def delete_user(self, uuid: str) -> bool:
+        """حذف کاربر"""
+        result = await self._make_request("DELETE", f"/admin/user/{uuid}/", name="delete_user")
+        return result is not None
+    
+    async def get_user_configs(self, secret_uuid: str) -> Optional[Dict]:
+        """دریافت کانفیگ‌های کاربر"""
+        return await self._make_request(
+            "GET", f"/panel/{secret_uuid}/api/v2/user/all-configs/", name="get_user_configs"
+        )
+    
+    async def get_user_profile(self, secret_uuid: str) -> Optional[Dict]:
+        """دریافت پروفایل کاربر"""
+        return await self._make_request(
+            "GET", f"/panel/{secret_uuid}/api/v2/user/me/", name="get_user_profile"
+        )
+    
+    # عملیات گروهی
+    async def _run_batch(self, items: Iterable[Any],
+                         operation: Callable[[Any], Awaitable[Dict]],
+                         concurrency: int = None, retries: int = None) -> List[Dict]:
+        """اجرای یک عملیات روی همه آیتم‌ها با موازی‌سازی محدود و تلاش مجدد خطاهای موقت
+        
+        خروجی به ترتیب ورودی است و برای هر آیتم شامل success، result، error و attempts است.
+        """
+        concurrency = concurrency or Config.HIDDIFY_BATCH_CONCURRENCY
+        retries = Config.HIDDIFY_RETRIES if retries is None else retries
+        iterator = enumerate(items)
+        results = {}
+        
+        async def worker():
+            # هر worker آیتم بعدی را از iterator مشترک برمی‌دارد تا کل ورودی یکجا در حافظه نباشد
+            for index, item in iterator:
+                attempt = 0
+                while True:
+                    attempt += 1
+                    try:
+                        result = await operation(item)
+                        results[index] = {"index": index, "success": True, "result": result,
+                                          "error": None, "attempts": attempt}
+                        break
+                    except HiddifyAPIError as e:
+                        if e.transient and attempt <= retries:
+                            await asyncio.sleep(self._backoff_delay(attempt - 1))
+                            continue
+                        results[index] = {"index": index, "success": False, "result": None,
+                                          "error": str(e), "attempts": attempt}
+                        break
+                    except Exception as e:
+                        results[index] = {"index": index, "success": False, "result": None,
+                                          "error": f"Unexpected Error: {e}", "attempts": attempt}
+                        break
+        
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return [results[i] for i in sorted(results)]
+    
+    async def bulk_create_users(self, users: Iterable[Dict], concurrency: int = None,
+                                retries: int = None) -> List[Dict]:
+        """ایجاد گروهی کاربران
+        
+        POST ایجاد idempotent نیست: بعد از تایم‌اوت یا 5xx ممکن است کاربر روی پنل
+        ساخته شده باشد. برای همین هر کاربر بدون uuid یک uuid سمت کلاینت می‌گیرد و
+        پیش از هر تلاش مجدد با find_user بررسی می‌شود (مثل provision_order).
+        """
+        attempted = set()
+        
+        async def create(user_data: Dict) -> Dict:
+            uuid = user_data["uuid"]
+            if uuid in attempted:
+                existing = await self.find_user(uuid)
+                if existing is not None:
+                    return existing
+            attempted.add(uuid)
+            return await self._request("POST", "/admin/user/", user_data, name="create_user")
+        
+        return await self._run_batch(
+            ({**user_data, "uuid": user_data.get("uuid") or str(uuid4())} for user_data in users),
+            create, concurrency, retries
+        )
+    
+    async def bulk_update_users(self, users: Iterable[Dict], concurrency: int = None,
+                                retries: int = None) -> List[Dict]:
+        """ویرایش گروهی کاربران (هر آیتم باید کلید uuid داشته باشد)"""
+        async def update(user_data: Dict) -> Dict:
+            payload = dict(user_data)
+            uuid = payload.pop("uuid")
+            return await self._request("PATCH", f"/admin/user/{uuid}/", payload, name="update_user")
+        
+        return await self._run_batch(users, update, concurrency, retries)
+    
+    async def bulk_delete_users(self, uuids: Iterable[str], concurrency: int = None,
+                                retries: int = None) -> List[Dict]:
+        """حذف گروهی کاربران"""
+        return await self._run_batch(
+            uuids,
+            lambda uuid: self._request("DELETE", f"/admin/user/{uuid}/", name="delete_user"),
+            concurrency, retries
+        )
+    
+    # مدیریت ادمین‌ها
+    async def get_all_admins(self) -> Optional[List[Dict]]:
+        """دریافت همه ادمین‌ها"""
+        return await self._make_request("GET", "/admin/admin_user/", name="get_all_admins")
+    
+    async def create_admin(self, admin_data: Dict) -> Optional[Dict]:
+        """ایجاد ادمین جدید"""
+        return await self._make_request("POST", "/admin/admin_user/", admin_data, name="create_admin")
+    
+    async def get_admin(self, uuid: str) -> Optional[Dict]:
+        """دریافت اطلاعات ادمین خاص"""
+        return await self._make_request("GET", f"/admin/admin_user/{uuid}/", name="get_admin")
+    
+    # اطلاعات سیستم
+    async def get_server_status(self) -> Optional[Dict]:
+        """دریافت وضعیت سرور"""
+        return await self._make_request("GET", "/admin/server_status/", name="get_server_status")
+    
+    async def get_panel_info(self) -> Optional[Dict]:
+        """دریافت اطلاعات پنل"""
+        return await self._make_request("GET", "/panel/info/", name="get_panel_info")
+    
+    async def get_all_configs(self) -> Optional[Dict]:
+        """دریافت همه تنظیمات"""
+        return await self._make_request("GET", "/admin/all-configs/", name="get_all_configs")
+
 # نمونه استفاده و تست
 if __name__ == "__main__":
     # تست اتصال
@@ -0,0 +1,294 @@
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import Config
+from models.order import Order
+from models.user import UserHiddify
+from modules.hidify_api import AsyncHiddifyAPI, HiddifyAPIError, CircuitOpenError
+from modules.hiddify_mirror import HiddifyMirror
+from modules.rollup_manager import RollupManager
+from modules.user_manager import UserManager
+from utils.background import PeriodicTask
+from utils.circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+class PanelNode:
+    """یک نود هیدیفای به همراه وضعیت سلامت و بار"""
+
+    def __init__(self, name: str, api: AsyncHiddifyAPI, capacity: int = None):
+        self.name = name
+        self.api = api
+        self.capacity = capacity or Config.HIDDIFY_PANEL_CAPACITY
+        self.user_count = 0
+        self.cpu_percent = 0.0
+        self.healthy = True
+        self.reserved = 0  # کاربرانی که از آخرین بروزرسانی به این نود داده شده‌اند
+        self.last_checked: Optional[datetime] = None
+        self.mirror: Optional[HiddifyMirror] = None  # در PanelRegistry ساخته می‌شود
+
+    @property
+    def available(self) -> bool:
+        """آیا نود برای کاربر جدید قابل انتخاب است؟"""
+        return (
+            self.healthy
+            and self.api.breaker.state != CircuitBreaker.OPEN
+            and self.user_count + self.reserved < self.capacity
+        )
+
+    @property
+    def load_score(self) -> float:
+        """امتیاز بار (کمتر بهتر): ترکیب پر بودن ظرفیت و مصرف CPU"""
+        fill = (self.user_count + self.reserved) / self.capacity
+        return 0.7 * fill + 0.3 * (self.cpu_percent / 100.0)
+
+    def get_stats(self) -> dict:
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "user_count": self.user_count,
+            "reserved": self.reserved,
+            "capacity": self.capacity,
+            "cpu_percent": self.cpu_percent,
+            "load_score": round(self.load_score, 3),
+            "last_checked": self.last_checked,
+            "breaker": self.api.get_stats(),
+            "mirror": self.mirror.get_stats() if self.mirror else None
+        }
+
+class PanelRegistry:
+    """ثبت نودهای هیدیفای و انتخاب نود بر اساس ظرفیت و بار"""
+
+    def __init__(self, nodes: List[PanelNode]):
+        if not nodes:
+            raise ValueError("At least one Hiddify panel is required")
+        self.nodes: Dict[str, PanelNode] = {node.name: node for node in nodes}
+        self.default = nodes[0]
+        for node in nodes:
+            # ردیف‌های قبل از چندپنلی (بدون نام نود) متعلق به نود پیش‌فرض هستند
+            node.mirror = HiddifyMirror(node.api, panel=node.name, include_unassigned=node is self.default)
+        self._task = PeriodicTask("panel_registry", Config.HIDDIFY_PANEL_REFRESH_INTERVAL, self.refresh)
+
+    @classmethod
+    def from_config(cls) -> "PanelRegistry":
+        """ساخت registry از Config.HIDDIFY_PANELS یا تنظیمات تک‌پنلی قبلی"""
+        nodes = []
+        if Config.HIDDIFY_PANELS:
+            for panel in json.loads(Config.HIDDIFY_PANELS):
+                api = AsyncHiddifyAPI(
+                    base_url=panel["base_url"],
+                    api_key=panel.get("api_key"),
+                    proxy_path=panel.get("proxy_path")
+                )
+                nodes.append(PanelNode(panel["name"], api, panel.get("capacity")))
+        else:
+            nodes.append(PanelNode("default", AsyncHiddifyAPI()))
+        return cls(nodes)
+
+    def get(self, name: str) -> Optional[PanelNode]:
+        """دریافت نود بر اساس نام"""
+        return self.nodes.get(name)
+
+    def node_for(self, panel_name: str = None) -> PanelNode:
+        """نودی که کاربر روی آن ساخته شده (سفارش‌ها و لینک‌های قدیمی روی نود پیش‌فرض هستند)"""
+        node = self.nodes.get(panel_name) if panel_name else None
+        return node or self.default
+
+    def api_for(self, panel_name: str = None) -> AsyncHiddifyAPI:
+        """کلاینت نودی که کاربر روی آن ساخته شده"""
+        return self.node_for(panel_name).api
+
+    def mirror_for(self, panel_name: str = None) -> HiddifyMirror:
+        """آینه نودی که کاربر روی آن ساخته شده"""
+        return self.node_for(panel_name).mirror
+
+    async def load_mirrors(self):
+        """بارگذاری آینه همه نودها از دیتابیس"""
+        for node in self.nodes.values():
+            await node.mirror.load_from_db()
+
+    def start(self):
+        """شروع بروزرسانی دوره‌ای بار نودها و همگام‌سازی آینه‌ها"""
+        self._task.start()
+        for node in self.nodes.values():
+            node.mirror.start()
+
+    async def stop(self):
+        """توقف بروزرسانی و بستن اتصال‌ها"""
+        await self._task.stop()
+        for node in self.nodes.values():
+            await node.mirror.stop()
+            await node.api.close()
+
+    async def refresh(self):
+        """بروزرسانی سلامت، تعداد کاربران و بار همه نودها به صورت موازی"""
+        await asyncio.gather(*(self._refresh_node(node) for node in self.nodes.values()))
+
+    async def _refresh_node(self, node: PanelNode):
+        """بروزرسانی یک نود بدون دانلود فهرست کامل کاربران
+
+        تعداد کاربران از آینه نود (که خودش دوره‌ای همگام می‌شود) خوانده می‌شود و تا
+        وقتی آینه هنوز همگام نشده، از شمارنده server_status.
+        """
+        status = await node.api.get_server_status()
+        previous_check = node.last_checked
+        node.last_checked = datetime.now()
+        node.healthy = status is not None
+        if status is not None:
+            node.cpu_percent = self._extract_cpu(status)
+        user_count = self._count_users(node, status, previous_check)
+        if user_count is not None:
+            node.user_count = user_count
+            node.reserved = 0
+        if not node.healthy:
+            logger.warning(f"Hiddify panel '{node.name}' is unhealthy")
+
+    def _count_users(self, node: PanelNode, status: Optional[Dict],
+                     previous_check: Optional[datetime]) -> Optional[int]:
+        """تعداد کاربران تازه نود؛ None یعنی شمارش جدیدی نیست و رزروها باید بمانند"""
+        mirror = node.mirror
+        if mirror is not None and mirror.last_full_sync is not None:
+            if previous_check is None or mirror.last_full_sync > previous_check:
+                return mirror.user_count
+            return None
+        if status is not None:
+            return self._extract_user_count(status)
+        return None
+
+    @staticmethod
+    def _extract_user_count(status: Dict) -> Optional[int]:
+        """استخراج تعداد کل کاربران از شمارنده‌های usage_history در پاسخ server_status"""
+        total = ((status.get("stats") or {}).get("usage_history") or {}).get("total") or {}
+        try:
+            return int(total["users"])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _extract_cpu(status: Dict) -> float:
+        """استخراج درصد CPU از پاسخ server_status"""
+        system = (status.get("stats") or {}).get("system") or {}
+        try:
+            return float(system.get("cpu_percent") or 0)
+        except (TypeError, ValueError):
+            return 0.0
+
+    def select_panel(self, exclude: Iterable[str] = ()) -> Optional[PanelNode]:
+        """انتخاب کم‌بارترین نود سالم که ظرفیت خالی دارد (به جز نودهای exclude)"""
+        exclude = set(exclude)
+        candidates = [
+            node for node in self.nodes.values()
+            if node.available and node.name not in exclude
+        ]
+        if not candidates:
+            return None
+        node = min(candidates, key=lambda n: n.load_score)
+        # رزرو تا انتخاب‌های بعدی قبل از بروزرسانی بعدی روی همین نود جمع نشوند
+        node.reserved += 1
+        return node
+
+    async def provision_user(self, user_data: Dict) -> Tuple[Optional[PanelNode], Optional[Dict]]:
+        """ساخت کاربر روی کم‌بارترین نود؛ نود بعدی فقط وقتی امتحان می‌شود که مطمئن باشیم
+        کاربر روی نود قبلی ساخته نشده است
+
+        uuid پیش از ارسال تعیین می‌شود. POST تکرارپذیر نیست، پس بعد از تایم‌اوت،
+        خطای شبکه یا 5xx کاربر با همان uuid روی نود جستجو می‌شود و اگر جستجو هم
+        جواب نداد failover انجام نمی‌شود تا کاربر دو بار ساخته نشود. خطای 4xx یعنی
+        داده نامعتبر است؛ روی نودهای دیگر هم رد می‌شود و نود را ناسالم نمی‌کند.
+        """
+        user_data = {**user_data, "uuid": user_data.get("uuid") or str(uuid4())}
+        tried = set()
+        while True:
+            node = self.select_panel(exclude=tried)
+            if node is None:
+                logger.error("No Hiddify panel available for provisioning")
+                return None, None
+            tried.add(node.name)
+
+            try:
+                return node, await node.api.create_user_or_raise(user_data)
+            except CircuitOpenError:
+                # درخواست اصلاً ارسال نشده است
+                pass
+            except HiddifyAPIError as e:
+                if not e.transient:
+                    node.reserved -= 1
+                    logger.error(f"Hiddify panel '{node.name}' rejected user {user_data['uuid']}: {e}")
+                    return None, None
+                if e.status != 429:
+                    # معلوم نیست POST روی پنل اجرا شده یا نه
+                    try:
+                        existing = await node.api.find_user(user_data["uuid"])
+                    except HiddifyAPIError as lookup_error:
+                        node.reserved -= 1
+                        node.healthy = False
+                        logger.error(
+                            f"Provisioning {user_data['uuid']} on '{node.name}' has unknown outcome, "
+                            f"not failing over: {lookup_error}"
+                        )
+                        return None, None
+                    if existing is not None:
+                        return node, existing
+                    node.healthy = False
+                    logger.warning(f"Hiddify panel '{node.name}' failed to create user, trying next panel: {e}")
+
+            node.reserved -= 1
+
+    async def provision_order(self, db: AsyncSession, order: Order, user_data: Dict) -> Optional[Dict]:
+        """ساخت کاربر هیدیفای برای سفارش پرداخت‌شده و ثبت نود در سفارش و UserHiddify
+
+        uuid پیش از تماس با پنل در سفارش ذخیره می‌شود تا اگر نتیجه نامعلوم بود،
+        تلاش دوباره همان uuid را بفرستد. سفارش تکمیل‌شده دوباره ساخته نمی‌شود و
+        سفارشی که ساخته نشد در وضعیت paid می‌ماند.
+        """
+        if order.status == "completed" and order.hiddify_uuid:
+            return {"uuid": order.hiddify_uuid}
+
+        order.hiddify_uuid = order.hiddify_uuid or str(uuid4())
+        if order.status != "paid":
+            await RollupManager(db).mark_dirty("orders", order.created_at)
+        order.status = "paid"
+        await db.commit()
+
+        node, result = await self.provision_user({**user_data, "uuid": order.hiddify_uuid})
+        if node is None:
+            return None
+
+        order.hiddify_uuid = result.get("uuid") or order.hiddify_uuid
+        order.secret_uuid = result.get("secret_uuid") or order.secret_uuid
+        order.hiddify_panel = node.name
+        await RollupManager(db).mark_dirty("orders", order.created_at)
+        order.status = "completed"
+        order.updated_at = datetime.now()
+        await UserManager(db).link_hiddify_user(
+            order.user_id, order.hiddify_uuid, order.secret_uuid or order.hiddify_uuid, node.name
+        )
+        return result
+
+    async def get_user_services(self, db: AsyncSession, user_id: int) -> List[Dict]:
+        """مصرف همه سرویس‌های یک کاربر ربات، هر سرویس از آینه نود خودش"""
+        result = await db.execute(
+            select(UserHiddify.hiddify_uuid, UserHiddify.hiddify_panel)
+            .where(UserHiddify.user_id == user_id)
+        )
+        services = []
+        for uuid, panel_name in result.all():
+            usage = await self.mirror_for(panel_name).get_usage(uuid)
+            if usage:
+                services.append({"hiddify_uuid": uuid, "panel": self.node_for(panel_name).name, **usage})
+        return services
+
+    def get_stats(self) -> List[dict]:
+        """آمار همه نودها"""
+        return [node.get_stats() for node in self.nodes.values()]
+
+# نمونه استفاده
+# registry = PanelRegistry.from_config()
+# registry.start()
+# result = await registry.provision_order(db, order, {"name": "user1", "package_days": 30})
+# services = await registry.get_user_services(db, user.id)
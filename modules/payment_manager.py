@@ -1,7 +1,9 @@
 from sqlalchemy import select, and_, func
 from sqlalchemy.ext.asyncio import AsyncSession
+from database import commit_or_flush
 from models.payment import Payment
 from models.user import User
+from utils.pagination import Keyset, Page
 from datetime import datetime, timedelta
 
 class PaymentManager:
@@ -24,7 +26,7 @@ class PaymentManager:
         )
         
         self.db.add(payment)
-        await self.db.commit()
+        await commit_or_flush(self.db)
         await self.db.refresh(payment)
         return payment
     
@@ -53,38 +55,46 @@ class PaymentManager:
         """بروزرسانی وضعیت پرداخت"""
         payment = await self.get_payment_by_id(payment_id)
         if payment:
+            if payment.status != status:
+                from modules.rollup_manager import RollupManager
+                await RollupManager(self.db).mark_dirty("payments", payment.created_at)
             payment.status = status
             if transaction_id:
                 payment.transaction_id = transaction_id
             if authority:
                 payment.authority = authority
             payment.updated_at = datetime.now()
-            await self.db.commit()
+            await commit_or_flush(self.db)
             return True
         return False
     
-    async def get_user_payments(self, user_id: int, page: int = 1, 
-                               per_page: int = 20) -> list:
+    async def get_user_payments(self, user_id: int, cursor: str = None, 
+                               per_page: int = 20) -> Page:
         """دریافت پرداخت‌های کاربر"""
-        offset = (page - 1) * per_page
         result = await self.db.execute(
-            select(Payment)
-            .where(Payment.user_id == user_id)
-            .order_by(Payment.created_at.desc())
-            .offset(offset).limit(per_page)
+            Keyset.apply(
+                select(Payment).where(Payment.user_id == user_id),
+                Payment.created_at, Payment.id, cursor, per_page
+            )
         )
-        return result.scalars().all()
+        return Keyset.page(result.scalars(), per_page)
     
-    async def get_pending_payments(self, page: int = 1, per_page: int = 20) -> list:
+    async def get_pending_payments(self, cursor: str = None, per_page: int = 20) -> Page:
         """دریافت پرداخت‌های در انتظار تایید"""
-        offset = (page - 1) * per_page
         result = await self.db.execute(
-            select(Payment)
-            .where(Payment.status == "pending")
-            .order_by(Payment.created_at.desc())
-            .offset(offset).limit(per_page)
+            Keyset.apply(
+                select(Payment).where(Payment.status == "pending"),
+                Payment.created_at, Payment.id, cursor, per_page
+            )
+        )
+        return Keyset.page(result.scalars(), per_page)
+    
+    async def get_recent_payments(self, cursor: str = None, per_page: int = 20) -> Page:
+        """دریافت همه پرداخت‌ها از جدیدترین"""
+        result = await self.db.execute(
+            Keyset.apply(select(Payment), Payment.created_at, Payment.id, cursor, per_page)
         )
-        return result.scalars().all()
+        return Keyset.page(result.scalars(), per_page)
     
     async def verify_payment(self, payment_id: int, is_verified: bool, 
                            transaction_id: str = None) -> bool:
@@ -95,57 +105,9 @@ class PaymentManager:
         )
     
     async def get_payment_statistics(self, days: int = 30) -> dict:
-        """دریافت آمار پرداخت‌ها"""
-        start_date = datetime.now() - timedelta(days=days)
-        
-        # پرداخت‌های موفق
-        success_result = await self.db.execute(
-            select(func.count(Payment.id), func.sum(Payment.amount))
-            .where(
-                and_(
-                    Payment.status == "success",
-                    Payment.created_at >= start_date
-                )
-            )
-        )
-        success_data = success_result.fetchone()
-        success_count = success_data[0] if success_data else 0
-        success_amount = success_data[1] if success_data else 0.0
-        
-        # پرداخت‌های ناموفق
-        failed_result = await self.db.execute(
-            select(func.count(Payment.id))
-            .where(
-                and_(
-                    Payment.status == "failed",
-                    Payment.created_at >= start_date
-                )
-            )
-        )
-        failed_count = failed_result.scalar_one() or 0
-        
-        # پرداخت‌های در انتظار
-        pending_result = await self.db.execute(
-            select(func.count(Payment.id))
-            .where(
-                and_(
-                    Payment.status == "pending",
-                    Payment.created_at >= start_date
-                )
-            )
-        )
-        pending_count = pending_result.scalar_one() or 0
-        
-        total_count = (success_count or 0) + (failed_count or 0) + (pending_count or 0)
-        conversion_rate = (success_count / total_count * 100) if total_count > 0 else 0
-        
-        return {
-            "success_count": success_count or 0,
-            "success_amount": success_amount or 0.0,
-            "failed_count": failed_count or 0,
-            "pending_count": pending_count or 0,
-            "conversion_rate": conversion_rate
-        }
+        """دریافت آمار پرداخت‌ها در بازه زمانی (از جدول‌های خلاصه روزانه)"""
+        from modules.rollup_manager import RollupManager
+        return await RollupManager(self.db).get_payment_statistics(days)
     
     async def get_payments_count(self) -> int:
         """دریافت تعداد کل پرداخت‌ها"""
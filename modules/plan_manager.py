@@ -1,8 +1,65 @@
-from sqlalchemy import select, and_, func
+import asyncio
+import logging
+import time
+from sqlalchemy import select, update, and_, func
 from sqlalchemy.ext.asyncio import AsyncSession
+from database import commit_or_flush
 from models.plan import Plan
+from config import Config
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+class PlanCache:
+    """کش درون‌فرآیندی کاتالوگ پلن‌های فعال
+    
+    هر تغییر در پلن‌ها نسخه را یک واحد بالا می‌برد و کش را خالی می‌کند؛ کیبوردها و
+    سایر کش‌های وابسته می‌توانند با مقایسه version تغییر کاتالوگ را تشخیص دهند.
+    """
+    version = 0
+    _plans = None
+    _by_id = {}
+    _loaded_at = 0.0
+    _lock = None
+    
+    @classmethod
+    def get(cls):
+        """پلن‌های کش‌شده یا None اگر کش خالی یا منقضی باشد"""
+        if cls._plans is None:
+            return None
+        if Config.PLAN_CACHE_TTL and time.monotonic() - cls._loaded_at > Config.PLAN_CACHE_TTL:
+            return None
+        return cls._plans
+    
+    @classmethod
+    def get_plan(cls, plan_id: int):
+        """پلن فعال کش‌شده بر اساس آیدی"""
+        return cls._by_id.get(plan_id)
+    
+    @classmethod
+    def set(cls, plans: list, version: int):
+        """ذخیره کاتالوگ؛ اگر در حین خواندن کش باطل شده باشد ذخیره نمی‌شود"""
+        if version != cls.version:
+            return
+        cls._plans = plans
+        cls._by_id = {plan.id: plan for plan in plans}
+        cls._loaded_at = time.monotonic()
+        # هر بارگذاری (از جمله بعد از انقضای TTL) نسخه جدیدی از کاتالوگ است
+        cls.version += 1
+    
+    @classmethod
+    def invalidate(cls):
+        """باطل کردن کش بعد از هر تغییر در پلن‌ها"""
+        cls.version += 1
+        cls._plans = None
+        cls._by_id = {}
+    
+    @classmethod
+    def lock(cls) -> asyncio.Lock:
+        if cls._lock is None:
+            cls._lock = asyncio.Lock()
+        return cls._lock
+
 class PlanManager:
     def __init__(self, db: AsyncSession):
         self.db = db
@@ -30,8 +87,9 @@ class PlanManager:
         )
         
         self.db.add(plan)
-        await self.db.commit()
+        await commit_or_flush(self.db)
         await self.db.refresh(plan)
+        PlanCache.invalidate()
         return plan
     
     async def get_plan_by_id(self, plan_id: int) -> Plan:
@@ -42,11 +100,32 @@ class PlanManager:
         return result.scalar_one_or_none()
     
     async def get_active_plans(self) -> list:
-        """دریافت پلن‌های فعال"""
-        result = await self.db.execute(
-            select(Plan).where(Plan.is_active == True).order_by(Plan.sort_order)
-        )
-        return result.scalars().all()
+        """دریافت پلن‌های فعال (از کش؛ فقط در صورت خالی بودن کش از دیتابیس)"""
+        plans = PlanCache.get()
+        if plans is not None:
+            return plans
+        
+        async with PlanCache.lock():
+            # ممکن است درخواست همزمان دیگری کش را پر کرده باشد
+            plans = PlanCache.get()
+            if plans is not None:
+                return plans
+            
+            version = PlanCache.version
+            result = await self.db.execute(
+                select(Plan).where(Plan.is_active == True).order_by(Plan.sort_order)
+            )
+            plans = result.scalars().all()
+            # جدا کردن از session تا بین درخواست‌ها قابل اشتراک باشند
+            for plan in plans:
+                self.db.expunge(plan)
+            PlanCache.set(plans, version)
+            return plans
+    
+    async def get_active_plan(self, plan_id: int) -> Plan:
+        """دریافت پلن فعال از کش کاتالوگ"""
+        await self.get_active_plans()
+        return PlanCache.get_plan(plan_id)
     
     async def get_all_plans(self, page: int = 1, per_page: int = 50) -> list:
         """دریافت همه پلن‌ها با صفحه‌بندی"""
@@ -64,7 +143,8 @@ class PlanManager:
                 if hasattr(plan, key):
                     setattr(plan, key, value)
             plan.updated_at = datetime.now()
-            await self.db.commit()
+            await commit_or_flush(self.db)
+            PlanCache.invalidate()
             return True
         return False
     
@@ -73,7 +153,8 @@ class PlanManager:
         plan = await self.get_plan_by_id(plan_id)
         if plan:
             await self.db.delete(plan)
-            await self.db.commit()
+            await commit_or_flush(self.db)
+            PlanCache.invalidate()
             return True
         return False
     
@@ -98,15 +179,21 @@ class PlanManager:
         return result.scalars().all()
     
     async def reorder_plans(self, plan_ids: list) -> bool:
-        """تغییر ترتیب پلن‌ها"""
+        """تغییر ترتیب پلن‌ها (همه یا هیچ‌کدام؛ خطا فقط savepoint همین کار را برمی‌گرداند)"""
         try:
-            for index, plan_id in enumerate(plan_ids):
-                await self.update_plan(plan_id, sort_order=index + 1)
-            await self.db.commit()
-            return True
+            async with self.db.begin_nested():
+                for index, plan_id in enumerate(plan_ids):
+                    await self.db.execute(
+                        update(Plan)
+                        .where(Plan.id == plan_id)
+                        .values(sort_order=index + 1, updated_at=datetime.now())
+                    )
         except Exception as e:
-            await self.db.rollback()
+            logger.error(f"Error reordering plans: {e}")
             return False
+        await commit_or_flush(self.db)
+        PlanCache.invalidate()
+        return True
     
     async def get_plans_count(self) -> int:
         """دریافت تعداد کل پلن‌ها"""
@@ -1,11 +1,20 @@
-from sqlalchemy import select, and_, func
+import json
+from sqlalchemy import select, update, insert, and_, func, case
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from database import commit_or_flush
 from models.user import User
-from models.referral import Referral
+from models.referral import Referral, ReferralSummary
 from models.payment import Payment
+from utils.pagination import Keyset, Page
 from datetime import datetime
 
 class ReferralManager:
+    # تعداد کاربران اخیر که در خلاصه رفرال نگه داشته می‌شوند
+    RECENT_REFERRALS = 5
+    INSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+    
     def __init__(self, db: AsyncSession):
         self.db = db
     
@@ -17,26 +26,37 @@ class ReferralManager:
             referrer_id=referrer_id,
             referred_id=referred_id,
             commission_amount=commission_amount,
-            order_id=order_id
+            order_id=order_id,
+            created_at=datetime.now()
         )
         
         self.db.add(referral)
-        await self.db.commit()
+        await self.db.flush()
+        await self._update_summary(
+            referrer_id,
+            referred_delta=1,
+            pending_delta=commission_amount,
+            new_referral=referral
+        )
+        await commit_or_flush(self.db)
         await self.db.refresh(referral)
         return referral
     
-    async def get_user_referrals(self, user_id: int, page: int = 1, 
-                               per_page: int = 20) -> list:
-        """دریافت کاربران معرفی‌شده توسط کاربر"""
-        offset = (page - 1) * per_page
+    async def get_user_referrals(self, user_id: int, cursor: str = None, 
+                               per_page: int = 20) -> Page:
+        """دریافت کاربران معرفی‌شده توسط کاربر به صورت ردیف‌های (کاربر، زمان معرفی، id رفرال)"""
         result = await self.db.execute(
-            select(User, Referral.created_at)
-            .join(Referral, User.id == Referral.referred_id)
-            .where(Referral.referrer_id == user_id)
-            .order_by(Referral.created_at.desc())
-            .offset(offset).limit(per_page)
+            Keyset.apply(
+                select(User, Referral.created_at, Referral.id.label("referral_id"))
+                .join(Referral, User.id == Referral.referred_id)
+                .where(Referral.referrer_id == user_id),
+                Referral.created_at, Referral.id, cursor, per_page
+            )
+        )
+        return Keyset.page(
+            result.all(), per_page,
+            key=lambda row: row.referral_id
         )
-        return result.all()
     
     async def get_referral_by_users(self, referrer_id: int, referred_id: int) -> Referral:
         """دریافت رکورد رفرال بین دو کاربر"""
@@ -51,42 +71,116 @@ class ReferralManager:
         return result.scalar_one_or_none()
     
     async def get_user_referral_stats(self, user_id: int) -> dict:
-        """دریافت آمار رفرال کاربر"""
-        # تعداد کاربران معرفی‌شده
-        referred_count_result = await self.db.execute(
-            select(func.count(Referral.id)).where(Referral.referrer_id == user_id)
+        """دریافت آمار رفرال کاربر از جدول خلاصه (یک جستجو با کلید اصلی)"""
+        summary = await self.db.get(ReferralSummary, user_id, populate_existing=True)
+        if summary is None:
+            summary = await self.rebuild_summary(user_id)
+            await commit_or_flush(self.db)
+        
+        return {
+            "referred_count": summary.referred_count,
+            "total_commission": summary.paid_commission,
+            "pending_commission": summary.pending_commission,
+            "recent_referrals": json.loads(summary.recent_referrals or "[]")
+        }
+    
+    async def _aggregate_stats(self, user_id: int) -> tuple:
+        """محاسبه آمار با یک کوئری تجمیعی شرطی"""
+        result = await self.db.execute(
+            select(
+                func.count(Referral.id),
+                func.coalesce(func.sum(case(
+                    (Referral.commission_status == "paid", Referral.commission_amount), else_=0.0
+                )), 0.0),
+                func.coalesce(func.sum(case(
+                    (Referral.commission_status == "pending", Referral.commission_amount), else_=0.0
+                )), 0.0)
+            ).where(Referral.referrer_id == user_id)
         )
-        referred_count = referred_count_result.scalar_one()
+        return result.one()
+    
+    async def _recent_referrals(self, user_id: int) -> list:
+        """آخرین کاربران معرفی‌شده برای ذخیره در خلاصه"""
+        referrals = await self.get_user_referrals(user_id, per_page=self.RECENT_REFERRALS)
+        return [self._recent_entry(user, created_at) for user, created_at, _ in referrals]
+    
+    @staticmethod
+    def _recent_entry(user: User, created_at: datetime) -> dict:
+        name = f"{user.first_name or ''} {user.last_name or ''}".strip() or f"کاربر {user.id}"
+        return {
+            "user_id": user.id,
+            "name": name,
+            "created_at": (created_at or datetime.now()).isoformat()
+        }
+    
+    async def _ensure_summary(self, user_id: int) -> bool:
+        """ساخت ردیف خالی خلاصه در صورت نبودن؛ True یعنی ردیف همین حالا ساخته شد
         
-        # مجموع کمیسیون دریافت‌شده
-        commission_result = await self.db.execute(
-            select(func.sum(Referral.commission_amount))
-            .where(
-                and_(
-                    Referral.referrer_id == user_id,
-                    Referral.commission_status == "paid"
-                )
+        ردیف با INSERT ... ON CONFLICT DO NOTHING ساخته می‌شود، پس اولین رفرال
+        همزمان دو نمونه ربات برای یک معرف به خطای کلید اصلی نمی‌خورد و نمونه
+        دوم فقط تغییر خودش را روی همان ردیف اعمال می‌کند.
+        """
+        insert_ignore = self.INSERT_DIALECTS.get(self.db.get_bind().dialect.name)
+        if insert_ignore is not None:
+            result = await self.db.execute(
+                insert_ignore(ReferralSummary)
+                .values(referrer_id=user_id)
+                .on_conflict_do_nothing()
             )
-        )
-        total_commission = commission_result.scalar_one() or 0.0
+            return result.rowcount == 1
         
-        # کمیسیون در انتظار پرداخت
-        pending_result = await self.db.execute(
-            select(func.sum(Referral.commission_amount))
-            .where(
-                and_(
-                    Referral.referrer_id == user_id,
-                    Referral.commission_status == "pending"
-                )
+        if await self.db.get(ReferralSummary, user_id) is not None:
+            return False
+        try:
+            async with self.db.begin_nested():
+                await self.db.execute(insert(ReferralSummary).values(referrer_id=user_id))
+        except IntegrityError:
+            return False
+        return True
+    
+    async def rebuild_summary(self, user_id: int) -> ReferralSummary:
+        """ساخت دوباره خلاصه رفرال از روی جدول referrals (بدون commit)"""
+        await self._ensure_summary(user_id)
+        referred_count, paid, pending = await self._aggregate_stats(user_id)
+        recent = await self._recent_referrals(user_id)
+        
+        summary = await self.db.get(ReferralSummary, user_id, populate_existing=True)
+        summary.referred_count = referred_count
+        summary.paid_commission = paid
+        summary.pending_commission = pending
+        summary.recent_referrals = json.dumps(recent, ensure_ascii=False)
+        await self.db.flush()
+        return summary
+    
+    async def _update_summary(self, referrer_id: int, referred_delta: int = 0,
+                              paid_delta: float = 0.0, pending_delta: float = 0.0,
+                              new_referral: Referral = None):
+        """بروزرسانی افزایشی خلاصه؛ اگر خلاصه وجود نداشته باشد از روی داده ساخته می‌شود"""
+        if await self._ensure_summary(referrer_id):
+            # رفرال جدید قبلاً flush شده، پس در محاسبه تجمیعی حساب می‌شود
+            await self.rebuild_summary(referrer_id)
+            return
+        
+        await self.db.execute(
+            update(ReferralSummary)
+            .where(ReferralSummary.referrer_id == referrer_id)
+            .values(
+                referred_count=ReferralSummary.referred_count + referred_delta,
+                paid_commission=ReferralSummary.paid_commission + paid_delta,
+                pending_commission=ReferralSummary.pending_commission + pending_delta,
+                updated_at=datetime.now()
             )
+            .execution_options(synchronize_session=False)
         )
-        pending_commission = pending_result.scalar_one() or 0.0
         
-        return {
-            "referred_count": referred_count,
-            "total_commission": total_commission,
-            "pending_commission": pending_commission
-        }
+        if new_referral is not None:
+            referred_user = await self.db.get(User, new_referral.referred_id)
+            if referred_user is None:
+                return
+            summary = await self.db.get(ReferralSummary, referrer_id, populate_existing=True)
+            recent = json.loads(summary.recent_referrals or "[]")
+            recent.insert(0, self._recent_entry(referred_user, new_referral.created_at))
+            summary.recent_referrals = json.dumps(recent[:self.RECENT_REFERRALS], ensure_ascii=False)
     
     async def pay_referral_commission(self, referral_id: int) -> bool:
         """پرداخت کمیسیون رفرال"""
@@ -98,6 +192,11 @@ class ReferralManager:
         if referral and referral.commission_status == "pending":
             referral.commission_status = "paid"
             referral.updated_at = datetime.now()
+            await self._update_summary(
+                referral.referrer_id,
+                paid_delta=referral.commission_amount,
+                pending_delta=-referral.commission_amount
+            )
             
             # افزایش کیف پول کاربر معرف
             from modules.wallet import WalletManager
@@ -108,7 +207,7 @@ class ReferralManager:
                 f"کمیسیون رفرال - کاربر {referral.referred_id}"
             )
             
-            await self.db.commit()
+            await commit_or_flush(self.db)
             return True
         return False
     
@@ -0,0 +1,269 @@
+import logging
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Optional
+from sqlalchemy import select, insert, delete, func, and_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import Config
+from database import AsyncSessionLocal, time_bound
+from models.user import User
+from models.order import Order
+from models.payment import Payment
+from models.rollup import (
+    PaymentDailyRollup, OrderDailyRollup, SignupDailyRollup, RollupState, RollupDirtyDay
+)
+
+logger = logging.getLogger(__name__)
+
+class RollupManager:
+    """مدیریت جدول‌های خلاصه روزانه پرداخت، سفارش و ثبت‌نام
+
+    روزهای گذشته تا rolled_through از جدول‌های خلاصه خوانده می‌شوند و فقط
+    بازه بعد از آن (معمولاً همان امروز) مستقیم از جدول اصلی محاسبه می‌شود.
+    چون وضعیت پرداخت و سفارش ممکن است بعداً تغییر کند، هر بار چند روز آخر
+    (ROLLUP_LOOKBACK_DAYS) دوباره ساخته می‌شوند. تغییر وضعیت ردیف‌های قدیمی‌تر
+    با mark_dirty روز آن ردیف را در rollup_dirty_days ثبت می‌کند و refresh بعدی
+    همان روزها را هم دوباره می‌سازد.
+    """
+
+    INSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self._rollups = {
+            "payments": (Payment.created_at, PaymentDailyRollup, self._rebuild_payments),
+            "orders": (Order.created_at, OrderDailyRollup, self._rebuild_orders),
+            "signups": (User.created_at, SignupDailyRollup, self._rebuild_signups)
+        }
+
+    @staticmethod
+    def _start_of(day: date):
+        """شروع روز به صورت مرز bind شده (time_bound) برای شرط‌های created_at"""
+        return time_bound(datetime.combine(day, time.min))
+
+    @staticmethod
+    def _as_date(value) -> date:
+        """func.date در SQLite رشته برمی‌گرداند"""
+        return date.fromisoformat(value) if isinstance(value, str) else value
+
+    async def refresh(self, lookback_days: int = None) -> Dict[str, Optional[date]]:
+        """بروزرسانی افزایشی همه خلاصه‌ها تا پایان دیروز"""
+        lookback = Config.ROLLUP_LOOKBACK_DAYS if lookback_days is None else lookback_days
+        yesterday = date.today() - timedelta(days=1)
+        result = {}
+
+        for name, (created_at, rollup, rebuild) in self._rollups.items():
+            state = await self.db.get(RollupState, name)
+            if state is None:
+                state = RollupState(name=name)
+                self.db.add(state)
+
+            if state.rolled_through:
+                start = min(state.rolled_through + timedelta(days=1),
+                            yesterday - timedelta(days=lookback - 1))
+            else:
+                first = (await self.db.execute(select(func.min(created_at)))).scalar_one()
+                start = first.date() if first else yesterday + timedelta(days=1)
+
+            if start <= yesterday:
+                await self.db.execute(
+                    delete(rollup).where(and_(rollup.day >= start, rollup.day <= yesterday))
+                )
+                await rebuild(self._start_of(start), self._start_of(yesterday + timedelta(days=1)))
+                logger.info(f"Rollup {name} rebuilt from {start} to {yesterday}")
+
+            # ردیف‌های dirty اول حذف می‌شوند تا علامت‌هایی که حین بازسازی ثبت شوند بمانند
+            dirty = await self.db.execute(
+                delete(RollupDirtyDay).where(RollupDirtyDay.name == name).returning(RollupDirtyDay.day)
+            )
+            for day in sorted(set(dirty.scalars())):
+                if day >= start:
+                    continue  # همین حالا در بازه بالا ساخته شد
+                await self.db.execute(delete(rollup).where(rollup.day == day))
+                await rebuild(self._start_of(day), self._start_of(day + timedelta(days=1)))
+                logger.info(f"Rollup {name} rebuilt dirty day {day}")
+
+            state.rolled_through = yesterday
+            result[name] = yesterday
+
+        await self.db.commit()
+        return result
+
+    async def mark_dirty(self, name: str, created_at: Optional[datetime]):
+        """ثبت روز created_at برای بازسازی در refresh بعدی، در همان تراکنش تغییر وضعیت
+
+        ردیف‌های امروز هنوز خلاصه نشده‌اند و علامت لازم ندارند.
+        """
+        if created_at is None or created_at.date() >= date.today():
+            return
+        values = dict(name=name, day=created_at.date())
+        upsert = self.INSERT_DIALECTS.get(self.db.get_bind().dialect.name)
+        if upsert is not None:
+            await self.db.execute(upsert(RollupDirtyDay).values(**values).on_conflict_do_nothing())
+            return
+        try:
+            async with self.db.begin_nested():
+                await self.db.execute(insert(RollupDirtyDay).values(**values))
+        except IntegrityError:
+            pass  # روز قبلاً علامت خورده است
+
+    async def _rebuild_payments(self, start, end):
+        day = func.date(Payment.created_at)
+        status = func.coalesce(Payment.status, "pending")
+        gateway = func.coalesce(Payment.payment_gateway, "")
+        await self.db.execute(
+            insert(PaymentDailyRollup).from_select(
+                ["day", "status", "payment_method", "payment_gateway", "count", "amount"],
+                select(day, status, Payment.payment_method, gateway,
+                       func.count(Payment.id), func.coalesce(func.sum(Payment.amount), 0.0))
+                .where(and_(Payment.created_at >= start, Payment.created_at < end))
+                .group_by(day, status, Payment.payment_method, gateway)
+            )
+        )
+
+    async def _rebuild_orders(self, start, end):
+        day = func.date(Order.created_at)
+        status = func.coalesce(Order.status, "pending")
+        await self.db.execute(
+            insert(OrderDailyRollup).from_select(
+                ["day", "plan_id", "status", "count", "amount", "discount_amount"],
+                select(day, Order.plan_id, status, func.count(Order.id),
+                       func.coalesce(func.sum(Order.price), 0.0),
+                       func.coalesce(func.sum(Order.discount_amount), 0.0))
+                .where(and_(Order.created_at >= start, Order.created_at < end))
+                .group_by(day, Order.plan_id, status)
+            )
+        )
+
+    async def _rebuild_signups(self, start, end):
+        day = func.date(User.created_at)
+        await self.db.execute(
+            insert(SignupDailyRollup).from_select(
+                ["day", "count"],
+                select(day, func.count(User.id))
+                .where(and_(User.created_at >= start, User.created_at < end))
+                .group_by(day)
+            )
+        )
+
+    async def _live_from(self, name: str, start_day: date) -> Optional[date]:
+        """آخرین روز خلاصه‌شده داخل بازه؛ None یعنی کل بازه باید زنده محاسبه شود"""
+        state = await self.db.get(RollupState, name)
+        if state is None or state.rolled_through is None or state.rolled_through < start_day:
+            return None
+        return state.rolled_through
+
+    async def get_payment_statistics(self, days: int = 30) -> dict:
+        """آمار پرداخت‌های days روز اخیر (از ابتدای روز) به همراه امروز"""
+        start_day = date.today() - timedelta(days=days)
+        rolled_through = await self._live_from("payments", start_day)
+        counts, amounts = defaultdict(int), defaultdict(float)
+        by_method = defaultdict(float)
+
+        if rolled_through:
+            rows = await self.db.execute(
+                select(PaymentDailyRollup.status, PaymentDailyRollup.payment_method,
+                       func.sum(PaymentDailyRollup.count), func.sum(PaymentDailyRollup.amount))
+                .where(and_(PaymentDailyRollup.day >= start_day, PaymentDailyRollup.day <= rolled_through))
+                .group_by(PaymentDailyRollup.status, PaymentDailyRollup.payment_method)
+            )
+            live_start = self._start_of(rolled_through + timedelta(days=1))
+        else:
+            rows = []
+            live_start = self._start_of(start_day)
+
+        live_rows = await self.db.execute(
+            select(Payment.status, Payment.payment_method,
+                   func.count(Payment.id), func.coalesce(func.sum(Payment.amount), 0.0))
+            .where(Payment.created_at >= live_start)
+            .group_by(Payment.status, Payment.payment_method)
+        )
+
+        for rows_ in (rows, live_rows):
+            for status, method, count, amount in rows_:
+                counts[status] += count or 0
+                amounts[status] += amount or 0.0
+                if status == "success":
+                    by_method[method] += amount or 0.0
+
+        success_count = counts["success"]
+        total_count = success_count + counts["failed"] + counts["pending"]
+        return {
+            "success_count": success_count,
+            "success_amount": amounts["success"],
+            "failed_count": counts["failed"],
+            "pending_count": counts["pending"],
+            "conversion_rate": (success_count / total_count * 100) if total_count > 0 else 0,
+            "by_method": dict(by_method)
+        }
+
+    async def get_order_statistics(self, days: int = 30) -> Dict[int, dict]:
+        """تعداد و مبلغ سفارش‌ها به تفکیک پلن و وضعیت"""
+        start_day = date.today() - timedelta(days=days)
+        rolled_through = await self._live_from("orders", start_day)
+        plans: Dict[int, dict] = defaultdict(lambda: defaultdict(lambda: {"count": 0, "amount": 0.0}))
+
+        if rolled_through:
+            rows = await self.db.execute(
+                select(OrderDailyRollup.plan_id, OrderDailyRollup.status,
+                       func.sum(OrderDailyRollup.count), func.sum(OrderDailyRollup.amount))
+                .where(and_(OrderDailyRollup.day >= start_day, OrderDailyRollup.day <= rolled_through))
+                .group_by(OrderDailyRollup.plan_id, OrderDailyRollup.status)
+            )
+            live_start = self._start_of(rolled_through + timedelta(days=1))
+        else:
+            rows = []
+            live_start = self._start_of(start_day)
+
+        live_rows = await self.db.execute(
+            select(Order.plan_id, Order.status, func.count(Order.id), func.coalesce(func.sum(Order.price), 0.0))
+            .where(Order.created_at >= live_start)
+            .group_by(Order.plan_id, Order.status)
+        )
+
+        for rows_ in (rows, live_rows):
+            for plan_id, status, count, amount in rows_:
+                plans[plan_id][status]["count"] += count or 0
+                plans[plan_id][status]["amount"] += amount or 0.0
+
+        return {plan_id: dict(statuses) for plan_id, statuses in plans.items()}
+
+    async def get_signup_statistics(self, days: int = 30) -> dict:
+        """تعداد ثبت‌نام روزانه"""
+        start_day = date.today() - timedelta(days=days)
+        rolled_through = await self._live_from("signups", start_day)
+        daily: Dict[date, int] = defaultdict(int)
+
+        if rolled_through:
+            rows = await self.db.execute(
+                select(SignupDailyRollup.day, SignupDailyRollup.count)
+                .where(and_(SignupDailyRollup.day >= start_day, SignupDailyRollup.day <= rolled_through))
+            )
+            live_start = self._start_of(rolled_through + timedelta(days=1))
+        else:
+            rows = []
+            live_start = self._start_of(start_day)
+
+        day = func.date(User.created_at)
+        live_rows = await self.db.execute(
+            select(day, func.count(User.id)).where(User.created_at >= live_start).group_by(day)
+        )
+
+        for rows_ in (rows, live_rows):
+            for row_day, count in rows_:
+                daily[self._as_date(row_day)] += count or 0
+
+        return {"total": sum(daily.values()), "daily": dict(sorted(daily.items()))}
+
+    @classmethod
+    async def refresh_all(cls):
+        """اجرای دوره‌ای بروزرسانی خلاصه‌ها با session مستقل"""
+        async with AsyncSessionLocal() as db:
+            await cls(db).refresh()
+
+# نمونه استفاده
+# rollup_manager = RollupManager(db_session)
+# await rollup_manager.refresh()
+# stats = await rollup_manager.get_payment_statistics(days=30)
@@ -0,0 +1,186 @@
+import abc
+import contextlib
+import logging
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, Optional, Tuple
+from sqlalchemy import select, update, delete, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal, UnitOfWork
+from models.conversation_state import ConversationState
+from utils.ttl_cache import TTLCache
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class StateStore(abc.ABC):
+    """ذخیره وضعیت گفتگوی کاربران با انقضای جداگانه برای هر ورودی"""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+    @abc.abstractmethod
+    async def get(self, user_id: int) -> Optional[str]:
+        """وضعیت فعلی کاربر؛ None اگر نبود یا منقضی شده بود"""
+
+    @abc.abstractmethod
+    async def set(self, user_id: int, state: str, ttl: int = None):
+        """ثبت وضعیت کاربر؛ ttl پیش‌فرض همان ttl کلی است"""
+
+    @abc.abstractmethod
+    async def delete(self, user_id: int):
+        """حذف وضعیت کاربر"""
+
+    @abc.abstractmethod
+    async def purge(self) -> int:
+        """حذف وضعیت‌های منقضی"""
+
+    def get_stats(self) -> dict:
+        return {"backend": self.__class__.__name__, "ttl": self.ttl}
+
+class MemoryStateStore(StateStore):
+    """وضعیت‌ها در حافظه همین فرآیند؛ حداکثر max_entries ورودی (LRU)"""
+
+    def __init__(self, ttl: int, max_entries: int):
+        super().__init__(ttl)
+        self.cache = TTLCache(max_entries, ttl)
+
+    async def get(self, user_id: int) -> Optional[str]:
+        return self.cache.get(user_id)
+
+    async def set(self, user_id: int, state: str, ttl: int = None):
+        self.cache.set(user_id, state, ttl)
+
+    async def delete(self, user_id: int):
+        self.cache.pop(user_id)
+
+    async def purge(self) -> int:
+        return self.cache.purge_expired()
+
+    def get_stats(self) -> dict:
+        return {**super().get_stats(), **self.cache.get_stats()}
+
+class SqlStateStore(StateStore):
+    """وضعیت‌ها در جدول conversation_states؛ بعد از ری‌استارت باقی می‌مانند و بین
+    چند نمونه ربات مشترک‌اند
+
+    نوشتن‌ها هیچ‌وقت روی session آپدیت انجام نمی‌شوند تا تغییرات نیمه‌کاره آن
+    آپدیت را commit نکنند و rollback آپدیت هم وضعیت را برنگرداند. داخل
+    UnitOfWork نوشتن تا پایان آپدیت نگه داشته (و در get همان آپدیت دیده) می‌شود
+    و بعد از آزاد شدن اتصال آپدیت با session کوتاه‌عمر خودش ثبت می‌شود؛ پس هر
+    آپدیت همزمان بیش از یک اتصال نمی‌گیرد و در SQLite پشت قفل نوشتن خودش نمی‌ماند.
+
+    set در PostgreSQL و SQLite یک INSERT ... ON CONFLICT DO UPDATE است؛ در
+    بقیه دیالکت‌ها درج تکراری داخل SAVEPOINT انجام می‌شود.
+    """
+
+    INSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+    def __init__(self, ttl: int):
+        super().__init__(ttl)
+        # نوشتن‌های معوق هر UnitOfWork: user_id -> (state، زمان انقضا) یا None برای حذف
+        self._pending: Dict[UnitOfWork, Dict[int, Optional[Tuple[str, datetime]]]] = {}
+
+    @contextlib.asynccontextmanager
+    async def _read_session(self) -> AsyncIterator[AsyncSession]:
+        """خواندن از session آپدیت (بدون اتصال دوم) یا session مستقل"""
+        unit = UnitOfWork.current()
+        if unit is not None:
+            yield await unit.get_session()
+            return
+        async with AsyncSessionLocal() as db:
+            yield db
+
+    async def get(self, user_id: int) -> Optional[str]:
+        pending = self._pending.get(UnitOfWork.current(), {})
+        if user_id in pending:
+            entry = pending[user_id]
+            return entry[0] if entry and entry[1] > datetime.now() else None
+
+        async with self._read_session() as db:
+            result = await db.execute(
+                select(ConversationState.state).where(
+                    ConversationState.user_id == user_id,
+                    ConversationState.expires_at > datetime.now()
+                )
+            )
+            return result.scalar_one_or_none()
+
+    async def set(self, user_id: int, state: str, ttl: int = None):
+        expires_at = datetime.now() + timedelta(seconds=self.ttl if ttl is None else ttl)
+        await self._write(user_id, (state, expires_at))
+
+    async def delete(self, user_id: int):
+        await self._write(user_id, None)
+
+    async def _write(self, user_id: int, entry: Optional[Tuple[str, datetime]]):
+        """ثبت فوری بیرون از UnitOfWork، یا معوق تا پایان UnitOfWork جاری"""
+        unit = UnitOfWork.current()
+        if unit is None:
+            await self._save({user_id: entry})
+            return
+        if unit not in self._pending:
+            self._pending[unit] = {}
+            unit.after_finish(lambda: self._save(self._pending.pop(unit)))
+        self._pending[unit][user_id] = entry
+
+    async def _save(self, entries: Dict[int, Optional[Tuple[str, datetime]]]):
+        """نوشتن وضعیت‌ها با session مستقل و commit خودش"""
+        async with AsyncSessionLocal() as db:
+            for user_id, entry in entries.items():
+                if entry is None:
+                    await db.execute(delete(ConversationState).where(ConversationState.user_id == user_id))
+                    continue
+                state, expires_at = entry
+                values = dict(state=state, expires_at=expires_at, updated_at=datetime.now())
+                upsert = self.INSERT_DIALECTS.get(db.get_bind().dialect.name)
+                if upsert is not None:
+                    await db.execute(
+                        upsert(ConversationState)
+                        .values(user_id=user_id, **values)
+                        .on_conflict_do_update(index_elements=[ConversationState.user_id], set_=values)
+                    )
+                else:
+                    await self._update_or_insert(db, user_id, values)
+            await db.commit()
+
+    async def _update_or_insert(self, db: AsyncSession, user_id: int, values: dict):
+        """UPDATE و در صورت نبودن ردیف INSERT، برای دیالکت‌های بدون ON CONFLICT"""
+        statement = (
+            update(ConversationState)
+            .where(ConversationState.user_id == user_id)
+            .values(**values)
+        )
+        result = await db.execute(statement)
+        if result.rowcount:
+            return
+        try:
+            async with db.begin_nested():
+                await db.execute(insert(ConversationState).values(user_id=user_id, **values))
+        except IntegrityError:
+            # نمونه دیگری همزمان همین کاربر را درج کرده است
+            await db.execute(statement)
+
+    async def purge(self) -> int:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                delete(ConversationState).where(ConversationState.expires_at <= datetime.now())
+            )
+            await db.commit()
+            if result.rowcount:
+                logger.info(f"Purged {result.rowcount} expired conversation states")
+            return result.rowcount
+
+def create_state_store() -> StateStore:
+    """ساخت state store بر اساس STATE_STORE (memory یا sql)"""
+    if Config.STATE_STORE == "sql":
+        return SqlStateStore(Config.STATE_TTL)
+    if Config.STATE_STORE != "memory":
+        logger.warning(f"Unknown STATE_STORE '{Config.STATE_STORE}', using memory")
+    return MemoryStateStore(Config.STATE_TTL, Config.STATE_MAX_ENTRIES)
+
+# نمونه استفاده
+# states = create_state_store()
+# await states.set(user_id, "awaiting_agent_request_data")
+# if await states.get(user_id) == "awaiting_agent_request_data": ...
@@ -0,0 +1,134 @@
+import asyncio
+import contextlib
+import logging
+import time
+from typing import Any, AsyncContextManager, Awaitable, Callable, Dict, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class _UserSlot:
+    """قفل FIFO یک کاربر به همراه تعداد آپدیت‌های منتظر/در حال اجرا"""
+
+    __slots__ = ("lock", "pending")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """پردازش همزمان آپدیت‌ها با حفظ ترتیب برای هر کاربر
+
+    آپدیت‌های یک کاربر به ترتیب رسیدن و پشت سر هم اجرا می‌شوند، اما کاربران
+    مختلف موازی پردازش می‌شوند. سقف سراسری max_concurrent فقط روی آپدیت‌هایی
+    اعمال می‌شود که نوبت کاربرشان رسیده، تا آپدیت‌های منتظر یک کاربر کند
+    ظرفیت بقیه را اشغال نکنند.
+
+    unit_of_work (مثل database.UnitOfWork) دور اجرای هر آپدیت باز می‌شود تا
+    هندلرها یک session مشترک داشته باشند.
+    """
+
+    # سمافور کلاس پایه فقط سقف تسک‌های باز است؛ سقف واقعی داخل همین کلاس اعمال می‌شود
+    MAX_PENDING_UPDATES = 10000
+
+    def __init__(self, max_concurrent: int = None,
+                 unit_of_work: Callable[[], AsyncContextManager] = None):
+        super().__init__(self.MAX_PENDING_UPDATES)
+        self.max_concurrent = max_concurrent or Config.UPDATE_CONCURRENCY
+        self.unit_of_work = unit_of_work or contextlib.nullcontext
+        self._global: Optional[asyncio.Semaphore] = None
+        self._slots: Dict[int, _UserSlot] = {}
+
+        self.queued = 0  # منتظر نوبت کاربر یا ظرفیت سراسری
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+        self.max_queued = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def initialize(self) -> None:
+        self._global = asyncio.Semaphore(self.max_concurrent)
+
+    async def shutdown(self) -> None:
+        self._slots.clear()
+
+    @staticmethod
+    def _ordering_key(update: object) -> Optional[int]:
+        """کلید ترتیب: کاربر، و در نبود کاربر چت؛ None یعنی بدون محدودیت ترتیب"""
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        if self._global is None:
+            await self.initialize()
+
+        key = self._ordering_key(update)
+        slot = None
+        if key is not None:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = _UserSlot()
+            slot.pending += 1
+
+        queued_at = time.perf_counter()
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        try:
+            if slot is not None:
+                await slot.lock.acquire()
+            try:
+                async with self._global:
+                    wait = time.perf_counter() - queued_at
+                    self.queued -= 1
+                    queued_at = None
+                    self.total_wait += wait
+                    self.max_wait = max(self.max_wait, wait)
+
+                    self.in_flight += 1
+                    try:
+                        async with self.unit_of_work():
+                            await coroutine
+                        self.processed += 1
+                    except Exception:
+                        self.failed += 1
+                        raise
+                    finally:
+                        self.in_flight -= 1
+            finally:
+                if slot is not None:
+                    slot.lock.release()
+        finally:
+            if queued_at is not None:
+                # لغو قبل از رسیدن نوبت
+                self.queued -= 1
+            if slot is not None:
+                slot.pending -= 1
+                if slot.pending == 0:
+                    # آزادسازی قفل کاربرانی که آپدیت منتظر ندارند
+                    self._slots.pop(key, None)
+
+    def get_stats(self) -> dict:
+        """آمار صف و زمان انتظار"""
+        started = self.processed + self.failed + self.in_flight
+        return {
+            "max_concurrent": self.max_concurrent,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "in_flight": self.in_flight,
+            "active_users": len(self._slots),
+            "processed": self.processed,
+            "failed": self.failed,
+            "avg_wait_ms": round(self.total_wait / started * 1000, 2) if started else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 2)
+        }
+
+# نمونه استفاده
+# processor = PerUserUpdateProcessor(max_concurrent=32, unit_of_work=UnitOfWork)
+# app = Application.builder().token(TOKEN).concurrent_updates(processor).build()
@@ -1,36 +1,226 @@
-from sqlalchemy import select, func
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+import logging
+from sqlalchemy import select, insert, func, String
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from database import commit_or_flush
 from models.user import User, UserHiddify
 from utils.helpers import Helpers
+from utils.pagination import Keyset, Page
+from utils.ttl_cache import TTLCache
+from config import Config
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class UserIdentity:
+    """اطلاعات ثابت و سطح دسترسی کاربر (بدون موجودی کیف پول) برای کش"""
+    id: int
+    telegram_id: int
+    first_name: Optional[str]
+    last_name: Optional[str]
+    username: Optional[str]
+    referral_code: Optional[str]
+    is_admin: bool
+    is_agent: bool
+    is_blocked: bool
+    is_active: bool
+    
+    @classmethod
+    def from_user(cls, user: User) -> "UserIdentity":
+        return cls(
+            id=user.id,
+            telegram_id=user.telegram_id,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            username=user.username,
+            referral_code=user.referral_code,
+            is_admin=bool(user.is_admin),
+            is_agent=bool(user.is_agent),
+            is_blocked=bool(user.is_blocked),
+            is_active=bool(user.is_active)
+        )
+
+class UserIdentityCache:
+    """کش درون‌فرآیندی telegram_id -> UserIdentity
+    
+    هر نوشتن روی کاربر (update_user_info و تغییرات پنل ادمین) ورودی را باطل
+    می‌کند؛ TTL فقط سقف کهنگی برای تغییراتی است که از نمونه دیگر ربات آمده‌اند.
+    """
+    _cache = TTLCache(Config.USER_CACHE_SIZE, Config.USER_CACHE_TTL)
+    
+    @classmethod
+    def get(cls, telegram_id: int) -> Optional[UserIdentity]:
+        return cls._cache.get(telegram_id)
+    
+    @classmethod
+    def set(cls, user: User) -> UserIdentity:
+        identity = UserIdentity.from_user(user)
+        cls._cache.set(user.telegram_id, identity)
+        return identity
+    
+    @classmethod
+    def invalidate(cls, telegram_id: int):
+        cls._cache.pop(telegram_id)
+    
+    @classmethod
+    def get_stats(cls) -> dict:
+        return cls._cache.get_stats()
+
+class UserLoader:
+    """بارگذاری دسته‌ای کاربران با id در طول ساخت یک صفحه
+    
+    به جای یک get_user_by_id برای هر ردیف، idهای لازم با prime یا load_many
+    جمع و با یک کوئری IN خوانده می‌شوند. نتیجه (حتی نبودن کاربر) تا پایان عمر
+    loader نگه داشته می‌شود، پس id تکراری دوباره کوئری نمی‌زند. loader را برای
+    هر آپدیت تازه بسازید تا داده کهنه نماند.
+    
+    جدول‌هایی که آیدی تلگرام را نگه می‌دارند (مثل agent_requests.user_id) از
+    load_many_by_telegram_id استفاده می‌کنند.
+    """
+    
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self._users: Dict[int, Optional[User]] = {}
+        self._by_telegram_id: Dict[int, Optional[User]] = {}
+        self._pending = set()
+        self.queries = 0
+    
+    def prime(self, user_ids: Iterable[int]):
+        """ثبت idهایی که در بارگذاری بعدی باید خوانده شوند"""
+        self._pending.update(
+            user_id for user_id in user_ids
+            if user_id is not None and user_id not in self._users
+        )
+    
+    async def load(self, user_id: int) -> Optional[User]:
+        """دریافت یک کاربر؛ idهای prime شده هم در همان کوئری خوانده می‌شوند"""
+        if user_id is None:
+            return None
+        self.prime([user_id])
+        await self._dispatch()
+        return self._users.get(user_id)
+    
+    async def load_many(self, user_ids: Iterable[int]) -> List[Optional[User]]:
+        """دریافت کاربران به همان ترتیب idها (None برای کاربر ناموجود)"""
+        user_ids = list(user_ids)
+        self.prime(user_ids)
+        await self._dispatch()
+        return [self._users.get(user_id) for user_id in user_ids]
+    
+    async def load_many_by_telegram_id(self, telegram_ids: Iterable[int]) -> List[Optional[User]]:
+        """دریافت کاربران با آیدی تلگرام به همان ترتیب (یک کوئری IN برای آیدی‌های جدید)"""
+        telegram_ids = list(telegram_ids)
+        missing = {
+            telegram_id for telegram_id in telegram_ids
+            if telegram_id is not None and telegram_id not in self._by_telegram_id
+        }
+        if missing:
+            result = await self.db.execute(select(User).where(User.telegram_id.in_(missing)))
+            self.queries += 1
+            self._by_telegram_id.update(dict.fromkeys(missing))
+            self._remember(result.scalars())
+        return [self._by_telegram_id.get(telegram_id) for telegram_id in telegram_ids]
+    
+    async def _dispatch(self):
+        if not self._pending:
+            return
+        user_ids, self._pending = self._pending, set()
+        result = await self.db.execute(select(User).where(User.id.in_(user_ids)))
+        self.queries += 1
+        self._users.update(dict.fromkeys(user_ids))
+        self._remember(result.scalars())
+    
+    def _remember(self, users: Iterable[User]):
+        for user in users:
+            self._users[user.id] = user
+            self._by_telegram_id[user.telegram_id] = user
+
 class UserManager:
+    # تعداد تلاش برای کد رفرال تکراری (احتمال برخورد کد ۸ کاراکتری بسیار کم است)
+    REFERRAL_CODE_ATTEMPTS = 5
+    
+    # دیالکت‌هایی که INSERT ... ON CONFLICT DO NOTHING RETURNING دارند
+    INSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+    
     def __init__(self, db: AsyncSession):
         self.db = db
     
+    async def ensure_user(self, telegram_id: int, first_name: str = None,
+                          last_name: str = None, username: str = None) -> UserIdentity:
+        """هویت کاربر؛ کاربر در صورت نبودن ساخته می‌شود (با کش گرم بدون کوئری)"""
+        identity = UserIdentityCache.get(telegram_id)
+        if identity is not None:
+            return identity
+        user = await self.create_user(telegram_id, first_name, last_name, username)
+        return UserIdentityCache.set(user)
+    
+    async def get_user_identity(self, telegram_id: int) -> Optional[UserIdentity]:
+        """هویت کاربر بر اساس آیدی تلگرام (از کش در صورت وجود)"""
+        identity = UserIdentityCache.get(telegram_id)
+        if identity is not None:
+            return identity
+        user = await self.get_user_by_telegram_id(telegram_id)
+        return UserIdentityCache.set(user) if user else None
+    
     async def create_user(self, telegram_id: int, first_name: str = None, 
                          last_name: str = None, username: str = None, 
                          phone: str = None) -> User:
-        """ایجاد کاربر جدید"""
-        # بررسی وجود کاربر
-        existing_user = await self.get_user_by_telegram_id(telegram_id)
-        if existing_user:
-            return existing_user
+        """ایجاد کاربر جدید؛ اگر کاربر وجود داشته باشد همان برگردانده می‌شود
         
-        # ایجاد کاربر جدید
-        user = User(
+        در PostgreSQL و SQLite ثبت‌نام یک INSERT ... ON CONFLICT DO NOTHING
+        RETURNING است، پس دو /start همزمان به خطای unique نمی‌خورند. برنگشتن
+        ردیف یعنی کاربر از قبل بوده یا کد رفرال تکراری بوده که با کد جدید
+        دوباره تلاش می‌شود.
+        """
+        insert_ignore = self.INSERT_DIALECTS.get(self.db.get_bind().dialect.name)
+        values = dict(
             telegram_id=telegram_id,
             first_name=first_name,
             last_name=last_name,
             username=username,
-            phone=phone,
-            referral_code=Helpers.generate_referral_code()
+            phone=phone
         )
         
-        self.db.add(user)
-        await self.db.commit()
-        await self.db.refresh(user)
-        return user
+        for _ in range(self.REFERRAL_CODE_ATTEMPTS):
+            values["referral_code"] = Helpers.generate_referral_code()
+            if insert_ignore is not None:
+                result = await self.db.execute(
+                    insert_ignore(User).values(**values)
+                    .on_conflict_do_nothing()
+                    .returning(User)
+                )
+                user = result.scalar_one_or_none()
+            else:
+                user = await self._insert_user(values)
+            
+            if user is not None:
+                await commit_or_flush(self.db)
+                UserIdentityCache.set(user)
+                return user
+            
+            existing_user = await self.get_user_by_telegram_id(telegram_id)
+            if existing_user:
+                return existing_user
+            logger.warning(f"Referral code collision for user {telegram_id}, retrying")
+        
+        raise RuntimeError(f"Could not assign a unique referral code to user {telegram_id}")
+    
+    async def _insert_user(self, values: dict) -> Optional[User]:
+        """درج کاربر برای دیالکت‌های بدون ON CONFLICT؛ None در صورت تکراری بودن
+        
+        درج داخل SAVEPOINT است تا خطای تکراری فقط همین درج را برگرداند، نه
+        تغییرات دیگر session مشترک UnitOfWork.
+        """
+        try:
+            async with self.db.begin_nested():
+                result = await self.db.execute(insert(User).values(**values))
+        except IntegrityError:
+            return None
+        return await self.db.get(User, result.inserted_primary_key[0])
     
     async def get_user_by_telegram_id(self, telegram_id: int) -> User:
         """دریافت کاربر بر اساس آیدی تلگرام"""
@@ -54,24 +244,24 @@ class UserManager:
         return result.scalar_one_or_none()
     
     async def update_user_wallet(self, user_id: int, amount: float) -> bool:
-        """بروزرسانی کیف پول کاربر"""
-        user = await self.get_user_by_id(user_id)
-        if user:
-            user.wallet_balance += amount
-            user.updated_at = datetime.now()
-            await self.db.commit()
-            return True
-        return False
+        """بروزرسانی کیف پول کاربر (مقدار منفی فقط در صورت کافی بودن موجودی کسر می‌شود)"""
+        from modules.wallet import WalletManager
+        wallet_manager = WalletManager(self.db)
+        if amount >= 0:
+            return await wallet_manager.add_to_wallet(user_id, amount)
+        return await wallet_manager.deduct_from_wallet(user_id, -amount)
     
-    async def link_hiddify_user(self, user_id: int, hiddify_uuid: str, secret_uuid: str) -> bool:
-        """اتصال کاربر ربات به کاربر هیدیفای"""
+    async def link_hiddify_user(self, user_id: int, hiddify_uuid: str, secret_uuid: str,
+                                hiddify_panel: str = None) -> bool:
+        """اتصال کاربر ربات به کاربر هیدیفای (hiddify_panel نام نودی است که کاربر روی آن ساخته شده)"""
         link = UserHiddify(
             user_id=user_id,
             hiddify_uuid=hiddify_uuid,
-            secret_uuid=secret_uuid
+            secret_uuid=secret_uuid,
+            hiddify_panel=hiddify_panel
         )
         self.db.add(link)
-        await self.db.commit()
+        await commit_or_flush(self.db)
         return True
     
     async def get_hiddify_user_link(self, user_id: int) -> UserHiddify:
@@ -81,29 +271,28 @@ class UserManager:
         )
         return result.scalar_one_or_none()
     
-    async def get_all_users(self, page: int = 1, per_page: int = 50) -> list:
-        """دریافت همه کاربران با صفحه‌بندی"""
-        offset = (page - 1) * per_page
+    async def get_all_users(self, cursor: str = None, per_page: int = 50) -> Page:
+        """دریافت همه کاربران با صفحه‌بندی keyset (cursor از next_cursor صفحه قبل)"""
         result = await self.db.execute(
-            select(User).order_by(User.created_at.desc()).offset(offset).limit(per_page)
+            Keyset.apply(select(User), User.created_at, User.id, cursor, per_page)
         )
-        return result.scalars().all()
+        return Keyset.page(result.scalars(), per_page)
     
-    async def search_users(self, query: str, page: int = 1, per_page: int = 50) -> list:
+    async def search_users(self, query: str, cursor: str = None, per_page: int = 50) -> Page:
         """جستجو در کاربران"""
-        offset = (page - 1) * per_page
         result = await self.db.execute(
-            select(User)
-            .where(
-                User.first_name.contains(query) | 
-                User.last_name.contains(query) | 
-                User.username.contains(query) |
-                User.telegram_id.cast(str).contains(query)
+            Keyset.apply(
+                select(User)
+                .where(
+                    User.first_name.contains(query) | 
+                    User.last_name.contains(query) | 
+                    User.username.contains(query) |
+                    User.telegram_id.cast(String).contains(query)
+                ),
+                User.created_at, User.id, cursor, per_page
             )
-            .order_by(User.created_at.desc())
-            .offset(offset).limit(per_page)
         )
-        return result.scalars().all()
+        return Keyset.page(result.scalars(), per_page)
     
     async def update_user_info(self, user_id: int, **kwargs) -> bool:
         """بروزرسانی اطلاعات کاربر"""
@@ -113,7 +302,8 @@ class UserManager:
                 if hasattr(user, key):
                     setattr(user, key, value)
             user.updated_at = datetime.now()
-            await self.db.commit()
+            await commit_or_flush(self.db)
+            UserIdentityCache.invalidate(user.telegram_id)
             return True
         return False
     
@@ -162,3 +352,5 @@ class UserManager:
 # نمونه استفاده
 # user_manager = UserManager(db_session)
 # user = await user_manager.create_user(123456789, "John", "Doe")
+# identity = await user_manager.get_user_identity(123456789)  # بدون کوئری در صورت گرم بودن کش
+# users = await UserLoader(db_session).load_many([p.user_id for p in payments])  # یک کوئری IN
@@ -1,8 +1,16 @@
-from sqlalchemy import select
+import logging
+from typing import List, Optional
+from sqlalchemy import select, update, and_, func
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.orm.attributes import set_committed_value
+from database import AsyncSessionLocal, commit_or_flush
 from models.user import User
-from models.payment import Payment
-from datetime import datetime
+from models.wallet import WalletLedgerEntry, WalletSnapshot
+from utils.helpers import Helpers
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
 
 class WalletManager:
     def __init__(self, db: AsyncSession):
@@ -16,134 +24,290 @@ class WalletManager:
         balance = result.scalar_one_or_none()
         return balance if balance is not None else 0.0
     
-    async def add_to_wallet(self, user_id: int, amount: float, 
+    async def _credit(self, user_id: int, amount: int) -> Optional[float]:
+        """افزایش اتمی موجودی بدون commit؛ موجودی جدید یا None اگر کاربر نبود"""
+        result = await self.db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(
+                wallet_balance=func.coalesce(User.wallet_balance, 0.0) + amount,
+                updated_at=datetime.now()
+            )
+            .returning(User.wallet_balance)
+            .execution_options(synchronize_session=False)
+        )
+        return self._sync_balance(user_id, result.scalar_one_or_none())
+    
+    async def _debit(self, user_id: int, amount: int) -> Optional[float]:
+        """کسر اتمی موجودی بدون commit؛ None اگر موجودی کافی نبود
+
+        شرط موجودی داخل همان UPDATE بررسی می‌شود، پس خریدهای همزمان نمی‌توانند
+        کیف پول را منفی کنند.
+        """
+        result = await self.db.execute(
+            update(User)
+            .where(
+                and_(
+                    User.id == user_id,
+                    User.wallet_balance >= amount
+                )
+            )
+            .values(
+                wallet_balance=User.wallet_balance - amount,
+                updated_at=datetime.now()
+            )
+            .returning(User.wallet_balance)
+            .execution_options(synchronize_session=False)
+        )
+        return self._sync_balance(user_id, result.scalar_one_or_none())
+    
+    def _sync_balance(self, user_id: int, balance: Optional[float]) -> Optional[float]:
+        """بروزرسانی شیء User بارگذاری‌شده در session با موجودی برگشتی از UPDATE"""
+        if balance is not None:
+            user = self.db.identity_map.get(identity_key(User, user_id))
+            if user is not None:
+                set_committed_value(user, "wallet_balance", balance)
+        return balance
+    
+    def _append_entry(self, user_id: int, amount: int, balance_after: float,
+                      entry_type: str, description: str = None, payment_id: int = None):
+        """افزودن ردیف به دفتر کل در همان تراکنش دیتابیس"""
+        self.db.add(WalletLedgerEntry(
+            user_id=user_id,
+            amount=amount,
+            balance_after=Helpers.to_toman(balance_after),
+            entry_type=entry_type,
+            description=description,
+            payment_id=payment_id,
+            created_at=datetime.now()
+        ))
+    
+    async def add_to_wallet(self, user_id: int, amount: float,
                            description: str = None, payment_id: int = None) -> bool:
         """افزایش موجودی کیف پول"""
+        amount = Helpers.to_toman(amount)
         if amount <= 0:
             return False
         
-        # بروزرسانی موجودی
-        result = await self.db.execute(
-            select(User).where(User.id == user_id)
-        )
-        user = result.scalar_one_or_none()
+        balance = await self._credit(user_id, amount)
+        if balance is None:
+            return False
         
-        if user:
-            user.wallet_balance += amount
-            user.updated_at = datetime.now()
-            
-            # ثبت تراکنش
-            transaction = Payment(
-                user_id=user_id,
-                amount=amount,
-                payment_method="wallet",
-                description=description or "افزایش موجودی کیف پول",
-                status="success"
-            )
-            self.db.add(transaction)
-            
-            await self.db.commit()
-            return True
-        return False
+        self._append_entry(
+            user_id, amount, balance, "credit",
+            description or "افزایش موجودی کیف پول", payment_id
+        )
+        await commit_or_flush(self.db)
+        return True
     
-    async def deduct_from_wallet(self, user_id: int, amount: float, 
+    async def deduct_from_wallet(self, user_id: int, amount: float,
                                description: str = None) -> bool:
         """کسر از کیف پول"""
+        amount = Helpers.to_toman(amount)
         if amount <= 0:
             return False
         
-        # بررسی موجودی
-        balance = await self.get_user_wallet_balance(user_id)
-        if balance < amount:
+        balance = await self._debit(user_id, amount)
+        if balance is None:
             return False
         
-        # بروزرسانی موجودی
-        result = await self.db.execute(
-            select(User).where(User.id == user_id)
+        self._append_entry(
+            user_id,
+            -amount,  # منفی برای کسر
+            balance, "debit",
+            description or "کسر از کیف پول"
         )
-        user = result.scalar_one_or_none()
-        
-        if user:
-            user.wallet_balance -= amount
-            user.updated_at = datetime.now()
-            
-            # ثبت تراکنش
-            transaction = Payment(
-                user_id=user_id,
-                amount=-amount,  # منفی برای کسر
-                payment_method="wallet",
-                description=description or "کسر از کیف پول",
-                status="success"
+        await commit_or_flush(self.db)
+        return True
+    
+    async def _lock_users(self, user_ids: List[int]) -> int:
+        """قفل ردیف کاربران برای تراکنش جاری؛ تعداد کاربران پیدا‌شده برگردانده می‌شود
+
+        در PostgreSQL ردیف‌ها با SELECT ... FOR UPDATE به ترتیب id قفل می‌شوند. SQLite
+        قفل ردیفی ندارد و خواندن پیش از نوشتن در یک تراکنش، هنگام ارتقا به قفل نوشتن
+        بدون انتظار خطای database is locked می‌دهد؛ پس آنجا اولین دستور یک UPDATE
+        بی‌اثر است که قفل نوشتن کل دیتابیس را با انتظار (busy timeout) می‌گیرد.
+        """
+        if self.db.get_bind().dialect.name == "sqlite":
+            result = await self.db.execute(
+                update(User)
+                .where(User.id.in_(user_ids))
+                .values(wallet_balance=User.wallet_balance)
+                .returning(User.id)
+                .execution_options(synchronize_session=False)
             )
-            self.db.add(transaction)
-            
-            await self.db.commit()
-            return True
-        return False
+        else:
+            result = await self.db.execute(
+                select(User.id)
+                .where(User.id.in_(user_ids))
+                .order_by(User.id)
+                .with_for_update()
+            )
+        return len(result.all())
     
-    async def transfer_to_wallet(self, from_user_id: int, to_user_id: int, 
+    async def transfer_to_wallet(self, from_user_id: int, to_user_id: int,
                                amount: float, description: str = None) -> bool:
-        """انتقال بین کیف پول‌ها"""
-        if amount <= 0:
-            return False
-        
-        # بررسی موجودی فرستنده
-        from_balance = await self.get_user_wallet_balance(from_user_id)
-        if from_balance < amount:
-            return False
-        
-        # کسر از فرستنده
-        if not await self.deduct_from_wallet(
-            from_user_id, amount, 
-            f"انتقال به کاربر {to_user_id} - {description or ''}"
-        ):
+        """انتقال بین کیف پول‌ها در یک تراکنش
+
+        ردیف هر دو کاربر پیش از هر تغییری قفل می‌شوند (_lock_users) تا انتقال‌های
+        همزمان در دو جهت مخالف به بن‌بست نخورند.
+        هر دو طرف داخل یک SAVEPOINT هستند، پس خطا فقط همین انتقال را برمی‌گرداند،
+        نه بقیه تغییرات session مشترک آپدیت.
+        """
+        amount = Helpers.to_toman(amount)
+        if amount <= 0 or from_user_id == to_user_id:
             return False
         
-        # افزایش به گیرنده
-        if not await self.add_to_wallet(
-            to_user_id, amount,
-            f"دریافت از کاربر {from_user_id} - {description or ''}"
-        ):
-            # برگشت مبلغ به فرستنده در صورت خطا
-            await self.add_to_wallet(
-                from_user_id, amount,
-                "برگشت مبلغ به دلیل خطا در انتقال"
+        async with self.db.begin_nested():
+            if await self._lock_users([from_user_id, to_user_id]) != 2:
+                return False
+            
+            from_balance = await self._debit(from_user_id, amount)
+            if from_balance is None:
+                return False
+            to_balance = await self._credit(to_user_id, amount)
+            
+            self._append_entry(
+                from_user_id, -amount, from_balance, "transfer_out",
+                f"انتقال به کاربر {to_user_id} - {description or ''}"
             )
-            return False
+            self._append_entry(
+                to_user_id, amount, to_balance, "transfer_in",
+                f"دریافت از کاربر {from_user_id} - {description or ''}"
+            )
+            await self.db.flush()
         
+        await commit_or_flush(self.db)
         return True
     
-    async def get_wallet_transactions(self, user_id: int, page: int = 1, 
-                                    per_page: int = 20) -> list:
-        """دریافت تراکنش‌های کیف پول"""
-        offset = (page - 1) * per_page
+    async def get_wallet_transactions(self, user_id: int, per_page: int = 20,
+                                    before_id: int = None) -> List[WalletLedgerEntry]:
+        """دریافت تراکنش‌های کیف پول (صفحه‌بندی keyset؛ before_id آخرین id صفحه قبل)"""
+        conditions = [WalletLedgerEntry.user_id == user_id]
+        if before_id is not None:
+            conditions.append(WalletLedgerEntry.id < before_id)
         result = await self.db.execute(
-            select(Payment)
-            .where(
-                and_(
-                    Payment.user_id == user_id,
-                    Payment.payment_method == "wallet"
-                )
-            )
-            .order_by(Payment.created_at.desc())
-            .offset(offset).limit(per_page)
+            select(WalletLedgerEntry)
+            .where(and_(*conditions))
+            .order_by(WalletLedgerEntry.id.desc())
+            .limit(per_page)
         )
         return result.scalars().all()
     
     async def set_wallet_balance(self, user_id: int, balance: float) -> bool:
-        """تنظیم موجودی کیف پول (برای ادمین)"""
+        """تنظیم موجودی کیف پول (برای ادمین)؛ اختلاف به صورت adjust ثبت می‌شود"""
+        balance = max(0, Helpers.to_toman(balance))  # جلوگیری از منفی
+        result = await self.db.execute(
+            select(User.wallet_balance).where(User.id == user_id).with_for_update()
+        )
+        current = result.scalar_one_or_none()
+        if current is None:
+            return False
+        
+        delta = balance - Helpers.to_toman(current or 0)
+        await self.db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(wallet_balance=balance, updated_at=datetime.now())
+            .execution_options(synchronize_session=False)
+        )
+        self._sync_balance(user_id, balance)
+        if delta:
+            self._append_entry(user_id, delta, balance, "adjust", "تنظیم موجودی توسط ادمین")
+        await commit_or_flush(self.db)
+        return True
+    
+    async def _latest_snapshot(self, user_id: int) -> Optional[WalletSnapshot]:
+        result = await self.db.execute(
+            select(WalletSnapshot)
+            .where(WalletSnapshot.user_id == user_id)
+            .order_by(WalletSnapshot.ledger_id.desc())
+            .limit(1)
+        )
+        return result.scalar_one_or_none()
+    
+    async def reconstruct_balance(self, user_id: int, until: datetime = None) -> tuple:
+        """بازسازی موجودی از آخرین snapshot و ردیف‌های بعد از آن
+
+        خروجی (موجودی، id آخرین ردیف دفتر کل) است. با until فقط ردیف‌های ثبت‌شده
+        تا آن زمان حساب می‌شوند.
+        """
+        snapshot = await self._latest_snapshot(user_id)
+        base_balance = snapshot.balance if snapshot else 0
+        base_ledger_id = snapshot.ledger_id if snapshot else 0
+        
+        conditions = [
+            WalletLedgerEntry.user_id == user_id,
+            WalletLedgerEntry.id > base_ledger_id
+        ]
+        if until is not None:
+            conditions.append(WalletLedgerEntry.created_at <= until)
+        result = await self.db.execute(
+            select(
+                func.coalesce(func.sum(WalletLedgerEntry.amount), 0),
+                func.max(WalletLedgerEntry.id)
+            ).where(and_(*conditions))
+        )
+        delta, last_id = result.one()
+        return base_balance + delta, last_id or base_ledger_id
+    
+    async def audit_wallet(self, user_id: int) -> dict:
+        """مقایسه موجودی ذخیره‌شده با موجودی بازسازی‌شده از دفتر کل"""
+        stored = Helpers.to_toman(await self.get_user_wallet_balance(user_id))
+        ledger_balance, _ = await self.reconstruct_balance(user_id)
+        return {
+            "user_id": user_id,
+            "stored_balance": stored,
+            "ledger_balance": ledger_balance,
+            "ok": stored == ledger_balance
+        }
+    
+    async def take_snapshots(self, settle_seconds: int = 60) -> int:
+        """ثبت snapshot برای کاربرانی که از آخرین snapshot تراکنش داشته‌اند
+
+        ردیف‌های settle_seconds ثانیه اخیر کنار گذاشته می‌شوند تا تراکنشی که id
+        کوچک‌تر گرفته ولی دیرتر commit شده، پشت snapshot جا نماند.
+        """
+        until = datetime.now() - timedelta(seconds=settle_seconds)
+        watermark = (await self.db.execute(
+            select(func.coalesce(func.max(WalletSnapshot.ledger_id), 0))
+        )).scalar_one()
+        
         result = await self.db.execute(
-            select(User).where(User.id == user_id)
+            select(WalletLedgerEntry.user_id)
+            .where(
+                and_(
+                    WalletLedgerEntry.id > watermark,
+                    WalletLedgerEntry.created_at <= until
+                )
+            )
+            .distinct()
         )
-        user = result.scalar_one_or_none()
+        user_ids = result.scalars().all()
         
-        if user:
-            user.wallet_balance = max(0, balance)  # جلوگیری از منفی
-            user.updated_at = datetime.now()
-            await self.db.commit()
-            return True
-        return False
+        for user_id in user_ids:
+            balance, ledger_id = await self.reconstruct_balance(user_id, until)
+            self.db.add(WalletSnapshot(user_id=user_id, ledger_id=ledger_id, balance=balance))
+        
+            audit = await self.audit_wallet(user_id)
+            if not audit["ok"]:
+                logger.warning(
+                    f"Wallet mismatch for user {user_id}: stored {audit['stored_balance']}, "
+                    f"ledger {audit['ledger_balance']}"
+                )
+        
+        await commit_or_flush(self.db)
+        return len(user_ids)
+    
+    @classmethod
+    async def snapshot_all(cls):
+        """اجرای دوره‌ای snapshot با session مستقل"""
+        async with AsyncSessionLocal() as db:
+            count = await cls(db).take_snapshots()
+            if count:
+                logger.info(f"Wallet snapshots taken for {count} users")
 
 # نمونه استفاده
 # wallet_manager = WalletManager(db_session)
 # await wallet_manager.add_to_wallet(1, 50000.0, "شارژ کیف پول")
+# balance, _ = await wallet_manager.reconstruct_balance(1)
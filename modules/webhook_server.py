@@ -0,0 +1,144 @@
+import asyncio
+import json
+import logging
+import signal
+from typing import Callable, Dict, Optional
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class WebhookServer:
+    """سرور وب‌هوک تلگرام روی aiohttp
+
+    آپدیت‌ها فقط اعتبارسنجی و در update_queue برنامه گذاشته می‌شوند و پاسخ
+    بلافاصله برمی‌گردد؛ پردازش همزمان آن‌ها بر عهده Application است.
+    """
+
+    SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+    def __init__(self, app: Application, metrics: Optional[Callable[[], Dict]] = None,
+                 host: str = "0.0.0.0", port: int = None, path: str = None,
+                 secret: str = None):
+        self.app = app
+        self.metrics = metrics
+        self.host = host
+        self.port = port or Config.WEBHOOK_PORT
+        self.path = path or Config.WEBHOOK_PATH
+        self.secret = secret if secret is not None else Config.WEBHOOK_SECRET
+        self.received = 0
+        self.rejected = 0
+        self._accepting = False
+        self._runner: Optional[web.AppRunner] = None
+        self._stop_event = asyncio.Event()
+
+    def _build_app(self) -> web.Application:
+        web_app = web.Application()
+        web_app.router.add_post(self.path, self.handle_update)
+        web_app.router.add_get("/health", self.handle_health)
+        web_app.router.add_get("/metrics", self.handle_metrics)
+        return web_app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        """دریافت آپدیت از تلگرام"""
+        if self.secret and request.headers.get(self.SECRET_HEADER) != self.secret:
+            self.rejected += 1
+            return web.Response(status=403)
+        if not self._accepting:
+            # در حال خاموش شدن؛ تلگرام بعداً دوباره ارسال می‌کند
+            return web.Response(status=503)
+
+        try:
+            data = await request.json()
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            self.rejected += 1
+            return web.Response(status=400)
+
+        update = Update.de_json(data, self.app.bot)
+        if update is None:
+            self.rejected += 1
+            return web.Response(status=400)
+
+        self.received += 1
+        await self.app.update_queue.put(update)
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        """بررسی سلامت برای load balancer و داکر"""
+        status = 200 if self._accepting and self.app.running else 503
+        return web.json_response({"status": "ok" if status == 200 else "unavailable"}, status=status)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        """آمار سرور وب‌هوک و اجزای ربات"""
+        data = {
+            "webhook": {
+                "received": self.received,
+                "rejected": self.rejected,
+                "queue_size": self.app.update_queue.qsize()
+            }
+        }
+        if self.metrics:
+            data.update(self.metrics())
+        return web.json_response(data, dumps=lambda obj: json.dumps(obj, default=str))
+
+    async def start(self):
+        """شروع گوش دادن روی پورت"""
+        self._runner = web.AppRunner(self._build_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self._accepting = True
+        logger.info(f"Webhook server listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        """توقف دریافت آپدیت جدید و بستن سرور"""
+        self._accepting = False
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def request_stop(self):
+        """درخواست خاموشی (از signal handler)"""
+        self._stop_event.set()
+
+    async def serve(self):
+        """اجرای کامل حالت وب‌هوک تا دریافت SIGINT/SIGTERM"""
+        app = self.app
+        await app.initialize()
+        if app.post_init:
+            await app.post_init(app)
+
+        await app.start()
+        await self.start()
+        await app.bot.set_webhook(
+            url=Config.WEBHOOK_URL.rstrip("/") + self.path,
+            secret_token=self.secret or None,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=min(Config.UPDATE_CONCURRENCY, 100)  # سقف تلگرام
+        )
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.request_stop)
+            except NotImplementedError:
+                pass
+
+        try:
+            await self._stop_event.wait()
+        finally:
+            logger.info("Shutting down webhook server...")
+            # ابتدا ورودی بسته می‌شود، سپس app.stop آپدیت‌های در صف و در حال پردازش را تمام می‌کند
+            await self.stop()
+            await app.stop()
+            if app.post_stop:
+                await app.post_stop(app)
+            await app.shutdown()
+            if app.post_shutdown:
+                await app.post_shutdown(app)
+
+# نمونه استفاده
+# server = WebhookServer(application, metrics=bot.get_metrics)
+# await server.serve()
@@ -0,0 +1,121 @@
+"""تنظیمات مشترک تست‌ها
+
+تست‌ها روی SQLite درون حافظه (aiosqlite) اجرا می‌شوند. تابع تستی که async
+باشد روی یک حلقه رویداد مشترک اجرا می‌شود تا اتصال‌های engine بین تست‌ها
+معتبر بمانند؛ نیازی به pytest-asyncio نیست.
+"""
+import asyncio
+import inspect
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite://"
+os.environ.setdefault("BOT_TOKEN", "123:abc")
+os.environ.setdefault("ADMIN_ID", "42")
+
+from sqlalchemy import event, text  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from database import engine, Base, AsyncSessionLocal  # noqa: E402
+from migrations.runner import upgrade  # noqa: E402
+
+LOOP = asyncio.new_event_loop()
+
+def run(coroutine):
+    """اجرای یک coroutine روی حلقه مشترک تست‌ها"""
+    return LOOP.run_until_complete(coroutine)
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    arguments = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    run(pyfuncitem.obj(**arguments))
+    return True
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    run(upgrade(engine))
+    yield
+    run(engine.dispose())
+
+@pytest.fixture(autouse=True)
+def clean_database():
+    """خالی کردن جدول‌ها و کش‌های درون‌فرآیندی بعد از هر تست"""
+    yield
+    from modules.user_manager import UserIdentityCache
+
+    async def truncate():
+        async with engine.begin() as conn:
+            for table in reversed(Base.metadata.sorted_tables):
+                await conn.execute(table.delete())
+    run(truncate())
+    UserIdentityCache._cache.clear()
+
+@pytest.fixture
+def file_sessions(tmp_path):
+    """sessionmaker روی SQLite فایلی با اتصال جدا برای هر session (برای تست‌های همزمانی)
+
+    SQLite درون حافظه فقط یک اتصال مشترک دارد و تراکنش‌های همزمان را نشان نمی‌دهد.
+    """
+    file_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'concurrency.db'}",
+        connect_args={"timeout": 30}
+    )
+    run(upgrade(file_engine))
+    yield sessionmaker(file_engine, class_=AsyncSession, expire_on_commit=False)
+    run(file_engine.dispose())
+
+@pytest.fixture
+def db():
+    """یک session مستقل (بیرون از UnitOfWork)"""
+    session = AsyncSessionLocal()
+    yield session
+    run(session.close())
+
+class QueryCounter:
+    """شمارش دستورهای SQL اجراشده روی engine"""
+
+    def __init__(self):
+        self.statements = []
+        self.parameters = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+        self.parameters.append(parameters)
+
+    def count(self, table: str = None) -> int:
+        if table is None:
+            return len(self.statements)
+        return sum(1 for statement in self.statements if f"FROM {table}" in statement)
+
+    def reset(self):
+        self.statements.clear()
+        self.parameters.clear()
+
+@pytest.fixture
+def queries():
+    counter = QueryCounter()
+    event.listen(engine.sync_engine, "before_cursor_execute", counter)
+    yield counter
+    event.remove(engine.sync_engine, "before_cursor_execute", counter)
+
+class FakeQuery:
+    """CallbackQuery حداقلی برای رندر صفحه‌های ادمین"""
+
+    def __init__(self, user_id: int = 42):
+        self.from_user = type("FromUser", (), {"id": user_id})()
+        self.text = None
+
+    async def edit_message_text(self, text, reply_markup=None):
+        self.text = text
+
+    async def answer(self, text=None, **kwargs):
+        self.text = text
+
+async def set_created_at(db, table: str, value: str = "2026-01-01 12:00:00", where: str = "1 = 1"):
+    """نوشتن created_at به همان شکلی که CURRENT_TIMESTAMP در SQLite ذخیره می‌کند"""
+    await db.execute(text(f"UPDATE {table} SET created_at = :value WHERE {where}"), {"value": value})
+    await db.commit()
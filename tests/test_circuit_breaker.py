@@ -0,0 +1,70 @@
+import pytest
+from utils import circuit_breaker
+from utils.circuit_breaker import CircuitBreaker
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ساعت قابل کنترل و بازیابی بدون jitter"""
+    now = [1000.0]
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(circuit_breaker.random, "uniform", lambda low, high: 1.0)
+    return now
+
+def tripped(failure_threshold: int = 3) -> CircuitBreaker:
+    breaker = CircuitBreaker("panel", failure_threshold=failure_threshold, recovery_timeout=10,
+                             max_recovery_timeout=40)
+    for _ in range(failure_threshold):
+        assert breaker.allow_request()
+        breaker.record_failure()
+    return breaker
+
+def test_consecutive_failures_open_the_circuit(clock):
+    breaker = tripped()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    assert breaker.get_stats()["rejected_calls"] == 1
+
+def test_late_success_does_not_close_an_open_circuit(clock):
+    breaker = tripped()
+
+    # جواب درخواستی که قبل از باز شدن مدار فرستاده شده بود
+    breaker.record_success()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.consecutive_failures == 3
+    assert not breaker.allow_request()
+
+def test_half_open_probe_success_closes_the_circuit(clock):
+    breaker = tripped()
+    clock[0] += 10
+
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request()  # فقط یک درخواست آزمایشی
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request() and breaker.allow_request()
+
+def test_half_open_probe_failure_reopens_with_a_longer_timeout(clock):
+    breaker = tripped()
+    clock[0] += 10
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock[0] += 19
+    assert not breaker.allow_request()
+    clock[0] += 1
+    assert breaker.allow_request() and breaker.state == CircuitBreaker.HALF_OPEN
+
+def test_success_while_closed_resets_the_failure_streak(clock):
+    breaker = CircuitBreaker("panel", failure_threshold=3)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.consecutive_failures == 1
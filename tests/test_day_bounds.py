@@ -0,0 +1,48 @@
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import func, select
+from models.user import User
+from modules.admin.stats_admin import StatsAdmin
+from modules.rollup_manager import RollupManager
+from conftest import set_created_at
+
+def stored(day: date, at: time = time.min) -> str:
+    """created_at به شکل CURRENT_TIMESTAMP در SQLite"""
+    return datetime.combine(day, at).strftime("%Y-%m-%d %H:%M:%S")
+
+async def add_users(db, *created_at: str):
+    for value in created_at:
+        telegram_id = 300 + await db.scalar(select(func.count(User.id)))
+        db.add(User(telegram_id=telegram_id, referral_code=f"DAY{telegram_id}"))
+        await db.flush()
+        await set_created_at(db, "users", value, where=f"telegram_id = {telegram_id}")
+
+async def test_row_at_midnight_counts_as_today(db):
+    today = date.today()
+    await add_users(db, stored(today), stored(today - timedelta(days=1), time(23, 59, 59)))
+
+    stats = await StatsAdmin(db).get_system_stats()
+    assert stats["today_users"] == 1
+
+    # نیمه‌شب فردا دیگر جزو امروز نیست
+    await add_users(db, stored(today + timedelta(days=1)))
+    stats = await StatsAdmin(db).get_system_stats()
+    assert stats["total_users"] == 3
+    assert stats["today_users"] == 1
+
+async def test_rollup_puts_midnight_rows_on_their_own_day(db):
+    today = date.today()
+    two_days_ago = today - timedelta(days=2)
+    yesterday = today - timedelta(days=1)
+    await add_users(
+        db,
+        stored(two_days_ago, time(23, 59, 59)),
+        stored(yesterday),
+        stored(yesterday, time(12)),
+        stored(today)
+    )
+
+    await RollupManager(db).refresh()
+    signups = await RollupManager(db).get_signup_statistics(days=5)
+
+    assert signups["daily"] == {two_days_ago: 1, yesterday: 2, today: 1}
+    assert signups["total"] == 4
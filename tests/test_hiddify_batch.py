@@ -0,0 +1,139 @@
+import asyncio
+import time
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from config import Config
+from modules.hidify_api import AsyncHiddifyAPI
+
+class StubPanel:
+    """پنل هیدیفای محلی؛ fail_first یعنی اولین درخواست آن مسیر 503 می‌گیرد
+
+    lose_response یعنی اولین POST آن کاربر انجام می‌شود ولی پاسخش 503 است.
+    """
+
+    def __init__(self, fail_first=(), reject=(), lose_response=()):
+        self.fail_first = set(fail_first)
+        self.reject = set(reject)
+        self.lose_response = set(lose_response)
+        self.users = {}
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.app = web.Application()
+        self.app.router.add_route("*", "/admin/api/v2/admin/user/{uuid:.*}", self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        uuid = request.match_info["uuid"].strip("/")
+        body = await request.json() if request.can_read_body else None
+        key = uuid or body["name"]
+        self.requests.append((request.method, key, body))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if key in self.fail_first:
+                self.fail_first.discard(key)
+                return web.Response(status=503)
+            if key in self.reject:
+                return web.Response(status=422)
+            if request.method == "GET":
+                if uuid not in self.users:
+                    return web.Response(status=404)
+                return web.json_response(self.users[uuid])
+            if request.method == "POST":
+                self.users[body["uuid"]] = {"method": "POST", "key": key, "body": body}
+                if key in self.lose_response:
+                    self.lose_response.discard(key)
+                    return web.Response(status=503)
+            return web.json_response({"method": request.method, "key": key, "body": body})
+        finally:
+            self.in_flight -= 1
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(Config, "HIDDIFY_BACKOFF_BASE", 0.0)
+    monkeypatch.setattr(Config, "HIDDIFY_BACKOFF_MAX", 0.0)
+
+async def serve(panel: StubPanel):
+    server = TestServer(panel.app)
+    await server.start_server()
+    api = AsyncHiddifyAPI(base_url=str(server.make_url("")), api_key="key", proxy_path="admin")
+    return server, api
+
+async def test_bulk_create_keeps_input_order_and_retries_transient_errors(no_backoff):
+    panel = StubPanel(fail_first={"u3"}, reject={"u5"})
+    server, api = await serve(panel)
+    try:
+        results = await api.bulk_create_users(
+            ({"name": f"u{i}"} for i in range(8)), concurrency=3
+        )
+    finally:
+        await api.close()
+        await server.close()
+
+    assert [r["index"] for r in results] == list(range(8))
+    assert [r["result"]["key"] for r in results if r["success"]] == [f"u{i}" for i in range(8) if i != 5]
+    assert results[3]["attempts"] == 2
+    assert not results[5]["success"] and results[5]["attempts"] == 1
+    assert "422" in results[5]["error"]
+    assert panel.max_in_flight <= 3
+
+async def test_bulk_create_does_not_duplicate_a_user_whose_response_was_lost(no_backoff):
+    panel = StubPanel(lose_response={"u2"})
+    server, api = await serve(panel)
+    try:
+        results = await api.bulk_create_users([{"name": f"u{i}"} for i in range(4)] + [{"name": "u4", "uuid": "fixed"}])
+    finally:
+        await api.close()
+        await server.close()
+
+    assert all(r["success"] for r in results)
+    assert results[2]["attempts"] == 2 and results[2]["result"]["key"] == "u2"
+    assert sum(1 for method, key, _ in panel.requests if method == "POST" and key == "u2") == 1
+    assert len(panel.users) == 5 and "fixed" in panel.users
+
+async def test_bulk_create_throughput_against_a_slow_panel(no_backoff):
+    """نسخه کوچک‌شده بنچمارک: 300 کاربر با تاخیر 10ms پنل و 10 درخواست همزمان"""
+    panel = StubPanel()
+    server, api = await serve(panel)
+    try:
+        started = time.perf_counter()
+        results = await api.bulk_create_users(({"name": f"u{i}"} for i in range(300)), concurrency=10)
+        elapsed = time.perf_counter() - started
+    finally:
+        await api.close()
+        await server.close()
+
+    assert all(r["success"] for r in results)
+    assert panel.max_in_flight == 10
+    # حالت یکی‌یکی حداقل 3 ثانیه طول می‌کشد
+    assert elapsed < 300 * 0.01 / 3
+
+async def test_bulk_update_and_delete_address_users_by_uuid(no_backoff):
+    panel = StubPanel()
+    server, api = await serve(panel)
+    try:
+        updated = await api.bulk_update_users([{"uuid": "a", "usage_limit_GB": 10}, {"uuid": "b", "enable": False}])
+        deleted = await api.bulk_delete_users(["a", "b"], retries=0)
+    finally:
+        await api.close()
+        await server.close()
+
+    assert all(r["success"] for r in updated + deleted)
+    patches = sorted(r for r in panel.requests if r[0] == "PATCH")
+    assert patches == [("PATCH", "a", {"usage_limit_GB": 10}), ("PATCH", "b", {"enable": False})]
+    assert sorted(key for method, key, _ in panel.requests if method == "DELETE") == ["a", "b"]
+
+async def test_bulk_gives_up_after_the_retry_budget(no_backoff):
+    panel = StubPanel(fail_first={"a"})
+    server, api = await serve(panel)
+    try:
+        results = await api.bulk_delete_users(["a"], retries=0)
+    finally:
+        await api.close()
+        await server.close()
+
+    assert results[0]["success"] is False
+    assert results[0]["attempts"] == 1
+    assert "503" in results[0]["error"]
@@ -0,0 +1,55 @@
+from sqlalchemy import select
+from models.user import HiddifyUserState
+from modules.hiddify_mirror import HiddifyMirror
+
+class FakeListAPI:
+    """کلاینت ساختگی که فقط فهرست کامل کاربران را برمی‌گرداند"""
+
+    def __init__(self, users):
+        self.users = users
+
+    async def get_all_users(self):
+        return [dict(user) for user in self.users.values()]
+
+def panel_users(count: int) -> dict:
+    return {
+        f"u{i}": {"uuid": f"u{i}", "name": f"user {i}", "usage_limit_GB": 10, "current_usage_GB": i}
+        for i in range(count)
+    }
+
+async def test_refresh_writes_only_changed_and_removed_users(db, queries):
+    api = FakeListAPI(panel_users(5))
+    mirror = HiddifyMirror(api)
+    await mirror.refresh(force=True)
+
+    api.users["u1"]["current_usage_GB"] = 9
+    del api.users["u4"]
+    queries.reset()
+    await mirror.refresh(force=True)
+
+    writes = [s.split()[0] for s in queries.statements if s.split()[0] in ("INSERT", "UPDATE", "DELETE")]
+    assert writes == ["UPDATE", "DELETE"]
+    rows = (await db.execute(select(HiddifyUserState.hiddify_uuid, HiddifyUserState.current_usage_gb))).all()
+    assert sorted(rows) == [("u0", 0.0), ("u1", 9.0), ("u2", 2.0), ("u3", 3.0)]
+
+async def test_reloaded_mirror_detects_changes_from_its_hashes():
+    api = FakeListAPI(panel_users(3))
+    await HiddifyMirror(api).refresh(force=True)
+
+    reloaded = HiddifyMirror(api)
+    await reloaded.load_from_db()
+    assert not hasattr(reloaded, "_raw")
+    assert all(len(fingerprint) == 16 for fingerprint in reloaded._hashes.values())
+
+    api.users["u2"]["name"] = "renamed"
+    written = []
+    original = reloaded._persist
+
+    async def persist(changed, removed, synced_at):
+        written.append((sorted(changed), removed))
+        await original(changed, removed, synced_at)
+
+    reloaded._persist = persist
+    await reloaded.refresh(force=True)
+    assert written == [(["u2"], [])]
+    assert (await reloaded.get_user("u2"))["name"] == "renamed"
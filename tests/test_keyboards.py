@@ -0,0 +1,87 @@
+import time
+import tracemalloc
+import pytest
+from models.plan import Plan
+from modules.plan_manager import PlanCache, PlanManager
+from utils.keyboards import Keyboards
+
+@pytest.fixture(autouse=True)
+def fresh_catalog():
+    PlanCache.invalidate()
+    Keyboards._plans_list_cache = None
+    yield
+    PlanCache.invalidate()
+
+def callback_data(keyboard) -> list:
+    return [button.callback_data for row in keyboard.inline_keyboard for button in row]
+
+def test_static_menus_are_shared_between_calls():
+    assert Keyboards.shop_menu() is Keyboards.shop_menu()
+    assert Keyboards.admin_menu() is Keyboards.admin_menu()
+    assert Keyboards.plan_actions(3) is Keyboards.plan_actions(3)
+    assert Keyboards.plan_actions(3) is not Keyboards.plan_actions(4)
+
+def test_main_menu_is_cached_per_role():
+    user_menu, admin_menu = Keyboards.main_menu(False), Keyboards.main_menu(True)
+
+    assert Keyboards.main_menu(True) is admin_menu
+    assert "admin_panel" in callback_data(admin_menu)
+    assert "admin_panel" not in callback_data(user_menu)
+
+def test_cursor_navigation_is_not_cached():
+    first = Keyboards.admin_users_navigation(2, "40")
+
+    assert Keyboards.admin_users_navigation(2, "40") is not first
+    assert "admin_users_page_3_40" in callback_data(first)
+
+async def test_plans_list_is_rebuilt_when_the_catalog_changes(db):
+    db.add(Plan(name="Basic", days=30, traffic_gb=50, price=100000))
+    await db.commit()
+    manager = PlanManager(db)
+
+    plans = await manager.get_active_plans()
+    keyboard = Keyboards.plans_list(plans, version=PlanCache.version)
+    assert Keyboards.plans_list(plans, version=PlanCache.version) is keyboard
+
+    await manager.update_plan(plans[0].id, price=150000)
+    plans = await manager.get_active_plans()
+    updated = Keyboards.plans_list(plans, version=PlanCache.version)
+
+    assert updated is not keyboard
+    assert "150" in updated.inline_keyboard[0][0].text
+
+def render_callbacks(count: int, cached: bool, plans) -> list:
+    """کیبوردهای count کالبک پشت‌سرهم؛ با cached=False هر بار از نو ساخته می‌شوند"""
+    if cached:
+        builders = [
+            lambda: Keyboards.main_menu(False), lambda: Keyboards.main_menu(True),
+            Keyboards.shop_menu, Keyboards.admin_menu,
+            lambda: Keyboards.plans_list(plans, version=PlanCache.version)
+        ]
+    else:
+        builders = [
+            lambda: Keyboards.main_menu.__wrapped__(False), lambda: Keyboards.main_menu.__wrapped__(True),
+            Keyboards.shop_menu.__wrapped__, Keyboards.admin_menu.__wrapped__,
+            lambda: Keyboards.plans_list(plans)
+        ]
+    return [builders[i % len(builders)]() for i in range(count)]
+
+def test_memoized_keyboards_save_per_callback_allocations():
+    """نسخه کوچک‌شده میکروبنچمارک: حافظه و زمان 2000 کالبک با و بدون کش"""
+    plans = [Plan(id=i, name=f"Plan {i}", days=30, traffic_gb=50, price=100000 + i) for i in range(10)]
+    render_callbacks(5, True, plans)  # گرم کردن کش
+
+    measured = {}
+    for cached in (True, False):
+        tracemalloc.start()
+        started = time.perf_counter()
+        keyboards = render_callbacks(2000, cached, plans)
+        elapsed = time.perf_counter() - started
+        allocated, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        measured[cached] = (allocated, elapsed, len({id(keyboard) for keyboard in keyboards}))
+
+    assert measured[True][2] == 5 and measured[False][2] == 2000
+    # با کش هر کالبک فقط یک ارجاع به کیبورد مشترک نگه می‌دارد
+    assert measured[False][0] > 20 * measured[True][0]
+    assert measured[True][1] < measured[False][1]
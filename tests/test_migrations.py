@@ -0,0 +1,61 @@
+from sqlalchemy import inspect, select, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from database import Base
+from migrations import baseline
+from migrations.runner import current_version, upgrade
+from migrations.versions import HEAD, load_models
+
+def missing_from_models(connection) -> list:
+    """جدول، ستون و ایندکس‌هایی از مدل‌ها که در دیتابیس نیستند"""
+    load_models()
+    inspector = inspect(connection)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            missing.append(table.name)
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        missing += [f"{table.name}.{column.name}" for column in table.columns if column.name not in columns]
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing += [index.name for index in table.indexes if index.name not in indexes]
+    return missing
+
+async def test_empty_database_upgrades_to_the_models(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'empty.db'}")
+    try:
+        assert await upgrade(engine) == HEAD
+        async with engine.connect() as conn:
+            assert await conn.run_sync(missing_from_models) == []
+    finally:
+        await engine.dispose()
+
+async def test_pre_series_database_upgrades_to_head(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'legacy.db'}")
+    try:
+        # شمایی که create_all قدیمی ربات پیش از نسخه‌گذاری می‌ساخت، با داده
+        async with engine.begin() as conn:
+            await conn.run_sync(lambda sync_conn: baseline.metadata.create_all(
+                sync_conn, tables=baseline.LEGACY_TABLES
+            ))
+            await conn.execute(baseline.users.insert().values(
+                id=1, telegram_id=100, referral_code="OLD00001", wallet_balance=5000.0
+            ))
+            await conn.execute(baseline.plans.insert().values(id=1, name="p", days=30, traffic_gb=50, price=1000))
+            await conn.execute(baseline.orders.insert().values(
+                user_id=1, plan_id=1, plan_name="p", days=30, traffic_gb=50, price=1000, status="completed"
+            ))
+        assert await current_version(engine) == 0
+
+        assert await upgrade(engine) == HEAD
+        assert await upgrade(engine) == HEAD
+
+        async with engine.connect() as conn:
+            assert await conn.run_sync(missing_from_models) == []
+            orders = (await conn.execute(text("SELECT status, hiddify_panel FROM orders"))).all()
+            assert orders == [("completed", None)]
+            ledger = (await conn.execute(text("SELECT user_id, amount, entry_type FROM wallet_ledger"))).all()
+            assert ledger == [(1, 5000, "opening")]
+            versions = (await conn.execute(text("SELECT version FROM schema_version ORDER BY version"))).scalars()
+            assert list(versions) == list(range(1, HEAD + 1))
+    finally:
+        await engine.dispose()
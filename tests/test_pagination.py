@@ -0,0 +1,124 @@
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from conftest import set_created_at
+from models.agent_request import AgentRequest
+from models.payment import Payment
+from models.user import User
+from modules.agent_manager import AgentManager
+from modules.payment_manager import PaymentManager
+from modules.referral import ReferralManager
+from modules.user_manager import UserManager
+from utils.pagination import Keyset
+
+async def walk(fetch, per_page):
+    """پیمایش همه صفحه‌ها با next_cursor؛ idهای هر صفحه برگردانده می‌شوند"""
+    pages, cursor = [], None
+    while True:
+        page = await fetch(cursor=cursor, per_page=per_page)
+        pages.append([row.id for row in page])
+        if page.next_cursor is None:
+            return pages
+        assert len(pages) < 100, "pagination did not terminate"
+        cursor = page.next_cursor
+
+async def test_users_created_in_the_same_second_are_paged_once(db):
+    users = UserManager(db)
+    for telegram_id in range(1, 26):
+        await users.create_user(telegram_id, f"user{telegram_id}")
+    await set_created_at(db, "users")
+
+    pages = await walk(users.get_all_users, per_page=10)
+
+    assert [len(page) for page in pages] == [10, 10, 5]
+    ids = [row_id for page in pages for row_id in page]
+    assert ids == sorted(ids, reverse=True)
+    assert len(set(ids)) == 25
+
+async def test_filtered_pages_skip_other_rows(db):
+    user = await UserManager(db).create_user(1, "payer")
+    for i in range(12):
+        db.add(Payment(user_id=user.id, amount=1000, payment_method="manual",
+                       status="pending" if i % 2 else "success"))
+    await db.commit()
+    await set_created_at(db, "payments")
+
+    pages = await walk(PaymentManager(db).get_pending_payments, per_page=4)
+
+    assert [len(page) for page in pages] == [4, 2]
+    pending = {payment.id for payment in await PaymentManager(db).get_pending_payments(per_page=50)}
+    assert {row_id for page in pages for row_id in page} == pending
+
+async def test_newer_rows_come_first_across_seconds(db):
+    users = UserManager(db)
+    for telegram_id in range(1, 7):
+        await users.create_user(telegram_id)
+    await set_created_at(db, "users", "2026-01-01 12:00:00")
+    await users.create_user(7)
+    await set_created_at(db, "users", "2026-01-02 08:00:00", where="telegram_id = 7")
+
+    first = await users.get_all_users(per_page=3)
+    rest = await users.get_all_users(cursor=first.next_cursor, per_page=10)
+    assert [u.telegram_id for u in first] == [7, 6, 5]
+    assert [u.telegram_id for u in rest] == [4, 3, 2, 1]
+
+async def test_referral_and_agent_request_pages(db):
+    users = UserManager(db)
+    referrer = await users.create_user(1)
+    referrals = ReferralManager(db)
+    for telegram_id in range(2, 9):
+        referred = await users.create_user(telegram_id)
+        await referrals.create_referral(referrer.id, referred.id)
+        db.add(AgentRequest(user_id=referred.id, full_name="x", phone="1"))
+    await db.commit()
+    await set_created_at(db, "referrals")
+    await set_created_at(db, "agent_requests")
+
+    referral_pages = []
+    cursor = None
+    while True:
+        page = await referrals.get_user_referrals(referrer.id, cursor=cursor, per_page=3)
+        referral_pages.append([user.telegram_id for user, _, _ in page])
+        if page.next_cursor is None:
+            break
+        cursor = page.next_cursor
+    assert referral_pages == [[8, 7, 6], [5, 4, 3], [2]]
+
+    agent_pages = await walk(AgentManager(db).get_pending_requests, per_page=5)
+    assert [len(page) for page in agent_pages] == [5, 2]
+
+def test_invalid_cursor_means_first_page():
+    assert Keyset.decode(None) is None
+    assert Keyset.decode("") is None
+    assert Keyset.decode("not-a-cursor") is None
+    assert Keyset.decode(Keyset.encode(42)) == 42
+
+async def test_deep_pages_cost_the_same_as_the_first(db, queries):
+    """نسخه کوچک‌شده بنچمارک صفحه 10,000: پیمایش 2,000 صفحه روی 4k کاربر (2 کاربر در هر صفحه)"""
+    base = datetime(2026, 1, 1)
+    await db.execute(insert(User), [
+        {"telegram_id": i, "referral_code": f"K{i:07d}", "created_at": base + timedelta(seconds=i // 7)}
+        for i in range(4000)
+    ])
+    await db.commit()
+    users = UserManager(db)
+
+    timings, cursor = [], None
+    queries.reset()
+    for _ in range(2000):
+        started = time.perf_counter()
+        page = await users.get_all_users(cursor=cursor, per_page=2)
+        timings.append(time.perf_counter() - started)
+        cursor = page.next_cursor
+    assert queries.count() == 2000  # یک کوئری برای هر صفحه، بدون COUNT
+    assert len(page) == 2 and cursor is None
+
+    # صفحه‌های آخر با همان جستجوی ایندکسی خوانده می‌شوند، نه پیمایش ردیف‌های قبلی
+    first, last = sorted(timings[100:400])[150], sorted(timings[-300:])[150]
+    assert last < 3 * first
+    connection = await db.connection()
+    plan = [row[-1] for row in await connection.exec_driver_sql(
+        f"EXPLAIN QUERY PLAN {queries.statements[-1]}", queries.parameters[-1]
+    )]
+    assert any("USING INDEX ix_users_created_id" in step for step in plan), plan
+    assert not any(step.startswith("SCAN users") for step in plan), plan
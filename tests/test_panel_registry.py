@@ -0,0 +1,196 @@
+from conftest import FakeQuery
+from models.order import Order
+from models.payment import Payment
+from models.plan import Plan
+from modules.admin.payment_admin import PaymentAdmin
+from modules.hidify_api import HiddifyAPIError, CircuitOpenError
+from modules.panel_registry import PanelNode, PanelRegistry
+from modules.user_manager import UserManager
+from utils.circuit_breaker import CircuitBreaker
+
+class FakePanelAPI:
+    """کلاینت ساختگی هیدیفای؛ create_error خطای POST و created یعنی POST با وجود خطا اجرا شده"""
+
+    def __init__(self, name: str, create_error: HiddifyAPIError = None, created: bool = False,
+                 lookup_error: HiddifyAPIError = None):
+        self.breaker = CircuitBreaker(name)
+        self.create_error = create_error
+        self.created = created
+        self.lookup_error = lookup_error
+        self.users = {}
+        self.posts = 0
+        self.lookups = 0
+
+    async def create_user_or_raise(self, user_data):
+        self.posts += 1
+        if self.create_error is None or self.created:
+            self.users[user_data["uuid"]] = dict(user_data)
+        if self.create_error is not None:
+            raise self.create_error
+        return dict(user_data)
+
+    async def find_user(self, uuid):
+        self.lookups += 1
+        if self.lookup_error is not None:
+            raise self.lookup_error
+        return self.users.get(uuid)
+
+def registry(*apis) -> PanelRegistry:
+    # نود اول کم‌بارتر است تا همیشه اول انتخاب شود
+    nodes = [PanelNode(f"n{i}", api, capacity=100) for i, api in enumerate(apis)]
+    for i, node in enumerate(nodes):
+        node.user_count = i * 10
+    return PanelRegistry(nodes)
+
+async def test_validation_error_does_not_fail_over_or_mark_unhealthy():
+    first, second = FakePanelAPI("a", HiddifyAPIError("bad", status=400)), FakePanelAPI("b")
+    panels = registry(first, second)
+
+    node, result = await panels.provision_user({"name": "u"})
+
+    assert (node, result) == (None, None)
+    assert panels.get("n0").healthy and panels.get("n0").reserved == 0
+    assert second.posts == 0
+
+async def test_timeout_that_created_the_user_is_not_retried_elsewhere():
+    first = FakePanelAPI("a", HiddifyAPIError("timeout"), created=True)
+    second = FakePanelAPI("b")
+    panels = registry(first, second)
+
+    node, result = await panels.provision_user({"name": "u"})
+
+    assert node.name == "n0" and result["uuid"] in first.users
+    assert second.posts == 0
+
+async def test_server_error_without_user_fails_over_with_same_uuid():
+    first = FakePanelAPI("a", HiddifyAPIError("boom", status=502))
+    second = FakePanelAPI("b")
+    panels = registry(first, second)
+
+    node, result = await panels.provision_user({"name": "u", "uuid": "fixed-uuid"})
+
+    assert node.name == "n1" and list(second.users) == ["fixed-uuid"]
+    assert first.lookups == 1 and not panels.get("n0").healthy
+    assert panels.get("n0").reserved == 0 and panels.get("n1").reserved == 1
+
+async def test_unknown_outcome_stops_without_failover():
+    first = FakePanelAPI("a", HiddifyAPIError("timeout"), lookup_error=HiddifyAPIError("down"))
+    second = FakePanelAPI("b")
+    panels = registry(first, second)
+
+    assert await panels.provision_user({"name": "u"}) == (None, None)
+    assert second.posts == 0 and not panels.get("n0").healthy
+
+async def test_open_circuit_and_rate_limit_fail_over_without_marking_unhealthy():
+    first = FakePanelAPI("a", CircuitOpenError("open"))
+    second = FakePanelAPI("b", HiddifyAPIError("slow down", status=429))
+    third = FakePanelAPI("c")
+    panels = registry(first, second, third)
+
+    node, _ = await panels.provision_user({"name": "u"})
+
+    assert node.name == "n2"
+    assert panels.get("n0").healthy and panels.get("n1").healthy
+    assert first.lookups == second.lookups == 0
+
+class FakeMirrorAPI(FakePanelAPI):
+    """کلاینت ساختگی با فهرست کاربران برای همگام‌سازی آینه"""
+
+    full_fetches = 0
+
+    async def get_all_users(self):
+        self.full_fetches += 1
+        return list(self.users.values())
+
+    async def get_server_status(self):
+        return {"stats": {"system": {"cpu_percent": 40}, "usage_history": {"total": {"users": 7}}}}
+
+    async def get_user(self, uuid):
+        return self.users.get(uuid)
+
+async def create_order(db, telegram_id: int = 1):
+    user = await UserManager(db).create_user(telegram_id, "buyer")
+    plan = Plan(name="p", days=30, traffic_gb=50, price=100000)
+    db.add(plan)
+    await db.flush()
+    order = Order(user_id=user.id, plan_id=plan.id, plan_name="p", days=30, traffic_gb=50, price=100000)
+    db.add(order)
+    await db.commit()
+    return user, order
+
+async def test_provision_order_links_user_to_the_chosen_panel(db):
+    first, second = FakeMirrorAPI("a", CircuitOpenError("open")), FakeMirrorAPI("b")
+    panels = registry(first, second)
+    user, order = await create_order(db)
+
+    result = await panels.provision_order(db, order, {"name": "buyer", "package_days": 30})
+
+    assert result["uuid"] == order.hiddify_uuid
+    assert (order.status, order.hiddify_panel) == ("completed", "n1")
+    link = await UserManager(db).get_hiddify_user_link(user.id)
+    assert (link.hiddify_uuid, link.hiddify_panel) == (order.hiddify_uuid, "n1")
+
+    # سفارش تکمیل‌شده دوباره ساخته نمی‌شود
+    await panels.provision_order(db, order, {"name": "buyer"})
+    assert second.posts == 1
+
+async def test_services_are_read_from_each_panels_mirror(db):
+    first, second = FakeMirrorAPI("a"), FakeMirrorAPI("b")
+    first.users["old"] = {"uuid": "old", "usage_limit_GB": 10, "current_usage_GB": 1, "package_days": 30}
+    second.users["new"] = {"uuid": "new", "usage_limit_GB": 20, "current_usage_GB": 5, "package_days": 30}
+    panels = registry(first, second)
+    user = await UserManager(db).create_user(1)
+    # لینک قدیمی بدون نام نود متعلق به نود پیش‌فرض است
+    await UserManager(db).link_hiddify_user(user.id, "old", "old")
+    await UserManager(db).link_hiddify_user(user.id, "new", "new", "n1")
+    for node in panels.nodes.values():
+        await node.mirror.refresh()
+
+    services = await panels.get_user_services(db, user.id)
+
+    assert {(s["hiddify_uuid"], s["panel"], s["usage_limit_gb"]) for s in services} == {
+        ("old", "n0", 10.0), ("new", "n1", 20.0)
+    }
+
+    # هر آینه بعد از ری‌استارت فقط ردیف‌های نود خودش را می‌خواند و حذف نمی‌کند
+    fresh = registry(FakeMirrorAPI("a"), FakeMirrorAPI("b"))
+    await fresh.load_mirrors()
+    assert list(fresh.get("n0").mirror._users) == ["old"]
+    assert list(fresh.get("n1").mirror._users) == ["new"]
+
+async def test_verified_order_payment_provisions_instead_of_crediting_wallet(db):
+    panels = registry(FakeMirrorAPI("a"))
+    user, order = await create_order(db)
+    payment = Payment(user_id=user.id, order_id=order.id, amount=order.price, payment_method="manual")
+    db.add(payment)
+    await db.commit()
+
+    query = FakeQuery()
+    await PaymentAdmin(db, panels).verify_payment(query, payment.id, True)
+
+    await db.refresh(order)
+    await db.refresh(user)
+    assert order.status == "completed" and "n0" in query.text
+    assert user.wallet_balance == 0
+
+async def test_refresh_counts_users_without_downloading_the_user_list():
+    api = FakeMirrorAPI("a")
+    api.users = {f"u{i}": {"uuid": f"u{i}"} for i in range(3)}
+    panels = registry(api)
+    node = panels.get("n0")
+
+    # آینه هنوز همگام نشده: شمارنده server_status
+    await panels.refresh()
+    assert (node.user_count, node.cpu_percent, node.healthy) == (7, 40.0, True)
+    assert api.full_fetches == 0
+
+    await node.mirror.refresh()
+    node.reserved = 2
+    await panels.refresh()
+    assert (node.user_count, node.reserved) == (3, 0)
+
+    # بدون همگام‌سازی جدید رزروها نگه داشته می‌شوند
+    node.reserved = 1
+    await panels.refresh()
+    assert (node.user_count, node.reserved) == (3, 1)
+    assert api.full_fetches == 1
@@ -0,0 +1,64 @@
+import pytest
+from sqlalchemy import insert
+from database import AsyncSessionLocal
+from models.referral import Referral, ReferralSummary
+from models.user import User
+from modules.referral import ReferralManager
+
+DIALECTS = pytest.mark.parametrize(
+    "dialects", [ReferralManager.INSERT_DIALECTS, {}], ids=["on_conflict", "savepoint"]
+)
+
+async def add_users(db, count: int) -> list:
+    users = [User(telegram_id=100 + i, referral_code=f"REF{i:05d}", first_name=f"u{i}") for i in range(count)]
+    db.add_all(users)
+    await db.commit()
+    return [user.id for user in users]
+
+@DIALECTS
+async def test_first_referral_creates_summary_and_later_ones_apply_deltas(db, monkeypatch, dialects):
+    monkeypatch.setattr(ReferralManager, "INSERT_DIALECTS", dialects)
+    referrer, first, second = await add_users(db, 3)
+
+    # هر رفرال از session جداگانه، مثل دو آپدیت مستقل
+    for referred, amount in ((first, 10.0), (second, 5.0)):
+        async with AsyncSessionLocal() as session:
+            await ReferralManager(session).create_referral(referrer, referred, amount)
+
+    stats = await ReferralManager(db).get_user_referral_stats(referrer)
+    assert stats["referred_count"] == 2
+    assert stats["pending_commission"] == 15.0
+    assert [entry["user_id"] for entry in stats["recent_referrals"]] == [second, first]
+
+@DIALECTS
+async def test_summary_row_created_elsewhere_receives_the_delta(db, monkeypatch, dialects):
+    monkeypatch.setattr(ReferralManager, "INSERT_DIALECTS", dialects)
+    referrer, first, second = await add_users(db, 3)
+    # نمونه دیگری اولین رفرال این معرف را ثبت کرده است
+    db.add(Referral(referrer_id=referrer, referred_id=first, commission_amount=10.0))
+    await db.execute(insert(ReferralSummary).values(
+        referrer_id=referrer, referred_count=1, pending_commission=10.0
+    ))
+    await db.commit()
+
+    async with AsyncSessionLocal() as session:
+        await ReferralManager(session).create_referral(referrer, second, 5.0)
+
+    summary = await db.get(ReferralSummary, referrer, populate_existing=True)
+    assert summary.referred_count == 2
+    assert summary.pending_commission == 15.0
+
+async def test_missing_summary_is_rebuilt_from_existing_referrals(db):
+    referrer, first, second = await add_users(db, 3)
+    db.add_all([
+        Referral(referrer_id=referrer, referred_id=first, commission_amount=10.0, commission_status="paid"),
+        Referral(referrer_id=referrer, referred_id=second, commission_amount=4.0),
+    ])
+    await db.commit()
+
+    stats = await ReferralManager(db).get_user_referral_stats(referrer)
+
+    assert stats["referred_count"] == 2
+    assert stats["total_commission"] == 10.0
+    assert stats["pending_commission"] == 4.0
+    assert await db.get(ReferralSummary, referrer) is not None
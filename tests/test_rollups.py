@@ -0,0 +1,48 @@
+from datetime import date, timedelta
+from sqlalchemy import select
+from models.payment import Payment
+from models.rollup import RollupDirtyDay
+from models.user import User
+from modules.payment_manager import PaymentManager
+from modules.rollup_manager import RollupManager
+from conftest import set_created_at
+
+async def add_payment(db, days_ago: int) -> Payment:
+    user_id = (await db.execute(select(User.id))).scalar()
+    if user_id is None:
+        user = User(telegram_id=1, referral_code="ROLL0001")
+        db.add(user)
+        await db.flush()
+        user_id = user.id
+    payment = Payment(user_id=user_id, amount=500, payment_method="manual", status="pending")
+    db.add(payment)
+    await db.commit()
+    created_at = f"{date.today() - timedelta(days=days_ago)} 12:00:00"
+    await set_created_at(db, "payments", created_at, where=f"id = {payment.id}")
+    await db.refresh(payment)
+    return payment
+
+async def test_status_change_outside_the_lookback_rebuilds_its_day(db):
+    payment = await add_payment(db, days_ago=10)
+    rollups = RollupManager(db)
+    await rollups.refresh(lookback_days=3)
+    assert (await rollups.get_payment_statistics(days=30))["pending_count"] == 1
+
+    await PaymentManager(db).update_payment_status(payment.id, "success")
+    assert (await db.execute(select(RollupDirtyDay.name, RollupDirtyDay.day))).all() == [
+        ("payments", date.today() - timedelta(days=10))
+    ]
+
+    await rollups.refresh(lookback_days=3)
+    stats = await rollups.get_payment_statistics(days=30)
+    assert (stats["pending_count"], stats["success_count"], stats["success_amount"]) == (0, 1, 500.0)
+    assert (await db.execute(select(RollupDirtyDay))).first() is None
+
+async def test_todays_rows_and_unchanged_status_are_not_marked(db):
+    payment = await add_payment(db, days_ago=0)
+    await PaymentManager(db).update_payment_status(payment.id, "success")
+
+    old = await add_payment(db, days_ago=5)
+    await PaymentManager(db).update_payment_status(old.id, "pending", transaction_id="T1")
+
+    assert (await db.execute(select(RollupDirtyDay))).first() is None
@@ -0,0 +1,147 @@
+import tracemalloc
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import UnitOfWork
+from models.conversation_state import ConversationState
+from models.user import User
+from modules.state_store import MemoryStateStore, SqlStateStore, StateStore
+
+async def users_count(db) -> int:
+    return (await db.execute(select(func.count(User.id)))).scalar()
+
+def test_state_store_is_abstract():
+    with pytest.raises(TypeError):
+        StateStore(60)
+
+    class Partial(StateStore):
+        async def get(self, user_id):
+            return None
+
+    with pytest.raises(TypeError):
+        Partial(60)
+
+async def test_memory_store_expires_entries():
+    states = MemoryStateStore(ttl=60, max_entries=10)
+    await states.set(1, "waiting")
+    await states.set(2, "gone", ttl=-1)
+
+    assert await states.get(1) == "waiting"
+    assert await states.get(2) is None
+    await states.delete(1)
+    assert await states.get(1) is None
+
+async def test_sql_set_upserts_a_single_row(db):
+    states = SqlStateStore(ttl=60)
+    await states.set(7, "first")
+    await states.set(7, "second")
+
+    assert await states.get(7) == "second"
+    count = await db.execute(select(func.count()).select_from(ConversationState))
+    assert count.scalar() == 1
+
+async def test_sql_expired_state_is_hidden_and_purged():
+    states = SqlStateStore(ttl=60)
+    await states.set(7, "old", ttl=-1)
+
+    assert await states.get(7) is None
+    assert await states.purge() == 1
+
+async def state_rows(db) -> int:
+    return (await db.execute(select(func.count()).select_from(ConversationState))).scalar()
+
+async def test_state_set_in_a_unit_is_read_back_and_saved_after_it(db):
+    states = SqlStateStore(ttl=60)
+
+    async with UnitOfWork():
+        await states.set(7, "waiting")
+        assert await states.get(7) == "waiting"
+        # تا پایان آپدیت چیزی روی اتصال آپدیت نوشته نمی‌شود
+        assert await state_rows(db) == 0
+        await states.delete(7)
+        assert await states.get(7) is None
+        await states.set(7, "second")
+
+    assert await states.get(7) == "second"
+    assert await state_rows(db) == 1
+
+@pytest.mark.parametrize("dialects", [SqlStateStore.INSERT_DIALECTS, {}], ids=["upsert", "savepoint"])
+async def test_state_neither_commits_nor_follows_a_failed_unit(db, monkeypatch, dialects):
+    monkeypatch.setattr(SqlStateStore, "INSERT_DIALECTS", dialects)
+    states = SqlStateStore(ttl=60)
+    await states.set(7, "first")
+
+    async with UnitOfWork() as unit:
+        session = await unit.get_session()
+        session.add(User(telegram_id=900, referral_code="PENDING1"))
+        await session.flush()
+        await states.set(7, "second")
+        UnitOfWork.mark_failed()
+
+    assert await users_count(db) == 0
+    assert await states.get(7) == "second"
+
+async def test_savepoint_insert_conflict_falls_back_to_update(db, monkeypatch):
+    monkeypatch.setattr(SqlStateStore, "INSERT_DIALECTS", {})
+    states = SqlStateStore(ttl=60)
+    await states.set(7, "first")
+
+    # ردیف بین UPDATE و INSERT توسط نمونه دیگری درج شده است
+    real_execute = AsyncSession.execute
+    calls = []
+
+    async def first_update_misses(self, statement, *args, **kwargs):
+        result = await real_execute(self, statement, *args, **kwargs)
+        calls.append(statement)
+        if len(calls) == 1:
+            result.rowcount = 0
+        return result
+
+    monkeypatch.setattr(AsyncSession, "execute", first_update_misses)
+    await states.set(7, "second")
+    monkeypatch.undo()
+
+    # درج تکراری خطا داد و به UPDATE دوم رسید
+    assert len(calls) == 2
+    assert await states.get(7) == "second"
+
+def allocated(fill) -> int:
+    """حافظه باقی‌مانده بعد از اجرای fill (بایت)"""
+    tracemalloc.start()
+    try:
+        kept = fill()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del kept
+    return size
+
+def test_memory_stays_bounded_with_abandoned_conversations():
+    # نسخه کوچک‌شده سناریوی یک میلیون فرم نیمه‌کاره
+    capacity, abandoned = 10_000, 200_000
+
+    def fill_store(count):
+        def fill():
+            store = MemoryStateStore(ttl=1800, max_entries=capacity)
+            for user_id in range(count):
+                store.cache.set(user_id, "awaiting_agent_request_data")
+            return store
+        return fill
+
+    def fill_dict():
+        # همان user_states قبلی: dict بدون سقف
+        states = {}
+        for user_id in range(abandoned):
+            states[user_id] = "awaiting_agent_request_data"
+        return states
+
+    at_capacity = allocated(fill_store(capacity))
+    after_abandoned = allocated(fill_store(abandoned))
+    unbounded = allocated(fill_dict)
+
+    store = fill_store(abandoned)()
+    assert len(store.cache) == capacity
+    assert store.cache.evictions == abandoned - capacity
+    # جدول داخلی OrderedDict بعد از حذف‌های زیاد کمی بزرگ‌تر می‌ماند، ولی با تعداد کاربران رشد نمی‌کند
+    assert after_abandoned < at_capacity * 1.5
+    assert after_abandoned < unbounded / 5
@@ -0,0 +1,98 @@
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy import event, insert
+from database import engine
+from models.order import Order
+from models.payment import Payment
+from models.plan import Plan
+from models.user import User
+from modules.admin.stats_admin import StatsAdmin
+from modules.admin_panel import AdminPanel
+from conftest import set_created_at
+
+async def seed(db):
+    users = [
+        User(telegram_id=1, referral_code="STAT0001", is_admin=True),
+        User(telegram_id=2, referral_code="STAT0002"),
+        User(telegram_id=3, referral_code="STAT0003", is_active=False)
+    ]
+    plans = [
+        Plan(name="A", days=30, traffic_gb=50, price=100),
+        Plan(name="B", days=30, traffic_gb=50, price=200, is_active=False)
+    ]
+    db.add_all(users + plans)
+    await db.flush()
+    db.add_all([
+        Order(user_id=users[0].id, plan_id=plans[0].id, plan_name="A", days=30, traffic_gb=50, price=100),
+        Order(user_id=users[1].id, plan_id=plans[0].id, plan_name="A", days=30, traffic_gb=50, price=100)
+    ])
+    db.add_all([
+        Payment(user_id=users[0].id, amount=100, payment_method="wallet", status="success"),
+        Payment(user_id=users[1].id, amount=250, payment_method="manual", status="success"),
+        Payment(user_id=users[1].id, amount=999, payment_method="manual", status="pending")
+    ])
+    await db.commit()
+
+    # یک کاربر، سفارش و پرداخت موفق مال دیروز است
+    yesterday = f"{date.today() - timedelta(days=1)} 12:00:00"
+    await set_created_at(db, "users", yesterday, where="telegram_id = 3")
+    await set_created_at(db, "orders", yesterday, where=f"user_id = {users[1].id}")
+    await set_created_at(db, "payments", yesterday, where="amount = 250")
+
+async def test_system_stats_in_one_query(db, queries):
+    await seed(db)
+    queries.reset()
+
+    stats = await StatsAdmin(db).get_system_stats()
+
+    assert queries.count() == 1
+    assert stats == {
+        "total_users": 3, "active_users": 2, "admin_users": 1, "today_users": 2,
+        "total_plans": 2, "active_plans": 1,
+        "total_orders": 2, "today_orders": 1,
+        "total_revenue": 350.0, "today_revenue": 100.0
+    }
+
+async def test_system_stats_on_an_empty_database(db):
+    stats = await AdminPanel(db).get_system_stats()
+
+    assert stats["total_users"] == 0
+    assert stats["today_users"] == 0
+    assert stats["total_revenue"] == 0.0
+    assert stats["today_revenue"] == 0.0
+
+async def test_today_counters_read_only_todays_index_range(db):
+    """نسخه کوچک‌شده بنچمارک (به جای 1M کاربر و 5M پرداخت): 20k کاربر و 50k پرداخت"""
+    now = datetime.now()
+    old = now - timedelta(days=400)
+    await db.execute(insert(User), [
+        {"telegram_id": i, "referral_code": f"B{i:07d}", "created_at": now if i < 30 else old}
+        for i in range(20000)
+    ])
+    await db.execute(insert(Payment), [
+        {"user_id": i % 20000 + 1, "amount": 10, "payment_method": "wallet",
+         "status": "success", "created_at": now if i < 40 else old}
+        for i in range(50000)
+    ])
+    await db.commit()
+
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        started = time.perf_counter()
+        stats = await StatsAdmin(db).get_system_stats()
+        elapsed = time.perf_counter() - started
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", capture)
+
+    assert (stats["today_users"], stats["today_revenue"], stats["total_revenue"]) == (30, 400.0, 500000.0)
+    statement, parameters = captured[0]
+    connection = await db.connection()
+    plan = [row[-1] for row in await connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+    # هر سه شمارنده امروز فقط بازه امروز را از ایندکس created_at می‌خوانند
+    assert len([step for step in plan if step.startswith("SEARCH") and "created_at>?" in step]) == 3, plan
+    assert elapsed < 1.0
@@ -0,0 +1,131 @@
+import pytest
+from sqlalchemy import func, select
+from telegram import CallbackQuery, Update
+from telegram.ext import ApplicationHandlerStop, TypeHandler
+from database import UnitOfWork, commit_or_flush, get_session
+from models.order import Order
+from models.payment import Payment
+from models.plan import Plan
+from models.user import User
+from models.wallet import WalletLedgerEntry
+from modules.payment_manager import PaymentManager
+from modules.wallet import WalletManager
+
+def make_update(update_id: int = 1) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": 1, "date": 0, "text": "hi",
+            "chat": {"id": 7, "type": "private"},
+            "from": {"id": 7, "is_bot": False, "first_name": "u"}
+        }
+    }, None)
+
+async def users_count(db) -> int:
+    return (await db.execute(select(func.count(User.id)))).scalar()
+
+async def process(app, update):
+    """همان مسیری که Application آپدیت را به update processor می‌دهد"""
+    await app.update_processor.process_update(update, app.process_update(update))
+
+def make_callback_update(data: str, update_id: int = 2) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "callback_query": {
+            "id": "1", "chat_instance": "c", "data": data,
+            "from": {"id": 7, "is_bot": False, "first_name": "u"}
+        }
+    }, None)
+
+def build_bot(callback=None):
+    import bot
+    shop = bot.HiddyShopBot()
+    if callback is not None:
+        shop.app.add_handler(TypeHandler(Update, callback), group=-1)
+    # initialize واقعی get_me را از تلگرام می‌خواهد
+    shop.app._initialized = True
+    return shop
+
+async def test_raising_handler_leaves_no_rows(db):
+    async def failing(update, context):
+        session = await get_session()
+        session.add(User(telegram_id=500, referral_code="FAILING1"))
+        await session.flush()
+        raise RuntimeError("handler failed after writing")
+
+    shop = build_bot(failing)
+    before = UnitOfWork.get_stats()["rollbacks"]
+
+    await process(shop.app, make_update())
+
+    assert await users_count(db) == 0
+    assert UnitOfWork.get_stats()["rollbacks"] == before + 1
+
+async def test_successful_handler_commits_once(db):
+    async def writing(update, context):
+        session = await get_session()
+        session.add(User(telegram_id=501, referral_code="WRITING1"))
+        # هندلرهای اصلی ربات بدون اتصال به تلگرام اجرا نمی‌شوند
+        raise ApplicationHandlerStop
+
+    shop = build_bot(writing)
+    await process(shop.app, make_update())
+
+    assert await users_count(db) == 1
+
+async def test_nested_unit_joins_outer_and_shares_the_session():
+    async with UnitOfWork() as outer:
+        session = await get_session()
+        async with UnitOfWork() as inner:
+            assert inner is outer
+            assert await get_session() is session
+        assert UnitOfWork.current() is outer
+    assert UnitOfWork.current() is None
+
+async def count(db, model) -> int:
+    return (await db.execute(select(func.count()).select_from(model))).scalar()
+
+async def buy_with_wallet(user_id: int, plan_id: int):
+    """خرید واقعی با مدیرها: کسر از کیف پول، ثبت سفارش و پرداخت، سپس خطا"""
+    db = await get_session()
+    assert await WalletManager(db).deduct_from_wallet(user_id, 100)
+    order = Order(user_id=user_id, plan_id=plan_id, plan_name="A", days=30, traffic_gb=50, price=100)
+    db.add(order)
+    await commit_or_flush(db)
+    await PaymentManager(db).create_payment(user_id, 100, "wallet", order_id=order.id)
+    raise RuntimeError("panel provisioning failed")
+
+@pytest.mark.parametrize("path", ["router", "error_handler"])
+async def test_failing_purchase_persists_nothing(db, monkeypatch, path):
+    user = User(telegram_id=7, referral_code="BUYER001", wallet_balance=500)
+    plan = Plan(name="A", days=30, traffic_gb=50, price=100)
+    db.add_all([user, plan])
+    await db.commit()
+
+    async def answer(self, *args, **kwargs):
+        return True
+
+    monkeypatch.setattr(CallbackQuery, "answer", answer)
+    if path == "router":
+        # button_handler خطا را خودش می‌گیرد و فقط mark_failed صدا زده می‌شود
+        shop = build_bot()
+        shop.router.add("test_buy", lambda query: buy_with_wallet(user.id, plan.id))
+        update = make_callback_update("test_buy")
+    else:
+        shop = build_bot(lambda update, context: buy_with_wallet(user.id, plan.id))
+        update = make_update()
+
+    await process(shop.app, update)
+
+    assert await WalletManager(db).get_user_wallet_balance(user.id) == 500
+    assert await count(db, Order) == 0
+    assert await count(db, Payment) == 0
+    assert await count(db, WalletLedgerEntry) == 0
+
+async def test_manager_commit_is_a_flush_inside_a_unit(db):
+    async with UnitOfWork() as unit:
+        session = await unit.get_session()
+        session.add(User(telegram_id=8, referral_code="FLUSH001"))
+        await commit_or_flush(session)
+        assert session.in_transaction()
+    assert await users_count(db) == 1
@@ -0,0 +1,66 @@
+import pytest
+from conftest import FakeQuery
+from database import UnitOfWork, get_session
+from models.agent_request import AgentRequest
+from models.payment import Payment
+from modules.admin.payment_admin import PaymentAdmin
+from modules.user_manager import UserManager, UserLoader
+
+async def create_users(db, count: int) -> list:
+    users = UserManager(db)
+    return [await users.create_user(1000 + i, f"user{i}") for i in range(count)]
+
+async def test_loader_batches_and_memoises(db, queries):
+    created = await create_users(db, 5)
+    loader = UserLoader(db)
+    queries.reset()
+
+    users = await loader.load_many([u.id for u in created] + [999999])
+    again = await loader.load(created[0].id)
+
+    assert [u.telegram_id for u in users[:5]] == [u.telegram_id for u in created]
+    assert users[5] is None
+    assert again is users[0]
+    assert queries.count("users") == 1
+    assert loader.queries == 1
+
+async def test_loader_by_telegram_id_shares_results(db, queries):
+    created = await create_users(db, 3)
+    loader = UserLoader(db)
+    queries.reset()
+
+    users = await loader.load_many_by_telegram_id([u.telegram_id for u in created])
+    by_id = await loader.load_many([u.id for u in created])
+
+    assert [u.id for u in users] == [u.id for u in by_id]
+    assert queries.count("users") == 1
+
+@pytest.mark.parametrize("rows", [2, 9])
+async def test_payments_page_issues_one_user_query(db, queries, rows):
+    for user in await create_users(db, rows):
+        db.add(Payment(user_id=user.id, amount=5000, payment_method="manual"))
+    await db.commit()
+
+    query = FakeQuery()
+    async with UnitOfWork():
+        queries.reset()
+        await PaymentAdmin(await get_session()).show_payments_list(query)
+
+    assert queries.count("users") == 1
+    assert "user1" in query.text
+
+@pytest.mark.parametrize("rows", [2, 9])
+async def test_agent_requests_page_issues_one_user_query(db, queries, rows):
+    import bot
+    for user in await create_users(db, rows):
+        # درخواست نمایندگی آیدی تلگرام کاربر را نگه می‌دارد
+        db.add(AgentRequest(user_id=user.telegram_id, full_name=f"agent{user.id}", phone="09120000000"))
+    await db.commit()
+
+    query = FakeQuery()
+    async with UnitOfWork():
+        queries.reset()
+        await bot.HiddyShopBot().show_admin_agent_requests(query)
+
+    assert queries.count("users") == 1
+    assert "(1000)" in query.text and f"({1000 + rows - 1})" in query.text
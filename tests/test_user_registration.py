@@ -0,0 +1,102 @@
+import asyncio
+from collections import defaultdict
+import pytest
+from sqlalchemy import func, select
+from telegram import Update
+from database import UnitOfWork
+from models.user import User
+from modules.update_processor import PerUserUpdateProcessor
+from modules.user_manager import UserManager
+from utils.helpers import Helpers
+
+DIALECTS = pytest.mark.parametrize(
+    "dialects", [UserManager.INSERT_DIALECTS, {}], ids=["on_conflict", "savepoint"]
+)
+
+def referral_codes(monkeypatch, *codes):
+    codes = iter(codes)
+    monkeypatch.setattr(Helpers, "generate_referral_code", staticmethod(lambda length=8: next(codes)))
+
+async def users_count(db) -> int:
+    return (await db.execute(select(func.count(User.id)))).scalar()
+
+@DIALECTS
+async def test_second_registration_returns_the_existing_user(db, monkeypatch, dialects):
+    monkeypatch.setattr(UserManager, "INSERT_DIALECTS", dialects)
+    referral_codes(monkeypatch, "CODE0001", "CODE0002")
+
+    first = await UserManager(db).create_user(42, first_name="a")
+    second = await UserManager(db).create_user(42, first_name="b")
+
+    assert second.id == first.id
+    assert second.referral_code == "CODE0001"
+    assert await users_count(db) == 1
+
+@DIALECTS
+async def test_referral_code_collision_retries_with_a_new_code(db, monkeypatch, dialects):
+    monkeypatch.setattr(UserManager, "INSERT_DIALECTS", dialects)
+    referral_codes(monkeypatch, "TAKEN001", "TAKEN001", "FRESH001")
+
+    await UserManager(db).create_user(1)
+    user = await UserManager(db).create_user(2)
+
+    assert user.telegram_id == 2
+    assert user.referral_code == "FRESH001"
+
+async def test_registration_gives_up_after_repeated_collisions(db, monkeypatch):
+    monkeypatch.setattr(Helpers, "generate_referral_code", staticmethod(lambda length=8: "TAKEN001"))
+    await UserManager(db).create_user(1)
+
+    with pytest.raises(RuntimeError):
+        await UserManager(db).create_user(2)
+
+@DIALECTS
+async def test_duplicate_insert_keeps_pending_writes_of_the_unit(db, monkeypatch, dialects):
+    monkeypatch.setattr(UserManager, "INSERT_DIALECTS", dialects)
+    referral_codes(monkeypatch, "TAKEN001", "TAKEN001", "FRESH001")
+    await UserManager(db).create_user(1)
+
+    async with UnitOfWork() as unit:
+        session = await unit.get_session()
+        session.add(User(telegram_id=3, referral_code="PENDING1"))
+        await session.flush()
+        await UserManager(session).create_user(2)
+
+    telegram_ids = await db.execute(select(User.telegram_id).order_by(User.telegram_id))
+    assert telegram_ids.scalars().all() == [1, 2, 3]
+
+def start_update(update_id: int, telegram_id: int) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "/start",
+            "chat": {"id": telegram_id, "type": "private"},
+            "from": {"id": telegram_id, "is_bot": False, "first_name": "u"}
+        }
+    }, None)
+
+async def test_start_burst_registers_each_user_once_in_order(file_sessions):
+    """نسخه کوچک‌شده burst پنجاه‌هزارتایی: 500 /start از 100 کاربر با 16 پردازش همزمان"""
+    processor = PerUserUpdateProcessor(max_concurrent=16)
+    registered = defaultdict(list)
+
+    async def start(update: Update):
+        telegram_id = update.effective_user.id
+        async with file_sessions() as session:
+            user = await UserManager(session).create_user(telegram_id, first_name="u")
+        registered[telegram_id].append((update.update_id, user.id))
+
+    updates = [start_update(update_id, update_id % 100 + 1) for update_id in range(500)]
+    await asyncio.wait_for(
+        asyncio.gather(*(processor.process_update(update, start(update)) for update in updates)),
+        timeout=120
+    )
+
+    assert processor.get_stats()["processed"] == 500 and processor.failed == 0
+    assert len(registered) == 100
+    for starts in registered.values():
+        update_ids = [update_id for update_id, _ in starts]
+        assert update_ids == sorted(update_ids) and len(update_ids) == 5
+        assert len({user_id for _, user_id in starts}) == 1
+    async with file_sessions() as check:
+        assert await users_count(check) == 100
@@ -0,0 +1,163 @@
+import asyncio
+import pytest
+from sqlalchemy import func, select
+from database import AsyncSessionLocal
+from models.user import User
+from models.wallet import WalletLedgerEntry
+from modules.user_manager import UserManager
+from modules.wallet import WalletManager
+
+async def add_user(db, telegram_id: int, balance: float = 0.0) -> int:
+    user = User(telegram_id=telegram_id, referral_code=f"WAL{telegram_id:05d}", wallet_balance=balance)
+    db.add(user)
+    await db.commit()
+    return user.id
+
+async def ledger(db, user_id: int) -> list:
+    result = await db.execute(
+        select(WalletLedgerEntry.entry_type, WalletLedgerEntry.amount, WalletLedgerEntry.balance_after)
+        .where(WalletLedgerEntry.user_id == user_id)
+        .order_by(WalletLedgerEntry.id)
+    )
+    return [tuple(row) for row in result]
+
+async def test_credit_and_debit_update_balance_and_ledger(db):
+    user_id = await add_user(db, 1)
+    wallet = WalletManager(db)
+
+    assert await wallet.add_to_wallet(user_id, 50000)
+    assert await wallet.deduct_from_wallet(user_id, 20000.4)
+
+    assert await wallet.get_user_wallet_balance(user_id) == 30000
+    assert await ledger(db, user_id) == [("credit", 50000, 50000), ("debit", -20000, 30000)]
+    assert (await wallet.audit_wallet(user_id))["ok"]
+
+async def test_debit_beyond_balance_is_refused(db):
+    user_id = await add_user(db, 1, balance=100)
+
+    assert not await WalletManager(db).deduct_from_wallet(user_id, 101)
+    assert await WalletManager(db).get_user_wallet_balance(user_id) == 100
+    assert await ledger(db, user_id) == []
+
+async def test_debit_checks_the_stored_balance_not_a_stale_object(db):
+    user_id = await add_user(db, 1, balance=100)
+    user = await db.get(User, user_id)
+    assert user.wallet_balance == 100
+
+    # خرید دیگری از session جداگانه همزمان موجودی را خرج کرده است
+    async with AsyncSessionLocal() as other:
+        assert await WalletManager(other).deduct_from_wallet(user_id, 80)
+
+    assert not await WalletManager(db).deduct_from_wallet(user_id, 80)
+    assert await WalletManager(db).get_user_wallet_balance(user_id) == 20
+
+async def test_parallel_debits_never_overdraw_one_wallet(file_sessions):
+    async with file_sessions() as setup:
+        user_id = await add_user(setup, 1)
+        await WalletManager(setup).add_to_wallet(user_id, 1000)
+
+    async def debit():
+        async with file_sessions() as session:
+            return await WalletManager(session).deduct_from_wallet(user_id, 7)
+
+    results = await asyncio.wait_for(asyncio.gather(*(debit() for _ in range(200))), timeout=60)
+
+    assert sum(results) == 1000 // 7
+    async with file_sessions() as check:
+        balance = await WalletManager(check).get_user_wallet_balance(user_id)
+        ledger_sum = (await check.execute(
+            select(func.sum(WalletLedgerEntry.amount)).where(WalletLedgerEntry.user_id == user_id)
+        )).scalar()
+    assert balance == 1000 % 7
+    assert ledger_sum == balance
+
+async def test_loaded_user_sees_the_new_balance(db):
+    user_id = await add_user(db, 1, balance=10)
+    user = await db.get(User, user_id)
+
+    await WalletManager(db).add_to_wallet(user_id, 5)
+
+    assert user.wallet_balance == 15
+
+async def test_invalid_amounts_and_unknown_users(db):
+    user_id = await add_user(db, 1, balance=10)
+    wallet = WalletManager(db)
+
+    assert not await wallet.add_to_wallet(user_id, 0)
+    assert not await wallet.deduct_from_wallet(user_id, -5)
+    assert not await wallet.add_to_wallet(user_id + 1, 5)
+    assert await ledger(db, user_id) == []
+
+async def test_user_manager_routes_negative_amounts_to_debit(db):
+    user_id = await add_user(db, 1, balance=10)
+    users = UserManager(db)
+
+    assert await users.update_user_wallet(user_id, 15)
+    assert not await users.update_user_wallet(user_id, -30)
+    assert await users.update_user_wallet(user_id, -25)
+    assert await WalletManager(db).get_user_wallet_balance(user_id) == 0
+
+async def test_transfer_moves_balance_in_one_transaction(db):
+    sender, recipient = await add_user(db, 1, balance=100), await add_user(db, 2, balance=5)
+
+    assert await WalletManager(db).transfer_to_wallet(sender, recipient, 60, "هدیه")
+
+    wallet = WalletManager(db)
+    assert await wallet.get_user_wallet_balance(sender) == 40
+    assert await wallet.get_user_wallet_balance(recipient) == 65
+    assert await ledger(db, sender) == [("transfer_out", -60, 40)]
+    assert await ledger(db, recipient) == [("transfer_in", 60, 65)]
+
+async def test_failed_transfer_changes_nothing(db):
+    sender, recipient = await add_user(db, 1, balance=50), await add_user(db, 2)
+    wallet = WalletManager(db)
+
+    assert not await wallet.transfer_to_wallet(sender, recipient, 51)
+    assert not await wallet.transfer_to_wallet(sender, recipient + 1, 10)
+    assert not await wallet.transfer_to_wallet(sender, sender, 10)
+    assert not await wallet.transfer_to_wallet(sender, recipient, 0)
+
+    assert await wallet.get_user_wallet_balance(sender) == 50
+    assert await wallet.get_user_wallet_balance(recipient) == 0
+    assert await ledger(db, sender) == []
+    assert await ledger(db, recipient) == []
+
+async def test_transfer_error_rolls_back_the_debit(db, monkeypatch):
+    sender, recipient = await add_user(db, 1, balance=50), await add_user(db, 2)
+
+    async def broken_credit(self, user_id, amount):
+        raise RuntimeError("credit failed")
+
+    monkeypatch.setattr(WalletManager, "_credit", broken_credit)
+    with pytest.raises(RuntimeError):
+        await WalletManager(db).transfer_to_wallet(sender, recipient, 20)
+
+    assert await WalletManager(db).get_user_wallet_balance(sender) == 50
+    assert await ledger(db, sender) == []
+
+async def test_opposite_transfers_between_one_pair_do_not_deadlock(file_sessions):
+    async with file_sessions() as setup:
+        first, second = await add_user(setup, 1), await add_user(setup, 2)
+        for user_id in (first, second):
+            await WalletManager(setup).add_to_wallet(user_id, 1000)
+
+    async def transfer(from_user_id, to_user_id, amount):
+        async with file_sessions() as session:
+            return await WalletManager(session).transfer_to_wallet(from_user_id, to_user_id, amount)
+
+    transfers = [
+        transfer(first, second, 7 + i % 5) if i % 2 else transfer(second, first, 11 + i % 3)
+        for i in range(100)
+    ]
+    results = await asyncio.wait_for(asyncio.gather(*transfers), timeout=60)
+    assert all(results)
+
+    async with file_sessions() as check:
+        wallet = WalletManager(check)
+        balances = [await wallet.get_user_wallet_balance(user_id) for user_id in (first, second)]
+        assert sum(balances) == 2000
+        assert all(balance >= 0 for balance in balances)
+        for user_id in (first, second):
+            assert (await wallet.audit_wallet(user_id))["ok"]
+        moved = (await check.execute(select(func.count()).select_from(WalletLedgerEntry))).scalar()
+    assert moved == 2 + 2 * sum(results)
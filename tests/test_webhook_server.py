@@ -0,0 +1,142 @@
+import asyncio
+from aiohttp.test_utils import TestClient, TestServer
+from telegram import Update, User
+from telegram.ext import Application, TypeHandler
+from modules.update_processor import PerUserUpdateProcessor
+from modules.webhook_server import WebhookServer
+
+UPDATE = {
+    "update_id": 10,
+    "message": {
+        "message_id": 1, "date": 0, "text": "/start",
+        "chat": {"id": 7, "type": "private"},
+        "from": {"id": 7, "is_bot": False, "first_name": "u"}
+    }
+}
+
+async def client_for(server: WebhookServer, accepting: bool = True) -> TestClient:
+    server._accepting = accepting
+    client = TestClient(TestServer(server._build_app()))
+    await client.start_server()
+    return client
+
+def webhook(secret: str = "s3cret", **kwargs) -> WebhookServer:
+    app = Application.builder().token("1:a").build()
+    return WebhookServer(app, path="/telegram", secret=secret, **kwargs)
+
+async def test_valid_update_is_queued():
+    server = webhook()
+    client = await client_for(server)
+    try:
+        response = await client.post("/telegram", json=UPDATE, headers={WebhookServer.SECRET_HEADER: "s3cret"})
+    finally:
+        await client.close()
+
+    assert response.status == 200
+    assert server.received == 1
+    assert (await server.app.update_queue.get()).update_id == 10
+
+async def test_wrong_secret_and_bad_body_are_rejected():
+    server = webhook()
+    client = await client_for(server)
+    try:
+        forbidden = await client.post("/telegram", json=UPDATE, headers={WebhookServer.SECRET_HEADER: "nope"})
+        bad_json = await client.post(
+            "/telegram", data=b"{not json", headers={WebhookServer.SECRET_HEADER: "s3cret"}
+        )
+    finally:
+        await client.close()
+
+    assert forbidden.status == 403
+    assert bad_json.status == 400
+    assert server.rejected == 2
+    assert server.app.update_queue.empty()
+
+async def test_updates_are_refused_while_shutting_down():
+    server = webhook(secret="")
+    client = await client_for(server, accepting=False)
+    try:
+        response = await client.post("/telegram", json=UPDATE)
+        health = await client.get("/health")
+    finally:
+        await client.close()
+
+    # تلگرام آپدیتی را که 200 نگرفته دوباره ارسال می‌کند
+    assert response.status == 503
+    assert health.status == 503
+    assert server.app.update_queue.empty()
+
+async def test_metrics_include_bot_components():
+    server = webhook(metrics=lambda: {"routes": {"shop": {"count": 1}}})
+    client = await client_for(server)
+    try:
+        response = await client.get("/metrics")
+        data = await response.json()
+    finally:
+        await client.close()
+
+    assert data["webhook"] == {"received": 0, "rejected": 0, "queue_size": 0}
+    assert data["routes"] == {"shop": {"count": 1}}
+
+def recorded_message(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": f"msg {update_id}",
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"}
+        }
+    }
+
+async def test_burst_is_acknowledged_without_waiting_for_handlers():
+    """نسخه کوچک‌شده load test: 500 آپدیت از 100 کاربر همزمان با هندلرهایی که تا پایان burst گیر کرده‌اند"""
+    processor = PerUserUpdateProcessor(max_concurrent=16)
+    app = Application.builder().token("1:a").concurrent_updates(processor).build()
+    release = asyncio.Event()
+    handled = {}
+
+    async def blocked_handler(update, context):
+        await release.wait()
+        handled.setdefault(update.effective_user.id, []).append(update.update_id)
+
+    app.add_handler(TypeHandler(Update, blocked_handler))
+    # initialize واقعی get_me را از تلگرام می‌خواهد
+    app._initialized = True
+    with app.bot._unfrozen():
+        app.bot._bot_user = User(id=1, is_bot=True, first_name="shop", username="shop_bot")
+    server = WebhookServer(app, path="/telegram", secret="s3cret")
+    client = await client_for(server)
+    await app.start()
+    try:
+        async def replay(user_id: int):
+            statuses = []
+            for update_id in range(user_id, 500, 100):
+                response = await client.post(
+                    "/telegram", json=recorded_message(update_id, user_id),
+                    headers={WebhookServer.SECRET_HEADER: "s3cret"}
+                )
+                statuses.append(response.status)
+            return statuses
+
+        # اگر وب‌هوک منتظر هندلرها بماند، این burst هرگز تمام نمی‌شود
+        statuses = await asyncio.wait_for(asyncio.gather(*(replay(u) for u in range(100))), timeout=30)
+        await asyncio.sleep(0.05)
+
+        assert all(status == 200 for user in statuses for status in user)
+        assert server.received == 500
+        assert app.update_queue.qsize() == 0
+        assert processor.in_flight == 16 and processor.queued == 500 - 16
+
+        release.set()
+        for _ in range(500):
+            if processor.processed == 500:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        release.set()
+        await app.stop()
+        await client.close()
+
+    assert processor.get_stats()["processed"] == 500
+    assert processor.get_stats()["queued"] == 0
+    assert all(ids == sorted(ids) and len(ids) == 5 for ids in handled.values())
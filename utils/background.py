@@ -0,0 +1,52 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+class PeriodicTask:
+    """اجرای دوره‌ای یک تابع async در پس‌زمینه"""
+
+    def __init__(self, name: str, interval: float, func: Callable[[], Awaitable[None]],
+                 run_immediately: bool = True):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.run_immediately = run_immediately
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """شروع اجرای دوره‌ای"""
+        if not self.running:
+            self._task = asyncio.create_task(self._loop(), name=self.name)
+
+    async def stop(self):
+        """توقف اجرای دوره‌ای"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        if not self.run_immediately:
+            await asyncio.sleep(self.interval)
+        while True:
+            try:
+                await self.func()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # خطای یک دور نباید حلقه را متوقف کند
+                logger.error(f"Error in background task {self.name}: {e}")
+            await asyncio.sleep(self.interval)
+
+# نمونه استفاده
+# task = PeriodicTask("mirror_sync", 60, mirror.refresh)
+# task.start()
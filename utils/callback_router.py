@@ -0,0 +1,140 @@
+import re
+import time
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class Route:
+    """یک مسیر کالبک مثل "main_menu" یا "verify_payment_{payment_id:int}_{result}" """
+
+    PARAM_PATTERN = re.compile(r"\{(\w+)(?::(\w+))?\}")
+    CONVERTERS = {"int": int, "float": float, "str": str}
+
+    def __init__(self, pattern: str, handler: Callable[..., Awaitable[Any]]):
+        self.pattern = pattern
+        self.handler = handler
+        self.params: List[Tuple[str, Callable]] = []
+        self.separators: List[str] = []  # متن ثابت بعد از هر پارامتر
+
+        parts = self.PARAM_PATTERN.split(pattern)
+        # parts: [prefix, name1, type1, literal1, name2, type2, literal2, ...]
+        self.prefix = parts[0]
+        for i in range(1, len(parts), 3):
+            name, type_name, literal = parts[i], parts[i + 1] or "str", parts[i + 2]
+            if type_name not in self.CONVERTERS:
+                raise ValueError(f"Unknown converter '{type_name}' in route {pattern}")
+            if i + 3 < len(parts) and not literal:
+                raise ValueError(f"Parameters must be separated in route {pattern}")
+            self.params.append((name, self.CONVERTERS[type_name]))
+            self.separators.append(literal)
+
+    @property
+    def is_exact(self) -> bool:
+        return not self.params
+
+    def parse(self, remainder: str) -> Optional[Dict[str, Any]]:
+        """تبدیل بخش بعد از prefix به پارامترهای تایپ‌شده؛ None اگر مطابقت نداشت"""
+        values = {}
+        last = len(self.params) - 1
+        for index, (name, converter) in enumerate(self.params):
+            separator = self.separators[index]
+            if index == last:
+                if separator:
+                    if not remainder.endswith(separator):
+                        return None
+                    remainder = remainder[:-len(separator)]
+                raw, remainder = remainder, ""
+            else:
+                raw, found, remainder = remainder.partition(separator)
+                if not found:
+                    return None
+            if not raw:
+                return None
+            try:
+                values[name] = converter(raw)
+            except ValueError:
+                return None
+        return values
+
+class CallbackRouter:
+    """مسیریاب کالبک‌ها: جستجوی O(1) برای مسیرهای ثابت و trie برای مسیرهای پارامتردار"""
+
+    def __init__(self):
+        self._exact: Dict[str, Route] = {}
+        self._trie: Dict = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def add(self, pattern: str, handler: Callable[..., Awaitable[Any]]):
+        """ثبت مسیر جدید"""
+        route = Route(pattern, handler)
+        if route.is_exact:
+            self._exact[pattern] = route
+            return
+
+        node = self._trie
+        for char in route.prefix:
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append(route)
+
+    def match(self, data: str) -> Tuple[Optional[Route], Dict[str, Any]]:
+        """پیدا کردن مسیر و پارامترهای آن"""
+        route = self._exact.get(data)
+        if route:
+            return route, {}
+
+        # همه prefixهایی که data با آن‌ها شروع می‌شود؛ طولانی‌ترین اولویت دارد
+        candidates = []
+        node = self._trie
+        for index, char in enumerate(data):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                candidates.append((index + 1, node[None]))
+
+        for length, routes in reversed(candidates):
+            for route in routes:
+                params = route.parse(data[length:])
+                if params is not None:
+                    return route, params
+        return None, {}
+
+    async def dispatch(self, data: str, *args) -> bool:
+        """اجرای هندلر مسیر؛ False اگر مسیری پیدا نشد"""
+        route, params = self.match(data)
+        if route is None:
+            return False
+
+        stats = self._stats.setdefault(
+            route.pattern, {"count": 0, "errors": 0, "total_time": 0.0, "max_time": 0.0}
+        )
+        started = time.perf_counter()
+        try:
+            await route.handler(*args, **params)
+        except Exception:
+            stats["errors"] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            stats["count"] += 1
+            stats["total_time"] += elapsed
+            stats["max_time"] = max(stats["max_time"], elapsed)
+        return True
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """آمار تاخیر هر مسیر به میلی‌ثانیه"""
+        return {
+            pattern: {
+                "count": stats["count"],
+                "errors": stats["errors"],
+                "avg_ms": round(stats["total_time"] / stats["count"] * 1000, 2) if stats["count"] else 0.0,
+                "max_ms": round(stats["max_time"] * 1000, 2)
+            }
+            for pattern, stats in self._stats.items()
+        }
+
+# نمونه استفاده
+# router = CallbackRouter()
+# router.add("plan_{plan_id:int}", show_plan_details)
+# await router.dispatch("plan_12", query)
@@ -0,0 +1,120 @@
+import logging
+import random
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+def jittered_backoff(attempt: int, base: float, cap: float) -> float:
+    """تاخیر تصادفی (full jitter) با رشد نمایی؛ attempt از صفر شروع می‌شود"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class CircuitBreaker:
+    """Circuit breaker با حالت نیمه‌باز و زمان بازیابی تطبیقی
+
+    بعد از failure_threshold خطای پشت‌سرهم مدار باز می‌شود و درخواست‌ها بلافاصله
+    رد می‌شوند. پس از پایان زمان بازیابی، تعداد محدودی درخواست آزمایشی (half-open)
+    عبور می‌کنند؛ موفقیت مدار را می‌بندد و شکست، زمان بازیابی را دو برابر می‌کند.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30,
+                 max_recovery_timeout: float = 300, half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.max_recovery_timeout = max_recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.total_failures = 0
+        self.total_successes = 0
+        self.rejected_calls = 0
+        self.open_count = 0
+        self.last_failure_at: Optional[float] = None
+        self._trips = 0  # تعداد باز شدن‌های پشت‌سرهم (برای backoff تطبیقی)
+        self._retry_at = 0.0
+        self._half_open_calls = 0
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"Circuit breaker '{self.name}': {self.state} -> {state}")
+            self.state = state
+
+    def allow_request(self) -> bool:
+        """آیا درخواست اجازه عبور دارد؟"""
+        if self.state == self.OPEN:
+            if time.monotonic() < self._retry_at:
+                self.rejected_calls += 1
+                return False
+            self._set_state(self.HALF_OPEN)
+            self._half_open_calls = 0
+
+        if self.state == self.HALF_OPEN:
+            if self._half_open_calls >= self.half_open_max_calls:
+                self.rejected_calls += 1
+                return False
+            self._half_open_calls += 1
+
+        return True
+
+    def release(self):
+        """آزاد کردن سهمیه درخواستی که بدون نتیجه (مثلاً با لغو) تمام شد"""
+        if self.state == self.HALF_OPEN and self._half_open_calls > 0:
+            self._half_open_calls -= 1
+
+    def record_success(self):
+        """ثبت درخواست موفق
+
+        فقط موفقیت در حالت بسته یا نیمه‌باز اثر دارد. جواب دیررسِ درخواستی که پیش
+        از باز شدن مدار فرستاده شده بود، مدار باز را نمی‌بندد.
+        """
+        self.total_successes += 1
+        if self.state == self.OPEN:
+            return
+        self.consecutive_failures = 0
+        if self.state == self.HALF_OPEN:
+            self._trips = 0
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        """ثبت درخواست ناموفق"""
+        self.total_failures += 1
+        self.consecutive_failures += 1
+        self.last_failure_at = time.time()
+
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        # زمان بازیابی با هر شکست آزمایشی دو برابر می‌شود و کمی jitter می‌گیرد
+        # تا چند نمونه ربات همزمان به پنل هجوم نیاورند
+        timeout = min(self.max_recovery_timeout, self.recovery_timeout * (2 ** self._trips))
+        timeout *= random.uniform(0.8, 1.2)
+        self._trips += 1
+        self.open_count += 1
+        self._retry_at = time.monotonic() + timeout
+        self._set_state(self.OPEN)
+
+    def get_stats(self) -> dict:
+        """آمار و وضعیت فعلی مدار"""
+        retry_in = max(0.0, self._retry_at - time.monotonic()) if self.state == self.OPEN else 0.0
+        return {
+            "name": self.name,
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "total_failures": self.total_failures,
+            "total_successes": self.total_successes,
+            "rejected_calls": self.rejected_calls,
+            "open_count": self.open_count,
+            "last_failure_at": self.last_failure_at,
+            "retry_in": round(retry_in, 1)
+        }
+
+# نمونه استفاده
+# breaker = CircuitBreaker("hiddify", failure_threshold=5)
+# if breaker.allow_request(): ...
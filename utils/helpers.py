@@ -1,8 +1,8 @@
 import uuid
 import random
 import string
-from datetime import datetime, timedelta
-from typing import Optional
+from datetime import date, datetime, time, timedelta
+from typing import Optional, Tuple
 
 class Helpers:
     @staticmethod
@@ -21,6 +21,11 @@ class Helpers:
         """فرمت قیمت به صورت خوانا"""
         return f"{int(price):,} تومان"
     
+    @staticmethod
+    def to_toman(amount: float) -> int:
+        """تبدیل مبلغ به تومان صحیح (برای دفتر کل کیف پول)"""
+        return int(round(amount or 0))
+    
     @staticmethod
     def format_traffic(traffic_gb: float) -> str:
         """فرمت ترافیک"""
@@ -54,6 +59,13 @@ class Helpers:
     def is_expired(expiry_date: datetime) -> bool:
         """بررسی انقضای سرویس"""
         return datetime.now() > expiry_date
+    
+    @staticmethod
+    def day_bounds(day: Optional[date] = None) -> Tuple[datetime, datetime]:
+        """بازه [شروع روز، شروع روز بعد) برای فیلترهایی که از ایندکس created_at استفاده کنند"""
+        day = day or datetime.now().date()
+        start = datetime.combine(day, time.min)
+        return start, start + timedelta(days=1)
 
 # نمونه استفاده
 # code = Helpers.generate_referral_code()
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Tuple
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+class IndexAdvisor:
+    """ثبت کوئری‌های SELECT اجرا شده و بررسی plan آن‌ها با EXPLAIN
+
+    پیمایش کامل جدول (SCAN در SQLite، Seq Scan در PostgreSQL و type=ALL در
+    MySQL) گزارش می‌شود. شمارش کل جدول بدون WHERE ذاتاً پیمایش کامل است و
+    باید جداگانه قضاوت شود.
+    """
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.queries: Dict[str, Tuple[Any, ...]] = {}  # متن کوئری -> پارامترهای نمونه
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith("SELECT"):
+            self.queries.setdefault(statement, parameters)
+
+    def start(self):
+        """شروع ثبت کوئری‌ها"""
+        event.listen(self.engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def stop(self):
+        """توقف ثبت کوئری‌ها"""
+        event.remove(self.engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    async def analyze(self) -> List[dict]:
+        """اجرای EXPLAIN روی همه کوئری‌های ثبت‌شده"""
+        report = []
+        async with self.engine.connect() as conn:
+            for statement, parameters in self.queries.items():
+                try:
+                    full_scans, plan = await conn.run_sync(self._explain, statement, parameters)
+                except Exception as e:
+                    logger.warning(f"EXPLAIN failed: {e}")
+                    continue
+                report.append({
+                    "statement": " ".join(statement.split()),
+                    "full_scans": full_scans,
+                    "plan": plan
+                })
+        return report
+
+    def _explain(self, connection, statement: str, parameters) -> Tuple[List[str], List[str]]:
+        dialect = connection.dialect.name
+        if dialect == "sqlite":
+            rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+            plan = [row[-1] for row in rows]
+            # "SCAN users" پیمایش کامل است؛ "SCAN users USING INDEX ..." نیست
+            full_scans = [step for step in plan if step.startswith("SCAN") and " USING " not in step]
+            return full_scans, plan
+
+        if dialect == "postgresql":
+            raw = connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()
+            root = json.loads(raw) if isinstance(raw, str) else raw
+            plan, full_scans = [], []
+            stack = [root[0]["Plan"]]
+            while stack:
+                node = stack.pop()
+                step = f"{node['Node Type']} {node.get('Relation Name', '')}".strip()
+                plan.append(step)
+                if node["Node Type"] == "Seq Scan":
+                    full_scans.append(step)
+                stack.extend(node.get("Plans", []))
+            return full_scans, plan
+
+        rows = connection.exec_driver_sql("EXPLAIN " + statement, parameters).mappings().fetchall()
+        plan = [str(dict(row)) for row in rows]
+        full_scans = [f"ALL {row.get('table')}" for row in rows if row.get("type") == "ALL"]
+        return full_scans, plan
+
+    @staticmethod
+    def format_report(report: List[dict]) -> str:
+        """متن خوانا از گزارش؛ کوئری‌های دارای پیمایش کامل اول می‌آیند"""
+        lines = []
+        for item in sorted(report, key=lambda r: not r["full_scans"]):
+            flag = "FULL SCAN" if item["full_scans"] else "ok"
+            lines.append(f"[{flag}] {item['statement']}")
+            for step in item["full_scans"]:
+                lines.append(f"    -> {step}")
+        return "\n".join(lines)
+
+async def _run_manager_queries(db):
+    """اجرای کوئری‌های خواندنی مدیرها با شناسه‌های نمونه"""
+    from modules.user_manager import UserManager
+    from modules.plan_manager import PlanManager
+    from modules.payment_manager import PaymentManager
+    from modules.referral import ReferralManager
+    from modules.agent_manager import AgentManager
+    from modules.discount_manager import DiscountManager
+    from modules.wallet import WalletManager
+    from modules.admin.stats_admin import StatsAdmin
+    from utils.pagination import Keyset
+
+    # صفحه‌های بعد از اول شرط keyset دارند و plan جداگانه‌ای می‌گیرند
+    cursor = Keyset.encode(1)
+
+    users = UserManager(db)
+    await users.get_user_by_telegram_id(1)
+    await users.get_user_by_referral_code("SAMPLE")
+    await users.get_hiddify_user_link(1)
+    await users.get_all_users()
+    await users.get_all_users(cursor=cursor)
+
+    plans = PlanManager(db)
+    await plans.get_plan_by_id(1)
+    await plans.get_all_plans()
+
+    payments = PaymentManager(db)
+    await payments.get_user_payments(1)
+    await payments.get_pending_payments()
+    await payments.get_pending_payments(cursor=cursor)
+    await payments.get_recent_payments(cursor=cursor)
+    await payments.get_payment_by_transaction_id("SAMPLE")
+
+    referrals = ReferralManager(db)
+    await referrals.get_user_referrals(1)
+    await referrals.get_user_referrals(1, cursor=cursor)
+    await referrals.get_referral_by_users(1, 2)
+    await referrals.get_pending_commissions()
+
+    agents = AgentManager(db)
+    await agents.get_user_agent_request(1)
+    await agents.get_pending_requests()
+    await agents.get_pending_requests(cursor=cursor)
+
+    discounts = DiscountManager(db)
+    await discounts.get_discount_by_code("SAMPLE")
+    await discounts.get_all_discounts(cursor=cursor)
+    await WalletManager(db).get_user_wallet_balance(1)
+
+    stats = StatsAdmin(db)
+    await stats.get_system_stats()
+    await stats.get_recent_payments()
+
+async def main():
+    from database import engine, AsyncSessionLocal
+
+    advisor = IndexAdvisor(engine)
+    advisor.start()
+    try:
+        async with AsyncSessionLocal() as db:
+            await _run_manager_queries(db)
+            await db.rollback()
+    finally:
+        advisor.stop()
+
+    print(IndexAdvisor.format_report(await advisor.analyze()))
+    await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
+
+# نمونه استفاده
+# python -m utils.index_advisor
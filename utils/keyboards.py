@@ -1,7 +1,17 @@
+from functools import lru_cache
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from utils.helpers import Helpers
 
 class Keyboards:
+    # کیبوردها فقط به چند ورودی ساده وابسته‌اند و InlineKeyboardMarkup تغییرناپذیر است،
+    # پس نمونه‌های ساخته‌شده بین کالبک‌ها به اشتراک گذاشته می‌شوند.
+    # کیبوردهای ناوبری ادمین cursor صفحه بعد را دارند و تقریباً هیچ‌وقت تکرار نمی‌شوند، پس کش نمی‌شوند.
+    
+    # آخرین لیست پلن‌ها به صورت (version کاتالوگ، کیبورد)
+    _plans_list_cache = None
+    
     @staticmethod
+    @lru_cache(maxsize=4)
     def main_menu(is_admin=False):
         """منوی اصلی"""
         buttons = [
@@ -21,6 +31,7 @@ class Keyboards:
         return InlineKeyboardMarkup(buttons)
     
     @staticmethod
+    @lru_cache(maxsize=1)
     def shop_menu():
         """منوی فروشگاه"""
         return InlineKeyboardMarkup([
@@ -30,6 +41,7 @@ class Keyboards:
         ])
     
     @staticmethod
+    @lru_cache(maxsize=1)
     def admin_menu():
         """منوی ادمین"""
         return InlineKeyboardMarkup([
@@ -44,8 +56,12 @@ class Keyboards:
         ])
     
     @staticmethod
-    def plans_list(plans):
-        """لیست پلن‌های فعال"""
+    def plans_list(plans, version: int = None):
+        """لیست پلن‌های فعال (با دادن version کاتالوگ، کیبورد تا تغییر کاتالوگ کش می‌شود)"""
+        cached = Keyboards._plans_list_cache
+        if version is not None and cached is not None and cached[0] == version:
+            return cached[1]
+        
         buttons = []
         for plan in plans:
             button = InlineKeyboardButton(
@@ -55,9 +71,13 @@ class Keyboards:
             buttons.append([button])
         
         buttons.append([InlineKeyboardButton("🏠 بازگشت", callback_data="shop")])
-        return InlineKeyboardMarkup(buttons)
+        keyboard = InlineKeyboardMarkup(buttons)
+        if version is not None:
+            Keyboards._plans_list_cache = (version, keyboard)
+        return keyboard
     
     @staticmethod
+    @lru_cache(maxsize=256)
     def plan_actions(plan_id):
         """عملیات پلن (خرید)"""
         return InlineKeyboardMarkup([
@@ -66,6 +86,7 @@ class Keyboards:
         ])
     
     @staticmethod
+    @lru_cache(maxsize=1)
     def payment_methods():
         """روش‌های پرداخت"""
         return InlineKeyboardMarkup([
@@ -76,6 +97,7 @@ class Keyboards:
         ])
     
     @staticmethod
+    @lru_cache(maxsize=1)
     def confirm_payment():
         """تایید پرداخت (برای پرداخت‌های دستی)"""
         return InlineKeyboardMarkup([
@@ -84,6 +106,7 @@ class Keyboards:
         ])
     
     @staticmethod
+    @lru_cache(maxsize=1)
     def back_to_main():
         """دکمه بازگشت به منوی اصلی"""
         return InlineKeyboardMarkup([
@@ -91,6 +114,7 @@ class Keyboards:
         ])
     
     @staticmethod
+    @lru_cache(maxsize=1)
     def admin_back_menu():
         """دکمه‌های بازگشت در بخش ادمین"""
         return InlineKeyboardMarkup([
@@ -100,6 +124,7 @@ class Keyboards:
     
     # --- کیبوردهای مخصوص بخش مدیریت پلن‌ها (Admin Plans) ---
     @staticmethod
+    @lru_cache(maxsize=256)
     def admin_plans_navigation(page: int, total_pages: int):
         """ناوبری صفحات پلن‌ها در پنل ادمین"""
         buttons = []
@@ -123,6 +148,7 @@ class Keyboards:
         return InlineKeyboardMarkup(buttons)
     
     @staticmethod
+    @lru_cache(maxsize=1)
     def admin_back_to_plans():
         """بازگشت به مدیریت پلن‌ها"""
         return InlineKeyboardMarkup([
@@ -132,16 +158,16 @@ class Keyboards:
 
     # --- کیبوردهای مخصوص بخش مدیریت کاربران (Admin Users) ---
     @staticmethod
-    def admin_users_navigation(page: int, total_pages: int):
-        """ناوبری صفحات کاربران در پنل ادمین"""
+    def admin_users_navigation(page: int, next_cursor: str = None):
+        """ناوبری صفحات کاربران در پنل ادمین (cursor صفحه بعد در callback_data)"""
         buttons = []
         
         # دکمه‌های صفحه‌بندی
         nav_buttons = []
         if page > 1:
-            nav_buttons.append(InlineKeyboardButton("◀ قبلی", callback_data=f"admin_users_page_{page-1}"))
-        if page < total_pages:
-            nav_buttons.append(InlineKeyboardButton("بعدی ▶", callback_data=f"admin_users_page_{page+1}"))
+            nav_buttons.append(InlineKeyboardButton("⏮ صفحه اول", callback_data="admin_users"))
+        if next_cursor:
+            nav_buttons.append(InlineKeyboardButton("بعدی ▶", callback_data=f"admin_users_page_{page+1}_{next_cursor}"))
         
         if nav_buttons:
             buttons.append(nav_buttons)
@@ -155,6 +181,7 @@ class Keyboards:
         return InlineKeyboardMarkup(buttons)
     
     @staticmethod
+    @lru_cache(maxsize=1)
     def admin_back_to_users():
         """بازگشت به مدیریت کاربران"""
         return InlineKeyboardMarkup([
@@ -164,8 +191,8 @@ class Keyboards:
 
     # --- کیبوردهای مخصوص بخش مدیریت پرداخت‌ها (Admin Payments) ---
     @staticmethod
-    def admin_payments_navigation(page: int, total_pages: int, status: str = "all"):
-        """ناوبری صفحات پرداخت‌ها در پنل ادمین"""
+    def admin_payments_navigation(page: int, next_cursor: str = None, status: str = "all"):
+        """ناوبری صفحات پرداخت‌ها در پنل ادمین (cursor صفحه بعد در callback_data)"""
         buttons = []
         
         # دکمه‌های فیلتر
@@ -178,9 +205,9 @@ class Keyboards:
         # دکمه‌های صفحه‌بندی
         nav_buttons = []
         if page > 1:
-            nav_buttons.append(InlineKeyboardButton("◀ قبلی", callback_data=f"admin_payments_page_{page-1}_{status}"))
-        if page < total_pages:
-            nav_buttons.append(InlineKeyboardButton("بعدی ▶", callback_data=f"admin_payments_page_{page+1}_{status}"))
+            nav_buttons.append(InlineKeyboardButton("⏮ صفحه اول", callback_data=f"admin_payments_{status}"))
+        if next_cursor:
+            nav_buttons.append(InlineKeyboardButton("بعدی ▶", callback_data=f"admin_payments_page_{page+1}_{status}_{next_cursor}"))
         
         if nav_buttons:
             buttons.append(nav_buttons)
@@ -191,6 +218,7 @@ class Keyboards:
         return InlineKeyboardMarkup(buttons)
     
     @staticmethod
+    @lru_cache(maxsize=1)
     def admin_back_to_payments():
         """بازگشت به مدیریت پرداخت‌ها"""
         return InlineKeyboardMarkup([
@@ -200,16 +228,16 @@ class Keyboards:
 
     # --- کیبوردهای مخصوص بخش مدیریت کدهای تخفیف (Admin Discounts) ---
     @staticmethod
-    def admin_discounts_navigation(page: int, total_pages: int):
-        """ناوبری صفحات کدهای تخفیف در پنل ادمین"""
+    def admin_discounts_navigation(page: int, next_cursor: str = None):
+        """ناوبری صفحات کدهای تخفیف در پنل ادمین (cursor صفحه بعد در callback_data)"""
         buttons = []
         
         # دکمه‌های صفحه‌بندی
         nav_buttons = []
         if page > 1:
-            nav_buttons.append(InlineKeyboardButton("◀ قبلی", callback_data=f"admin_discounts_page_{page-1}"))
-        if page < total_pages:
-            nav_buttons.append(InlineKeyboardButton("بعدی ▶", callback_data=f"admin_discounts_page_{page+1}"))
+            nav_buttons.append(InlineKeyboardButton("⏮ صفحه اول", callback_data="admin_discount"))
+        if next_cursor:
+            nav_buttons.append(InlineKeyboardButton("بعدی ▶", callback_data=f"admin_discounts_page_{page+1}_{next_cursor}"))
         
         if nav_buttons:
             buttons.append(nav_buttons)
@@ -223,6 +251,7 @@ class Keyboards:
         return InlineKeyboardMarkup(buttons)
     
     @staticmethod
+    @lru_cache(maxsize=1)
     def admin_back_to_discounts():
         """بازگشت به مدیریت کدهای تخفیف"""
         return InlineKeyboardMarkup([
@@ -232,16 +261,30 @@ class Keyboards:
 
     # --- کیبوردهای مخصوص بخش درخواست نمایندگی ---
     @staticmethod
+    def admin_agent_requests_navigation(page: int, next_cursor: str = None):
+        """ناوبری صفحات درخواست‌های نمایندگی در انتظار"""
+        buttons = []
+        
+        # دکمه‌های صفحه‌بندی
+        nav_buttons = []
+        if page > 1:
+            nav_buttons.append(InlineKeyboardButton("⏮ صفحه اول", callback_data="admin_agent_requests"))
+        if next_cursor:
+            nav_buttons.append(InlineKeyboardButton("بعدی ▶", callback_data=f"admin_agent_requests_page_{page+1}_{next_cursor}"))
+        
+        if nav_buttons:
+            buttons.append(nav_buttons)
+        
+        # دکمه بازگشت
+        buttons.append([InlineKeyboardButton("🏠 بازگشت", callback_data="admin_panel")])
+        
+        return InlineKeyboardMarkup(buttons)
+    
+    @staticmethod
+    @lru_cache(maxsize=1)
     def confirm_agent_request():
         """تایید ارسال درخواست نمایندگی مجدد"""
         return InlineKeyboardMarkup([
             [InlineKeyboardButton("✅ ارسال درخواست جدید", callback_data="submit_agent_request")],
             [InlineKeyboardButton("🏠 بازگشت", callback_data="main_menu")]
         ])
-
-# نکته: کلاس Helpers باید در utils/helpers.py تعریف شده باشد تا توابع فرمت‌بندی کار کنند.
-# اگر نیست، باید از توابع ساده‌تر استفاده کنید یا کلاس Helpers را اضافه کنید.
-# برای مثال:
-# from utils.helpers import Helpers 
-# باید در بالای این فایل ایمپورت شود یا توابع فرمت‌بندی را مستقیم در اینجا تعریف کنید.
-# برای سادگی، من فرض می‌کنم Helpers در دسترس است. در غیر این صورت باید تغییر داده شود.
@@ -0,0 +1,85 @@
+import logging
+from typing import Any, Callable, Iterable, Optional
+from sqlalchemy import select, tuple_
+from sqlalchemy.sql import Select
+
+logger = logging.getLogger(__name__)
+
+class Page(list):
+    """یک صفحه از نتایج به همراه cursor صفحه بعد (None یعنی صفحه آخر)
+
+    چون از list ارث می‌برد، کدهایی که خروجی را فقط پیمایش یا شمارش می‌کنند
+    بدون تغییر کار می‌کنند.
+    """
+
+    def __init__(self, items: Iterable = (), next_cursor: Optional[str] = None):
+        super().__init__(items)
+        self.next_cursor = next_cursor
+
+class Keyset:
+    """صفحه‌بندی keyset روی (created_at, id) به ترتیب نزولی
+
+    به جای OFFSET که همه ردیف‌های صفحه‌های قبل را می‌خواند، کوئری از آخرین
+    ردیف صفحه قبل ادامه می‌دهد و هزینه هر صفحه مستقل از شماره آن است. cursor
+    فقط id آخرین ردیف است تا در callback_data تلگرام (حداکثر ۶۴ بایت) جا شود.
+
+    created_at ردیف cursor با یک زیرکوئری روی کلید اصلی از خود جدول خوانده
+    می‌شود، نه به صورت datetime پایتون bind. SQLite زمان پیش‌فرض را به شکل
+    'YYYY-MM-DD HH:MM:SS' ذخیره می‌کند ولی datetime با میکروثانیه bind می‌شود و
+    مقایسه رشته‌ای، ردیف‌های همان ثانیه را دوباره برمی‌گرداند؛ مقایسه ستون با
+    مقدار ذخیره‌شده خودش در هر دیالکتی درست است.
+    """
+
+    @classmethod
+    def encode(cls, row_id: int) -> str:
+        """ساخت cursor از id آخرین ردیف صفحه"""
+        return str(row_id)
+
+    @classmethod
+    def decode(cls, cursor: Optional[str]) -> Optional[int]:
+        """خواندن cursor؛ برای cursor خالی یا نامعتبر None (یعنی صفحه اول)"""
+        if not cursor:
+            return None
+        if not cursor.isdigit():
+            logger.debug(f"Invalid pagination cursor: {cursor!r}")
+            return None
+        return int(cursor)
+
+    @classmethod
+    def apply(cls, statement: Select, created_column, id_column,
+              cursor: Optional[str], per_page: int) -> Select:
+        """افزودن شرط بعد از cursor، ترتیب و limit به کوئری
+
+        یک ردیف بیشتر خوانده می‌شود تا بدون COUNT معلوم شود صفحه بعدی هست یا نه.
+        اگر ردیف cursor در این فاصله حذف شده باشد صفحه خالی برمی‌گردد.
+        """
+        row_id = cls.decode(cursor)
+        if row_id is not None:
+            created_at = (
+                select(created_column)
+                .where(id_column == row_id)
+                .correlate(None)
+                .scalar_subquery()
+            )
+            statement = statement.where(tuple_(created_column, id_column) < tuple_(created_at, row_id))
+        return (
+            statement
+            .order_by(created_column.desc(), id_column.desc())
+            .limit(per_page + 1)
+        )
+
+    @classmethod
+    def page(cls, rows: Iterable, per_page: int,
+             key: Callable[[Any], int] = None) -> Page:
+        """ساخت Page از ردیف‌های کوئری apply؛ key id هر ردیف را می‌دهد"""
+        rows = list(rows)
+        if len(rows) <= per_page:
+            return Page(rows)
+        rows = rows[:per_page]
+        key = key or (lambda row: row.id)
+        return Page(rows, cls.encode(key(rows[-1])))
+
+# نمونه استفاده
+# statement = Keyset.apply(select(User), User.created_at, User.id, cursor, 20)
+# users = Keyset.page((await db.execute(statement)).scalars(), 20)
+# next_cursor = users.next_cursor
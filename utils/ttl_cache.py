@@ -0,0 +1,92 @@
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+class TTLCache:
+    """کش LRU با زمان انقضای جداگانه برای هر ورودی
+
+    get/set/pop همه O(1) هستند. با پر شدن ظرفیت، کم‌استفاده‌ترین ورودی حذف
+    می‌شود، پس حافظه حداکثر maxsize ورودی است. ورودی منقضی در اولین دسترسی
+    یا در purge_expired پاک می‌شود.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # کلید -> (زمان انقضا، مقدار)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """مقدار کلید؛ default اگر نبود یا منقضی شده بود"""
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """ذخیره مقدار؛ ttl خالی یعنی ttl پیش‌فرض کش"""
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """حذف کلید و برگرداندن مقدار آن"""
+        item = self._data.pop(key, None)
+        if item is None or item[0] <= time.monotonic():
+            return default
+        return item[1]
+
+    def purge_expired(self) -> int:
+        """حذف همه ورودی‌های منقضی؛ تعداد حذف‌شده برگردانده می‌شود"""
+        now = time.monotonic()
+        expired = [key for key, (expires_at, _) in self._data.items() if expires_at <= now]
+        for key in expired:
+            del self._data[key]
+        self.expirations += len(expired)
+        return len(expired)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and item[0] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_stats(self) -> dict:
+        """آمار اندازه و نرخ برخورد"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+# نمونه استفاده
+# cache = TTLCache(maxsize=10000, ttl=1800)
+# cache.set(user_id, "awaiting_agent_request_data")
+# state = cache.get(user_id)